@@ -0,0 +1,303 @@
+#!/usr/bin/python
+########################################################################################################################
+#
+#  Lemma Logic LLC
+#  __________________
+#
+# Copyright 2018 Lemma Logic LLC
+# All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+########################################################################################################################
+"""Measures the throughput and latency of ird endpoints.
+
+Requests go through the Flask test client in the benchmark process (wsgi), or over HTTP to a server started in the
+benchmark process or already running at --url (http).  The in-process server talks to MySQL, or to a SQLite stand-in
+when --database standin is used.  Results are written as JSON so runs can be compared with --compare."""
+import argparse, atexit, base64, datetime, json, logging, math, os, platform, subprocess, sys, tempfile, threading, time
+try:
+    import httplib
+except ImportError:
+    import http.client as httplib
+try:
+    from urlparse import urlparse
+except ImportError:
+    from urllib.parse import urlparse
+
+this_directory = os.path.abspath(os.path.dirname(__file__))
+ird_directory = os.path.join(os.path.dirname(this_directory), "ird")
+default_config = os.path.join(this_directory, "benchmark.json")
+
+clock = getattr(time, "perf_counter", time.time)
+
+def basicAuth(username, password):
+    credentials = base64.b64encode(("%s:%s" % (username, password)).encode("utf-8")).decode("ascii")
+    return "Basic " + credentials
+
+ADMIN = basicAuth("admin", "admin password")
+SENSOR = basicAuth("sensor-account", "sensor password")
+
+class Scenario(object):
+    def __init__(self, name, method, path, authorization, body=None):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.body = None if body is None else json.dumps(body).encode("utf-8")
+        self.headers = {"Authorization": authorization, "Accept": "application/json"}
+        if self.body is not None:
+            self.headers["Content-Type"] = "application/json"
+
+def createScenarios(bulk_size):
+    return [Scenario("get-small", "GET", "/sensor-event", ADMIN),
+            Scenario("get-large", "GET", "/sensor-event-all", ADMIN),
+            Scenario("put-single", "PUT", "/sensor-event", SENSOR, {"RAW_VALUE": 0.77}),
+            Scenario("post-bulk", "POST", "/sensor-event-bulk", SENSOR, [{"RAW_VALUE": 0.77}] * bulk_size)]
+
+class WsgiClient(object):
+    def __init__(self, app):
+        self._client = app.test_client()
+
+    def request(self, method, path, body, headers):
+        response = self._client.open(path, method=method, data=body, headers=headers)
+        size = len(response.get_data())
+        response.close()
+        return response.status_code, size
+
+    def close(self):
+        pass
+
+class HttpClient(object):
+    def __init__(self, host, port):
+        self._connection = httplib.HTTPConnection(host, port, timeout=60)
+
+    def request(self, method, path, body, headers):
+        self._connection.request(method, path, body, headers)
+        response = self._connection.getresponse()
+        size = len(response.read())
+        return response.status, size
+
+    def close(self):
+        self._connection.close()
+
+def percentile(sorted_values, fraction):
+    """The nearest-rank percentile: the smallest value with at least fraction of the values at or below it."""
+    if not sorted_values:
+        return None
+    # Rounded first so 0.07 * 100 == 7.000000000000001 is rank 7, not 8.
+    index = max(0, int(math.ceil(round(fraction * len(sorted_values), 9))) - 1)
+    return sorted_values[min(index, len(sorted_values) - 1)]
+
+def summarize(scenario, concurrency, latencies, errors, elapsed, response_bytes):
+    latencies = sorted(latencies)
+    def milliseconds(value):
+        return None if value is None else round(value * 1000.0, 3)
+    return {"scenario": scenario.name,
+            "method": scenario.method,
+            "path": scenario.path,
+            "concurrency": concurrency,
+            "requests": len(latencies) + len(errors),
+            "errors": len(errors),
+            "error_statuses": sorted(set(errors)),
+            "seconds": round(elapsed, 3),
+            "throughput": round(len(latencies) / elapsed, 1) if elapsed > 0 else None,
+            "response_bytes": response_bytes,
+            "latency_ms": {"p50": milliseconds(percentile(latencies, 0.50)),
+                           "p95": milliseconds(percentile(latencies, 0.95)),
+                           "p99": milliseconds(percentile(latencies, 0.99)),
+                           "mean": milliseconds(sum(latencies) / len(latencies) if latencies else None),
+                           "max": milliseconds(latencies[-1] if latencies else None)}}
+
+def runScenario(create_client, scenario, concurrency, requests_per_worker, warmup):
+    """Runs requests_per_worker requests on each of concurrency threads, after warmup requests that are not timed."""
+    latencies = []
+    errors = []
+    response_bytes = [0]
+    lock = threading.Lock()
+    ready = threading.Semaphore(0)
+    start = threading.Event()
+
+    def worker():
+        client = create_client()
+        timings = []
+        failures = []
+        size = 0
+        try:
+            try:
+                for _ in range(warmup):
+                    client.request(scenario.method, scenario.path, scenario.body, scenario.headers)
+            finally:
+                ready.release()
+            start.wait()
+            for _ in range(requests_per_worker):
+                began = clock()
+                try:
+                    status, size = client.request(scenario.method, scenario.path, scenario.body, scenario.headers)
+                except Exception as err:
+                    status = type(err).__name__
+                if status in (200, 202):
+                    timings.append(clock() - began)
+                else:
+                    failures.append(status)
+        finally:
+            client.close()
+            with lock:
+                latencies.extend(timings)
+                errors.extend(failures)
+                response_bytes[0] = max(response_bytes[0], size)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for _ in threads:
+        ready.acquire()
+    began = clock()
+    start.set()
+    for thread in threads:
+        thread.join()
+    return summarize(scenario, concurrency, latencies, errors, clock() - began, response_bytes[0])
+
+def seed(client, rows):
+    """Inserts rows through the bulk endpoint so get-large has a table of known size to read."""
+    batch = 1000
+    for offset in range(0, rows, batch):
+        body = json.dumps([{"RAW_VALUE": 0.77}] * min(batch, rows - offset)).encode("utf-8")
+        status, _ = client.request("POST", "/sensor-event-bulk", body,
+                                   {"Authorization": SENSOR, "Content-Type": "application/json"})
+        if status not in (200, 202):
+            raise RuntimeError("Unable to seed the benchmark table, the server responded: " + str(status))
+
+def createApp(config):
+    sys.path.insert(0, ird_directory)
+    import ird
+    app = ird.create_app(config, "WARN")
+    logging.getLogger("werkzeug").setLevel(logging.WARN)
+    return app
+
+def startHttpServer(app):
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    class KeepAliveRequestHandler(WSGIRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+    httpd = make_server("127.0.0.1", 0, app, threaded=True, request_handler=KeepAliveRequestHandler)
+    thread = threading.Thread(target=httpd.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return httpd
+
+def gitCommit():
+    try:
+        with open(os.devnull, "w") as devnull:
+            return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=this_directory,
+                                           stderr=devnull).decode("ascii").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def printResult(result):
+    latency = result["latency_ms"]
+    print("%-10s c=%-3d %8s req/s  p50 %8s ms  p95 %8s ms  p99 %8s ms  errors %d" % (
+        result["scenario"], result["concurrency"], result["throughput"], latency["p50"], latency["p95"],
+        latency["p99"], result["errors"]))
+
+def change(current, previous):
+    if current is None or not previous:
+        return "     n/a"
+    return "%+7.1f%%" % ((current - previous) * 100.0 / previous)
+
+def compare(results, baseline_path):
+    with open(baseline_path, "r") as f:
+        baseline = json.load(f)
+    previous = {}
+    for result in baseline["results"]:
+        previous[(result["scenario"], result["concurrency"])] = result
+    print("Compared with " + baseline_path + " (commit " + str(baseline.get("commit")) + "):")
+    for result in results:
+        before = previous.get((result["scenario"], result["concurrency"]))
+        if before is None:
+            continue
+        print("%-10s c=%-3d throughput %s  p99 %s" % (
+            result["scenario"], result["concurrency"], change(result["throughput"], before["throughput"]),
+            change(result["latency_ms"]["p99"], before["latency_ms"]["p99"])))
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ird endpoints.")
+    parser.add_argument("--config", help="ird configuration file", type=str, default=default_config)
+    parser.add_argument("--transport", help="wsgi or http", choices=["wsgi", "http"], default="wsgi")
+    parser.add_argument("--database", help="mysql or a SQLite standin", choices=["mysql", "standin"], default="standin")
+    parser.add_argument("--url", help="benchmark a server that is already running, e.g. http://127.0.0.1:5000", type=str)
+    parser.add_argument("--concurrency", help="comma separated numbers of client threads", type=str, default="1,4,16")
+    parser.add_argument("--requests", help="timed requests per client thread", type=int, default=200)
+    parser.add_argument("--warmup", help="untimed requests per client thread", type=int, default=10)
+    parser.add_argument("--bulk-size", help="rows per post-bulk request", type=int, default=100)
+    parser.add_argument("--seed-rows", help="rows inserted before the GET scenarios", type=int, default=10000)
+    parser.add_argument("--scenarios", help="comma separated scenario names", type=str,
+                        default="get-small,get-large,put-single,post-bulk")
+    parser.add_argument("--output", help="results file", type=str,
+                        default="ird-benchmark-" + datetime.datetime.now().strftime("%Y%m%d-%H%M%S") + ".json")
+    parser.add_argument("--compare", help="an earlier results file to compare with", type=str)
+    args = parser.parse_args()
+
+    started = datetime.datetime.now().isoformat()
+    httpd = None
+    if args.url:
+        args.transport = "http"
+        url = urlparse(args.url)
+        create_client = lambda: HttpClient(url.hostname, url.port or 80)
+    else:
+        if args.database == "standin":
+            import standin
+            handle, path = tempfile.mkstemp(prefix="ird-benchmark-", suffix=".db")
+            os.close(handle)
+            standin.install(path)
+            atexit.register(standin.remove, path)
+        app = createApp(args.config)
+        if args.transport == "wsgi":
+            create_client = lambda: WsgiClient(app)
+        else:
+            httpd = startHttpServer(app)
+            create_client = lambda: HttpClient("127.0.0.1", httpd.server_port)
+
+    client = create_client()
+    try:
+        seed(client, args.seed_rows)
+    finally:
+        client.close()
+
+    scenarios = dict((scenario.name, scenario) for scenario in createScenarios(args.bulk_size))
+    results = []
+    try:
+        for name in args.scenarios.split(","):
+            for concurrency in [int(c) for c in args.concurrency.split(",")]:
+                result = runScenario(create_client, scenarios[name], concurrency, args.requests, args.warmup)
+                printResult(result)
+                results.append(result)
+    finally:
+        if httpd is not None:
+            httpd.shutdown()
+
+    report = {"started": started,
+              "commit": gitCommit(),
+              "python": platform.python_version(),
+              "platform": platform.platform(),
+              "transport": args.transport,
+              "database": "remote" if args.url else args.database,
+              "url": args.url,
+              "config": os.path.abspath(args.config),
+              "requests_per_thread": args.requests,
+              "bulk_size": args.bulk_size,
+              "seed_rows": args.seed_rows,
+              "results": results}
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print("Results written to " + args.output)
+    if args.compare:
+        compare(results, args.compare)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+########################################################################################################################
+#
+#  Lemma Logic LLC
+#  __________________
+#
+# Copyright 2018 Lemma Logic LLC
+# All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+########################################################################################################################
+"""A SQLite database that answers to mysql.connector.connect, so the benchmark can run without a MySQL server.
+
+The stand-in only covers the parts of the connector API that ird uses.  Queries are passed to SQLite as written, apart
+from the parameter markers, so benchmark queries have to stay within the SQL the two databases share."""
+import mysql.connector, os, re, sqlite3
+
+PARAMETER_PATTERN = re.compile(r"%\((\w+)\)s")
+
+def translate(query):
+    return PARAMETER_PATTERN.sub(r":\1", query).replace("%s", "?")
+
+def raiseAsMySqlError(err):
+    raise mysql.connector.DatabaseError(msg=str(err))
+
+class StandInCursor(object):
+    def __init__(self, connection):
+        self._connection = connection
+        self._cursor = connection._sqlite.cursor()
+        self.description = None
+        self.column_names = ()
+        self.with_rows = False
+        self.rowcount = -1
+        self.lastrowid = None
+
+    def _execute(self, query, parameters):
+        try:
+            self._cursor.execute(translate(query), parameters or ())
+        except sqlite3.Error as err:
+            self._connection.abortStatement()
+            raiseAsMySqlError(err)
+        self.description = self._cursor.description
+        self.column_names = tuple(column[0] for column in self.description or ())
+        self.with_rows = self.description is not None
+        self.rowcount = self._cursor.rowcount
+        self.lastrowid = self._cursor.lastrowid
+        self._connection.autoCommit()
+
+    def execute(self, query, parameters=None, multi=False):
+        if not multi:
+            return self._execute(query, parameters)
+        return self._executeEach([s for s in query.split(";") if s.strip()], parameters)
+
+    def _executeEach(self, statements, parameters):
+        # Like mysql.connector, each result is read through this cursor, which is yielded once per statement.
+        for statement in statements:
+            self._execute(statement, parameters)
+            yield self
+
+    def executemany(self, query, seq_parameters):
+        try:
+            self._cursor.executemany(translate(query), seq_parameters)
+        except sqlite3.Error as err:
+            self._connection.abortStatement()
+            raiseAsMySqlError(err)
+        self.rowcount = self._cursor.rowcount
+        self._connection.autoCommit()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def fetchmany(self, size=1):
+        return self._cursor.fetchmany(size)
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def close(self):
+        self._cursor.close()
+
+class StandInConnection(object):
+    def __init__(self, path, autocommit=False):
+        self._sqlite = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._sqlite.execute("PRAGMA synchronous = OFF")
+        self.autocommit = autocommit
+        self.in_transaction = False
+
+    def autoCommit(self):
+        if self.autocommit and not self.in_transaction:
+            self._sqlite.commit()
+
+    def abortStatement(self):
+        # A failed statement outside a transaction leaves nothing behind, as a failed multi-row INSERT does on MySQL.
+        if self.autocommit and not self.in_transaction:
+            self._sqlite.rollback()
+
+    def start_transaction(self):
+        self.in_transaction = True
+
+    def cursor(self, prepared=False, **kwargs):
+        return StandInCursor(self)
+
+    def commit(self):
+        self.in_transaction = False
+        self._sqlite.commit()
+
+    def rollback(self):
+        self.in_transaction = False
+        self._sqlite.rollback()
+
+    def ping(self, reconnect=False, **kwargs):
+        pass
+
+    def is_connected(self):
+        return True
+
+    def close(self):
+        self._sqlite.close()
+
+def createSchema(path):
+    connection = sqlite3.connect(path)
+    connection.execute("PRAGMA journal_mode = WAL")
+    connection.execute("CREATE TABLE IF NOT EXISTS SENSOR_EVENT ("
+                       "ID INTEGER PRIMARY KEY AUTOINCREMENT, "
+                       "RAW_VALUE REAL, "
+                       "EVENT_TIMESTAMP TIMESTAMP DEFAULT CURRENT_TIMESTAMP)")
+    connection.commit()
+    connection.close()
+
+def install(path):
+    """Routes every mysql.connector.connect call to the SQLite database file at path."""
+    createSchema(path)
+    mysql.connector.connect = lambda autocommit=False, **kwargs: StandInConnection(path, autocommit)
+
+def remove(path):
+    for name in [path, path + "-wal", path + "-shm"]:
+        if os.path.exists(name):
+            os.remove(name)
@@ -0,0 +1,829 @@
+#!/usr/bin/python3
+########################################################################################################################
+#
+#  Lemma Logic LLC
+#  __________________
+#
+# Copyright 2018 Lemma Logic LLC
+# All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+########################################################################################################################
+"""Serves the endpoints of an ird config file as an ASGI app, so a single process can wait on many queries at once.
+
+Request queries run on aiomysql connections.  Buffered writers, response caches, authentication and serialization
+are shared with ird.py, and so is the config file.  Requires Python 3.5 or later, aiomysql, and an ASGI server such as
+uvicorn:
+
+    ./ird/asgi.py --config example/example.json
+    IRD_CONFIG=example/example.json uvicorn --factory --app-dir ird asgi:create_asgi_app --workers 4
+"""
+import argparse, asyncio, collections, json, mysql.connector, os, sys, zlib
+from urllib.parse import parse_qsl
+from werkzeug.datastructures import Headers
+import aiomysql, pymysql
+from pymysql.constants import CLIENT
+import ird
+from ird import BulkLoad, ConnectionPoolTimeout, DatabaseCluster, EVENT_STREAM, IngestQueueFull, InvalidParameter, InvalidUpload, MissingParameter, PhaseTimer, QueryResult, StreamEncoder, TooManyRequests, TooManySubscribers, UploadTooLarge, clock, logger
+
+class AsyncConnectionPool(object):
+    """aiomysql connections for queries made while handling a request.  Like MySqlConnectionPool, connections are
+    opened lazily up to the pool size and a checkout waits up to checkout_timeout seconds before giving up."""
+    def __init__(self, host, database, user, password, size, pool_name, checkout_timeout=5.0, local_infile=False):
+        self._pool_name = pool_name
+        self._host = host
+        self._database = database
+        self._user = user
+        self._password = password
+        self._size = max(1, size)
+        self._checkout_timeout = checkout_timeout
+        self._local_infile = local_infile
+        self._pool = None
+        self._opening = None
+        self._checkouts = 0
+        self._timeouts = 0
+
+    @staticmethod
+    def createInstanceFromConfig(config, pool_name, local_infile=False):
+        return AsyncConnectionPool(config["database_ip_address"], config["database"], config["database_user"],
+                                   config["database_password"],
+                                   config.get("database_async_pool_size", config["database_pool_size"]),
+                                   pool_name, config.get("database_pool_timeout", 5.0), local_infile)
+
+    async def open(self):
+        if self._pool is not None:
+            return
+        if self._opening is None:
+            self._opening = asyncio.Lock()
+        async with self._opening:
+            if self._pool is None:
+                logger.info("Opening async connection pool " + self._pool_name + " to database: " + self._database + " at " + self._host)
+                self._pool = await aiomysql.create_pool(host=self._host, db=self._database, user=self._user,
+                                                        password=self._password, minsize=0, maxsize=self._size,
+                                                        autocommit=True, client_flag=CLIENT.MULTI_STATEMENTS,
+                                                        local_infile=self._local_infile)
+
+    async def checkout(self):
+        await self.open()
+        try:
+            connection = await asyncio.wait_for(self._pool.acquire(), self._checkout_timeout)
+        except asyncio.TimeoutError:
+            self._timeouts += 1
+            raise ConnectionPoolTimeout(self._pool_name)
+        self._checkouts += 1
+        return connection
+
+    def release(self, connection, broken=False):
+        # A connection with unread rows or a failed session can't be reused; the pool drops closed connections.
+        if broken:
+            connection.close()
+        self._pool.release(connection)
+
+    def getMetrics(self):
+        if self._pool is None:
+            return {"size": self._size, "open": 0, "idle": 0, "in_use": 0, "checkouts": self._checkouts, "timeouts": self._timeouts}
+        return {"size": self._size,
+                "open": self._pool.size,
+                "idle": self._pool.freesize,
+                "in_use": self._pool.size - self._pool.freesize,
+                "checkouts": self._checkouts,
+                "timeouts": self._timeouts}
+
+    async def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            await self._pool.wait_closed()
+            self._pool = None
+
+class AsyncAdmission(object):
+    """AdmissionControl for the event loop: requests wait for a turn on futures, first come first served, and the
+    counts are kept in the AdmissionControl so /metrics reads them the same way."""
+    def __init__(self, admission):
+        self._admission = admission
+        self._waiters = collections.deque()
+
+    async def enter(self):
+        admission = self._admission
+        while self._waiters and self._waiters[0].done():
+            self._waiters.popleft()
+        if admission.active < admission.max_concurrent and not self._waiters:
+            admission.active += 1
+            admission.counts["admitted"] += 1
+            return
+        if admission.waiting >= admission.max_queued:
+            admission.counts["rejected"] += 1
+            raise TooManyRequests("the server is busy")
+        admission.counts["queued"] += 1
+        admission.waiting += 1
+        turn = asyncio.get_event_loop().create_future()
+        self._waiters.append(turn)
+        try:
+            await asyncio.wait_for(turn, admission.queue_timeout)
+        except asyncio.TimeoutError:
+            # The turn may have been handed over just as the wait ran out.
+            if not turn.done() or turn.cancelled():
+                admission.counts["timeouts"] += 1
+                raise TooManyRequests("the server is busy")
+        finally:
+            admission.waiting -= 1
+        admission.counts["admitted"] += 1
+
+    def leave(self):
+        # Hand the turn straight to the next waiter that hasn't given up, so active stays the same.
+        while self._waiters:
+            turn = self._waiters.popleft()
+            if not turn.done():
+                turn.set_result(None)
+                return
+        self._admission.active -= 1
+
+class AsyncRequest(object):
+    """The parts of an HTTP request the endpoints use, read from an ASGI scope.  The body is only read once the request
+    has been authorized, with readBody or through a ReceiveStream."""
+    def __init__(self, scope, receive=None):
+        # WebSocket scopes have no method; the handshake is a GET.
+        self.method = scope.get("method", "GET")
+        self.path = scope["path"]
+        self.headers = Headers([(name.decode("latin-1"), value.decode("latin-1")) for name, value in scope["headers"]])
+        self.args = {}
+        for name, value in parse_qsl(scope.get("query_string", b"").decode("latin-1"), keep_blank_values=True):
+            # The first value wins, as with Flask's request.args.
+            self.args.setdefault(name, value)
+        self.receive = receive
+        self.body = b""
+        self.mimetype = self.headers.get("Content-Type", "").split(";")[0].strip().lower()
+        self.admitted = False
+
+    async def readBody(self, max_bytes):
+        """Reads the whole body into self.body, raising UploadTooLarge as soon as more than max_bytes arrive."""
+        chunks = []
+        size = 0
+        while True:
+            message = await self.receive()
+            chunk = message.get("body", b"")
+            size += len(chunk)
+            if size > max_bytes:
+                raise UploadTooLarge("the request body is larger than {} bytes".format(max_bytes))
+            chunks.append(chunk)
+            if not message.get("more_body", False):
+                self.body = b"".join(chunks)
+                return self.body
+
+class ReceiveStream(object):
+    """The body of an ASGI request as a file for code running on a worker thread: readline waits on the event loop
+    for the next chunk, so only one line is held in memory at a time.  More than max_bytes raises UploadTooLarge."""
+    def __init__(self, receive, loop, max_bytes):
+        self._receive = receive
+        self._loop = loop
+        self._max_bytes = max_bytes
+        self._buffer = b""
+        self._size = 0
+        self._more = True
+
+    def fill(self):
+        message = asyncio.run_coroutine_threadsafe(self._receive(), self._loop).result()
+        chunk = message.get("body", b"")
+        self._size += len(chunk)
+        if self._size > self._max_bytes:
+            raise UploadTooLarge("the upload is larger than {} bytes".format(self._max_bytes))
+        self._buffer += chunk
+        self._more = message.get("more_body", False)
+
+    def readline(self):
+        while self._more and b"\n" not in self._buffer:
+            self.fill()
+        end = self._buffer.find(b"\n") + 1 or len(self._buffer)
+        line, self._buffer = self._buffer[:end], self._buffer[end:]
+        return line
+
+class AsyncRestServer(object):
+    """The ASGI app.  Routes, users, caches and buffered writers come from an ird RestHttpServer built from the same
+    config; only the queries made while handling a request go through AsyncConnectionPools, which are grouped into
+    DatabaseClusters the same way as the server's pools."""
+    def __init__(self, server, cluster, shard_clusters=None):
+        self._server = server
+        self._cluster = cluster
+        self._shard_clusters = shard_clusters or {}
+        self._admission = AsyncAdmission(server.admission) if server.admission is not None else None
+
+    def getClusters(self):
+        clusters = [self._cluster]
+        for name in sorted(self._shard_clusters):
+            clusters.extend(self._shard_clusters[name])
+        return clusters
+
+    async def checkout(self, verb=None, shard=None):
+        """Returns a pool and a connection checked out of it, picked the way RestHttpServer.getConnection does."""
+        cluster = self._cluster if shard is None else self._shard_clusters[verb.shard.name][shard]
+        for pool in cluster.candidates(verb is not None and verb.reads):
+            try:
+                return pool, await pool.checkout()
+            except pymysql.err.MySQLError as err:
+                if pool is cluster.primary:
+                    raise
+                cluster.markDown(pool, err)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+        elif scope["type"] == "http":
+            await self.handle(scope, receive, send)
+        elif scope["type"] == "websocket":
+            await self.handleWebSocket(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                try:
+                    for cluster in self.getClusters():
+                        await cluster.primary.open()
+                except pymysql.err.MySQLError as err:
+                    await send({"type": "lifespan.startup.failed", "message": str(err)})
+                    return
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                for cluster in self.getClusters():
+                    for name, pool in cluster.getPools():
+                        await pool.close()
+                # Writers block while they flush, so stop them off the event loop.
+                await asyncio.get_event_loop().run_in_executor(None, self._server.shutdown)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def handle(self, scope, receive, send):
+        timer = PhaseTimer()
+        request = AsyncRequest(scope, receive)
+        if self._server.debug_sampler is not None:
+            self._server.debug_sampler.sample()
+        path = request.path.strip("/")
+        if path == "heartbeat":
+            return await self.sendResponse(send, request, self.heartbeat())
+        if path == "metrics" and self._server.request_metrics is not None:
+            return await self.sendResponse(send, request, ird.Response(self._server.renderMetrics(), content_type=ird.MetricsText.CONTENT_TYPE))
+        if path.endswith("/events") and request.method == "GET":
+            return await self.streamEvents(request, path[:-len("/events")], receive, send)
+        method = "GET" if request.method == "HEAD" else request.method
+        methods = self._server.getRoutes(path)
+        record = methods.get(method) if methods else None
+        try:
+            status_code = await self.respondTo(send, request, methods, record, timer)
+        finally:
+            # Streamed responses hold their turn until the last chunk is sent.
+            if request.admitted:
+                self._admission.leave()
+        if record is not None and record.metrics is not None:
+            record.metrics.observe(status_code, timer)
+
+    async def respondTo(self, send, request, methods, record, timer):
+        """Dispatches the request and sends its response, or the error response for what dispatching raised."""
+        try:
+            response = await self.dispatch(request, methods, record, timer)
+        except MissingParameter as error:
+            logger.warning("Request is missing parameter: {}".format(error))
+            response = ird.Response('Missing parameter: {}\n'.format(error), 400)
+        except InvalidParameter as error:
+            logger.warning("Request has an invalid parameter: {}".format(error))
+            response = ird.Response('Invalid parameter: {}\n'.format(error), 400)
+        except InvalidUpload as error:
+            logger.warning("Invalid upload: {}".format(error))
+            response = ird.Response('Invalid upload: {}\n'.format(error), 400)
+        except UploadTooLarge as error:
+            logger.warning("Upload too large: {}".format(error))
+            response = ird.Response('Upload too large: {}\n'.format(error), 413)
+        except IngestQueueFull as error:
+            logger.warning("Ingest queue is full: {}".format(error))
+            response = ird.Response('Too many pending writes.\nPlease retry your request', 503, {'Retry-After': '1'})
+        except TooManyRequests as error:
+            logger.warning("Too many requests: {}".format(error))
+            response = ird.respondTooManyRequests(error)
+        except ConnectionPoolTimeout:
+            response = ird.respondServiceUnavailable()
+        except (pymysql.err.MySQLError, mysql.connector.Error) as error:
+            # Rollups are read with the server's mysql.connector pool.
+            logger.error("Unable to connect to database: {}".format(error))
+            response = ird.respondServiceUnavailable()
+        except Exception:
+            logger.exception("Unable to handle request: " + request.path)
+            response = ird.Response('The server was unable to handle the request.\n', 500)
+        if isinstance(response, AsyncStream):
+            return await response.send(send, self._server.compressor, request)
+        return await self.sendResponse(send, request, response)
+
+    async def dispatch(self, request, methods, record, timer):
+        authorization = request.headers.get("Authorization")
+        began = clock()
+        user = self._server._authenticator.lookup(authorization)
+        if user is None and authorization:
+            # Password hashes are slow on purpose, so check them off the event loop.
+            user = await asyncio.get_event_loop().run_in_executor(None, self._server.authenticate, authorization)
+        timer.add("auth", clock() - began)
+        if not user:
+            return ird.respondInvalidCredentials()
+        self._server.admit(user, record)
+        if self._admission is not None and record is not None:
+            await self._admission.enter()
+            request.admitted = True
+        document = self._server.getDocument(request.path.strip("/"))
+        if document is not None:
+            return document.createResponse(request.headers.get("If-None-Match"))
+        if methods is None:
+            return ird.Response('The requested URL was not found on the server.\n', 404)
+        if record is None:
+            return ird.respondMethodNotAllowed(methods)
+        if not record.permits(user):
+            return ird.respondInvalidPermissions()
+        endpoint = self._server.getEndpoint(record.path)
+        if record.loads and request.mimetype in BulkLoad.FORMATS:
+            return self._server.finishWrite(record.path, await self.executeLoad(endpoint, request, timer))
+        await request.readBody(self._server.max_body_bytes)
+        body = self.parseBody(request)
+        if body is False:
+            return ird.Response('The request body could not be parsed.\n', 400)
+        if not record.writes:
+            return await self.executeGet(endpoint, request, body, timer)
+        return self._server.finishWrite(record.path, await self.executeWrite(endpoint, getattr(endpoint, record.method.lower() + "_verb"), request, body, timer))
+
+    async def subscribe(self, request, path):
+        """Returns a Subscription to the events of path, or the Response to send instead."""
+        server = self._server
+        authorization = request.headers.get("Authorization")
+        user = server._authenticator.lookup(authorization)
+        if user is None and authorization:
+            user = await asyncio.get_event_loop().run_in_executor(None, server.authenticate, authorization)
+        if not user:
+            return ird.respondInvalidCredentials()
+        try:
+            server.admit(user)
+        except TooManyRequests as error:
+            logger.warning("Too many requests: {}".format(error))
+            return ird.respondTooManyRequests(error)
+        methods = server.getRoutes(path)
+        if methods is None or "GET" not in methods or not server.broadcaster.publishes(path):
+            return ird.Response('The requested URL was not found on the server.\n', 404)
+        if not methods["GET"].permits(user):
+            return ird.respondInvalidPermissions()
+        try:
+            return server.broadcaster.subscribe(path)
+        except TooManySubscribers as error:
+            logger.warning("Too many event subscribers: {}".format(error))
+            return ird.Response('Too many event subscribers.\nPlease retry your request', 503, {'Retry-After': '5'})
+
+    async def streamEvents(self, request, path, receive, send):
+        subscription = await self.subscribe(request, path)
+        if not isinstance(subscription, ird.Subscription):
+            return await self.sendResponse(send, request, subscription)
+        headers = [("Content-Type", EVENT_STREAM), ("Cache-Control", "no-cache"), ("X-Accel-Buffering", "no")]
+        await send({"type": "http.response.start", "status": 200, "headers": encodeHeaders(Headers(headers))})
+        await send({"type": "http.response.body", "body": b"retry: 1000\n\n", "more_body": True})
+
+        async def deliver(events):
+            body = b"".join([event.sse for event in events]) if events else b": keep-alive\n\n"
+            await send({"type": "http.response.body", "body": body, "more_body": True})
+
+        await AsyncSubscriber(self._server.broadcaster, subscription).run(receive, deliver)
+        try:
+            await send({"type": "http.response.body", "body": b""})
+        except Exception:
+            pass
+
+    async def handleWebSocket(self, scope, receive, send):
+        """Sends the events of GET /<endpoint>/events as WebSocket text messages, one JSON object per event."""
+        message = await receive()
+        if message["type"] != "websocket.connect":
+            return
+        request = AsyncRequest(scope)
+        path = request.path.strip("/")
+        if not path.endswith("/events"):
+            return await send({"type": "websocket.close", "code": 1008})
+        subscription = await self.subscribe(request, path[:-len("/events")])
+        if not isinstance(subscription, ird.Subscription):
+            # Closing before accepting refuses the handshake with a 403.
+            return await send({"type": "websocket.close", "code": 1008})
+        await send({"type": "websocket.accept"})
+
+        async def deliver(events):
+            # WebSocket servers ping idle connections themselves, so there is nothing to send without events.
+            for event in events or ():
+                await send({"type": "websocket.send", "text": event.message})
+
+        await AsyncSubscriber(self._server.broadcaster, subscription).run(receive, deliver)
+        try:
+            await send({"type": "websocket.close", "code": 1001})
+        except Exception:
+            pass
+
+    def parseBody(self, request):
+        """Returns the parsed body, None if there is none, or False if it could not be parsed."""
+        adapter = self._server.format_adapters.forContentType(request.mimetype)
+        if adapter is None or not request.body:
+            return None
+        try:
+            return adapter.parse(request.body)
+        except Exception as err:
+            logger.warning("Unable to parse " + request.mimetype + " request body: {}".format(err))
+            return False
+
+    def merge(self, endpoint, verb, request, body, timer):
+        began = clock()
+        parameters = endpoint.merge(request.args, body, request.headers, verb)
+        timer.add("merge", clock() - began)
+        return parameters
+
+    def respond(self, endpoint, verb, status, data, timer, extra=None, adapter=None):
+        began = clock()
+        response = endpoint.respond(verb, status, data, extra, adapter)
+        timer.add("serialize", clock() - began)
+        return response
+
+    def createResponse(self, endpoint, status, status_code, timer, extra=None, adapter=None):
+        began = clock()
+        response = endpoint.createResponse(status, status_code, extra=extra, adapter=adapter)
+        timer.add("serialize", clock() - began)
+        return response
+
+    async def executeGet(self, endpoint, request, body, timer):
+        verb = endpoint.get_verb
+        parameters = self.merge(endpoint, verb, request, body, timer)
+        if verb.rollup is not None:
+            return await self.queryRollup(endpoint, verb, parameters, endpoint.negotiate(request.headers))
+        plan = verb.plan
+        if verb.pagination:
+            plan = verb.pagination.bind(parameters)
+        adapter = endpoint.negotiate(request.headers)
+        if verb.stream and plan.preparable:
+            return await self.streamGet(endpoint, verb, plan, parameters, adapter, timer)
+        if verb.cache:
+            key = adapter.mimetype + "\0" + verb.cache.createKey(plan, parameters)
+            entry = verb.cache.get(key)
+            if entry is None:
+                generation = verb.cache.getGeneration()
+                response = await self.queryGetOnce(endpoint, verb, plan, parameters, adapter, timer, key)
+                if response.status_code != 200:
+                    return response
+                entry = verb.cache.put(key, response.get_data(), response.mimetype, generation)
+            return entry.createResponse(request.headers.get("If-None-Match"))
+        return await self.queryGetOnce(endpoint, verb, plan, parameters, adapter, timer)
+
+    async def queryGetOnce(self, endpoint, verb, plan, parameters, adapter, timer, key=None):
+        """Like RestEndpoint.queryGetOnce, but waits for the running query on the event loop."""
+        single_flight = verb.single_flight
+        if single_flight is None:
+            return await self.queryGet(endpoint, verb, plan, parameters, adapter, timer)
+        key = key or adapter.mimetype + "\0" + plan.createKey(parameters)
+        flight, leader = single_flight.join(key)
+        if not leader:
+            loop = asyncio.get_event_loop()
+            landed = loop.create_future()
+            single_flight.onLanding(flight, lambda: loop.call_soon_threadsafe(lambda: landed.done() or landed.set_result(None)))
+            try:
+                await asyncio.wait_for(landed, single_flight.timeout)
+            except asyncio.TimeoutError:
+                single_flight.timedOut()
+            if flight.body is not None:
+                return flight.createResponse()
+            return await self.queryGet(endpoint, verb, plan, parameters, adapter, timer)
+        response = None
+        try:
+            response = await self.queryGet(endpoint, verb, plan, parameters, adapter, timer)
+        finally:
+            single_flight.land(key, flight, response)
+        return response
+
+    async def queryRollup(self, endpoint, verb, parameters, adapter):
+        # Checking out of the server's pool and reading the rollup both block, so neither runs on the event loop.
+        return await asyncio.get_event_loop().run_in_executor(None, self.readRollup, endpoint, verb, parameters, adapter)
+
+    def readRollup(self, endpoint, verb, parameters, adapter):
+        """Rollups are kept by the server's own threads, so they are read on a worker thread with its connections."""
+        connections = []
+
+        def get_connection(verb=None, shard=None):
+            connections.append(self._server.getConnection(verb, shard))
+            return connections[-1]
+
+        try:
+            return endpoint.executeRollup(get_connection, verb, parameters, adapter)
+        finally:
+            for connection in connections:
+                self._server.releaseConnection(connection)
+
+    async def queryGet(self, endpoint, verb, plan, parameters, adapter, timer):
+        status, data = await self.execute(verb, plan, parameters, False, timer)
+        if verb.pagination and status:
+            next_key = verb.pagination.nextKey(parameters, data.column_names, data.rows[-1], len(data)) if data else None
+            return self.respond(endpoint, verb, status, data, timer, {"next": next_key}, adapter)
+        return self.respond(endpoint, verb, status, data, timer, adapter=adapter)
+
+    async def executeWrite(self, endpoint, verb, request, body, timer):
+        adapter = endpoint.negotiate(request.headers)
+        if verb.spool is not None:
+            if verb.spool.syncsEveryWrite():
+                return await asyncio.get_event_loop().run_in_executor(None, endpoint.spoolWrite, verb, request.args, body, request.headers)
+            return endpoint.spoolWrite(verb, request.args, body, request.headers)
+        if verb.isBuffered():
+            if verb.writers[0].acksOnFlush():
+                # Waiting for the flush blocks, so wait on a worker thread.
+                return await asyncio.get_event_loop().run_in_executor(None, endpoint.enqueue, verb, request.args, body, request.headers)
+            return endpoint.enqueue(verb, request.args, body, request.headers)
+        if isinstance(body, list):
+            return await self.executeBulk(endpoint, verb, request, body, adapter, timer)
+        parameters = self.merge(endpoint, verb, request, body, timer)
+        status, data = await self.execute(verb, verb.plan, parameters, verb.commit, timer)
+        if status:
+            verb.observeWrite([parameters])
+        return self.respond(endpoint, verb, status, data, timer, adapter=adapter)
+
+    async def executeBulk(self, endpoint, verb, request, body, adapter, timer):
+        began = clock()
+        groups = endpoint.bindRows(verb, request.args, body, request.headers)
+        timer.add("merge", clock() - began)
+        query = verb.plan.sql if verb.plan.preparable else verb.plan.query
+        reports = []
+        row_count = 0
+        for shard, rows in groups.items():
+            status, shard_reports = await self.executeChunks(verb, shard, query, rows, verb.bulk.chunk_size, timer)
+            if shard is not None:
+                for report in shard_reports:
+                    report["shard"] = shard
+            reports.extend(shard_reports)
+            if not status:
+                return self.createResponse(endpoint, "failure", 500, timer, {"chunks": reports}, adapter)
+            verb.observeWrite(rows, verb.plan.parameter_names if verb.plan.preparable else None)
+            row_count += len(rows)
+        return self.createResponse(endpoint, "success", 200, timer, {"rows": row_count}, adapter)
+
+    async def executeLoad(self, endpoint, request, timer):
+        adapter = endpoint.negotiate(request.headers)
+        load = endpoint.post_verb.bulk.load
+        loop = asyncio.get_event_loop()
+        # The upload is copied into the temporary file as it arrives rather than read into memory first.
+        stream = ReceiveStream(request.receive, loop, load.max_bytes)
+        path, columns, row_count = await loop.run_in_executor(None, load.spool, stream, request.mimetype)
+        try:
+            if row_count:
+                pool, connection = await self.checkout(endpoint.post_verb)
+                broken = False
+                try:
+                    began = clock()
+                    async with connection.cursor() as cursor:
+                        await cursor.execute(load.createStatement(columns), (path,))
+                        row_count = cursor.rowcount
+                    await connection.commit()
+                    timer.add("execute", clock() - began)
+                except pymysql.err.MySQLError as err:
+                    logger.error("Bulk load failed: {}".format(err))
+                    broken = True
+                    return self.createResponse(endpoint, "failure", 500, timer, adapter=adapter)
+                finally:
+                    pool.release(connection, broken)
+        finally:
+            os.remove(path)
+        return self.createResponse(endpoint, "success", 200, timer, {"rows": row_count}, adapter)
+
+    async def execute(self, verb, plan, parameters, commit, timer):
+        if plan.preparable:
+            query, values = plan.sql, plan.bind(parameters)
+        else:
+            query, values = plan.query, parameters
+        pool, connection = await self.checkout(verb, verb.locate(parameters))
+        broken = False
+        try:
+            logger.debug("Executing query: %s, using values: %s", query, values)
+            began = clock()
+            fetching = 0.0
+            column_names = []
+            rows = []
+            async with connection.cursor() as cursor:
+                try:
+                    await cursor.execute(query, values)
+                except KeyError as err:
+                    raise MissingParameter(str(err))
+                while True:
+                    if cursor.description:
+                        fetch_began = clock()
+                        column_names.extend(column[0] for column in cursor.description)
+                        rows.extend(await cursor.fetchall())
+                        fetching += clock() - fetch_began
+                    if not await cursor.nextset():
+                        break
+            if commit:
+                await connection.commit()
+            timer.add("materialize", fetching)
+            timer.add("execute", clock() - began - fetching)
+            results = QueryResult(column_names, rows) if column_names else None
+            logger.debug("Results: %s", results)
+            return True, results or None
+        except pymysql.err.MySQLError as err:
+            logger.error("Query operation failed: {}".format(err))
+            broken = True
+            return False, None
+        finally:
+            pool.release(connection, broken)
+
+    async def executeChunks(self, verb, shard, query, rows, chunk_size, timer):
+        """Like MySqlConnection.executeChunks: one executemany per chunk, all in one transaction."""
+        pool, connection = await self.checkout(verb, shard)
+        reports = []
+        began = clock()
+        try:
+            await connection.begin()
+            async with connection.cursor() as cursor:
+                for start in range(0, len(rows), chunk_size):
+                    chunk = rows[start:start + chunk_size]
+                    reports.append({"chunk": len(reports), "first_row": start, "rows": len(chunk), "status": "success"})
+                    await cursor.executemany(query, chunk)
+            await connection.commit()
+            return True, reports
+        except pymysql.err.MySQLError as err:
+            logger.error("Bulk write failed in chunk %(chunk)s: %(error)s" % {"chunk": len(reports) - 1, "error": err})
+            for report in reports:
+                report["status"] = "rolled_back"
+            if reports:
+                reports[-1]["status"] = "failure"
+                reports[-1]["error"] = str(err)
+            # The pool closes a connection that is still in a transaction, which rolls it back.
+            return False, reports
+        finally:
+            timer.add("execute", clock() - began)
+            pool.release(connection)
+
+    async def streamGet(self, endpoint, verb, plan, parameters, adapter, timer):
+        values = plan.bind(parameters)
+        pool, connection = await self.checkout(verb, verb.locate(parameters))
+        try:
+            logger.debug("Streaming query: %s, using values: %s", plan.sql, values)
+            began = clock()
+            cursor = await connection.cursor(aiomysql.SSCursor)
+            await cursor.execute(plan.sql, values)
+            timer.add("execute", clock() - began)
+            column_names = [str(column[0]) for column in cursor.description or ()]
+            # Fetch the first chunk before committing to a 200 so empty results still get the configured emptyResponse.
+            began = clock()
+            first_chunk = await cursor.fetchmany(verb.stream["fetchSize"])
+            timer.add("materialize", clock() - began)
+        except pymysql.err.MySQLError as err:
+            logger.error("Query operation failed: {}".format(err))
+            pool.release(connection, True)
+            return self.respond(endpoint, verb, False, None, timer, adapter=adapter)
+        if not first_chunk and verb.empty_response:
+            await cursor.close()
+            pool.release(connection)
+            return self.respond(endpoint, verb, True, None, timer, adapter=adapter)
+        encoder = StreamEncoder(verb, adapter, column_names, parameters, timer)
+        return AsyncStream(pool, connection, cursor, encoder, first_chunk, verb.stream["fetchSize"], timer)
+
+    def heartbeat(self):
+        server = self._server
+        databases = {"replicas": self._cluster.getMetrics()["replicas"], "shards": {}}
+        for name, clusters in self._shard_clusters.items():
+            databases["shards"][name] = [cluster.getMetrics() for cluster in clusters]
+        body = json.dumps({"version": server.version, "pool": self._cluster.primary.getMetrics(), "databases": databases, "ingest": server.getIngestMetrics(),
+                           "spools": server.getSpoolMetrics(), "rollups": server.getRollupMetrics(), "push": server.getPushMetrics(), "tasks": server.getTaskMetrics(), "cache": server.getCacheMetrics(), "flights": server.getSingleFlightMetrics(), "admission": server.getAdmissionMetrics(), "auth": server.getAuthMetrics()})
+        return ird.Response(body, 200, mimetype="application/json")
+
+    async def sendResponse(self, send, request, response):
+        if self._server.compressor is not None:
+            response = self._server.compressor.compress(response, request.headers.get("Accept-Encoding"))
+        body = b"" if request.method == "HEAD" else response.get_data()
+        await send({"type": "http.response.start", "status": response.status_code, "headers": encodeHeaders(response.headers)})
+        await send({"type": "http.response.body", "body": body})
+        return response.status_code
+
+def encodeHeaders(headers):
+    return [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers.items()]
+
+class AsyncStream(object):
+    """A streamed GET result, sent chunk by chunk from an unbuffered cursor.  The connection goes back to the pool
+    when the last row has been sent, or is closed if the client goes away first."""
+    def __init__(self, pool, connection, cursor, encoder, first_chunk, fetch_size, timer):
+        self._pool = pool
+        self._connection = connection
+        self._cursor = cursor
+        self._encoder = encoder
+        self._first_chunk = first_chunk
+        self._fetch_size = fetch_size
+        self._timer = timer
+
+    async def send(self, send, compressor, request):
+        headers = Headers([("Content-Type", self._encoder.mimetype),
+                           ("Cache-Control", "no-cache, no-store, no-transform, max-age=0")])
+        encoding = None
+        if compressor is not None:
+            headers.add("Vary", "Accept-Encoding")
+            accept_encoding = request.headers.get("Accept-Encoding")
+            encoding = compressor.chooseEncoding(accept_encoding) if accept_encoding else None
+        deflater = None
+        if encoding is not None:
+            headers.add("Content-Encoding", encoding)
+            deflater = compressor.createCompressor(encoding)
+
+        async def write(piece, more_body=True):
+            data = piece.encode("utf-8") if not isinstance(piece, bytes) else piece
+            if deflater is not None:
+                data = deflater.compress(data) + (deflater.flush(zlib.Z_SYNC_FLUSH) if more_body else deflater.flush())
+            await send({"type": "http.response.body", "body": data, "more_body": more_body})
+
+        complete = False
+        try:
+            await send({"type": "http.response.start", "status": 200, "headers": encodeHeaders(headers)})
+            if request.method != "HEAD":
+                await write(self._encoder.open())
+                chunk = self._first_chunk
+                while chunk:
+                    await write(self._encoder.encodeChunk(chunk))
+                    began = clock()
+                    chunk = await self._cursor.fetchmany(self._fetch_size)
+                    self._timer.add("materialize", clock() - began)
+                await write(self._encoder.close(), False)
+                complete = True
+            else:
+                await send({"type": "http.response.body", "body": b""})
+        except pymysql.err.MySQLError as err:
+            logger.error("Streaming query failed: {}".format(err))
+        finally:
+            if complete:
+                await self._cursor.close()
+            # Unread rows would break the next request on this connection, so close it instead of draining them.
+            self._pool.release(self._connection, not complete)
+        return 200
+
+class AsyncSubscriber(object):
+    """Sends the events of one Subscription to its client from the event loop, so a subscriber costs no thread."""
+    DISCONNECTS = frozenset(["http.disconnect", "websocket.disconnect"])
+
+    def __init__(self, broadcaster, subscription):
+        self._broadcaster = broadcaster
+        self._subscription = subscription
+
+    async def waitForDisconnect(self, receive):
+        while (await receive())["type"] not in AsyncSubscriber.DISCONNECTS:
+            pass
+
+    async def run(self, receive, deliver):
+        """Calls deliver with each batch of events, or with None after keepAlive seconds without any, until the
+        client goes away or the subscription is closed."""
+        subscription = self._subscription
+        encode = self._broadcaster.encode
+        loop = asyncio.get_event_loop()
+        ready = asyncio.Event()
+        # Writes publish from worker threads as well as from the event loop.
+        subscription.on_push = lambda: loop.call_soon_threadsafe(ready.set)
+        disconnect = asyncio.ensure_future(self.waitForDisconnect(receive))
+        try:
+            while not subscription.closed:
+                ready.clear()
+                events = subscription.take(encode)
+                if events:
+                    await deliver(events)
+                    continue
+                waiter = asyncio.ensure_future(ready.wait())
+                done, pending = await asyncio.wait([waiter, disconnect], timeout=self._broadcaster.keep_alive, return_when=asyncio.FIRST_COMPLETED)
+                waiter.cancel()
+                if disconnect in done:
+                    break
+                if not done:
+                    await deliver(None)
+        except Exception as err:
+            logger.info("Event subscriber went away: {}".format(err))
+        finally:
+            disconnect.cancel()
+            self._broadcaster.unsubscribe(subscription)
+
+def create_asgi_app(config=None, loglevel=None):
+    """Builds the ASGI app for a config file path or an already parsed config, by default the file named by the
+    IRD_CONFIG environment variable."""
+    if config is None:
+        config = os.environ.get("IRD_CONFIG", "config.json")
+    if not isinstance(config, dict):
+        config = ird.readConfig(config)
+    debug_sampler = ird.configureLogging(config.get("logging", {}), loglevel)
+    server = ird.RestHttpServer.createFromConfig(config)
+    server.debug_sampler = debug_sampler
+    local_infile = any(["load" in endpoint.get("post", {}).get("bulk", {}) for endpoint in config["endpoints"]])
+    create_pool = lambda settings, name: AsyncConnectionPool.createInstanceFromConfig(settings, name, local_infile)
+    cluster = DatabaseCluster.createInstanceFromConfig("primary", config, {}, config.get("database_replicas", []), create_pool)
+    shard_clusters = {}
+    for name, shard_element in config.get("shards", {}).items():
+        shard_clusters[name] = [DatabaseCluster.createInstanceFromConfig(name + "-" + str(index), config, database_element, database_element.get("replicas", []), create_pool)
+                                for index, database_element in enumerate(shard_element["databases"])]
+    return AsyncRestServer(server, cluster, shard_clusters)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config", help="configuration file", type=str, default='config.json')
+    parser.add_argument("--loglevel", help="log level", type=str, default='INFO')
+    parser.add_argument("--host", help="address to listen on", type=str, default='127.0.0.1')
+    parser.add_argument("--port", help="port to listen on", type=int, default=5000)
+    args = parser.parse_args(argv)
+    import uvicorn
+    uvicorn.run(create_asgi_app(args.config, args.loglevel), host=args.host, port=args.port, log_level=args.loglevel.lower())
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
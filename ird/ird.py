@@ -15,9 +15,11 @@
 #
 ########################################################################################################################
 
+from flask import Blueprint
 from flask import Flask
 from flask import Response
 from flask import abort
+from flask import current_app
 from flask import flash
 from flask import g
 from flask import jsonify
@@ -25,172 +27,2802 @@ from flask import redirect
 from flask import render_template
 from flask import request
 from flask import session
+from flask import stream_with_context
 from flask import url_for
 from functools import wraps
-import json, logging, logging.handlers, mysql.connector, os, string, sys, weakref, argparse, hashlib, uuid, schedule, atexit, collections
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import http_date
+from werkzeug.http import parse_accept_header
+from werkzeug.serving import make_server
+from werkzeug.wsgi import ClosingIterator
+import json, logging, logging.handlers, mysql.connector, os, re, sys, weakref, argparse, hashlib, uuid, importlib, collections, threading, time, datetime, decimal, zlib, hmac, base64, binascii, bisect, random, signal, socket, select, multiprocessing, csv, tempfile, calendar, math, mmap, numbers, struct
 from mysql.connector import FieldType
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
-parser = argparse.ArgumentParser()
-parser.add_argument("--config", help="configuration file", type=str, default='config.json')
-parser.add_argument("--loglevel", help="log level", type=str, default='INFO')
-args = parser.parse_args()
+def parseArguments(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config", help="configuration file", type=str, default='config.json')
+    parser.add_argument("--loglevel", help="log level", type=str, default='INFO')
+    parser.add_argument("--host", help="address to listen on", type=str, default='127.0.0.1')
+    parser.add_argument("--port", help="port to listen on", type=int, default=5000)
+    parser.add_argument("--workers", help="number of worker processes, or auto for one per core; without it the development server is used", type=str)
+    parser.add_argument("--drain-timeout", help="seconds a stopping worker waits for requests in flight", type=float, default=30.0)
+    return parser.parse_args(argv)
 
 logger = logging.getLogger('rest-datastore')
 # logger.propagate = False
 formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 
-logger.setLevel(logging.DEBUG)
-logging.basicConfig(format='%(levelname)s:%(message)s', level=logging.INFO, formatter=formatter)
-log = logging.getLogger('werkzeug')
-if args.loglevel == "INFO":
-    log.setLevel(logging.INFO)
-elif args.loglevel == "DEBUG":
-    log.setLevel(logging.DEBUG)
+class JsonLogFormatter(logging.Formatter):
+    """Writes each record as one JSON object per line."""
+    def format(self, record):
+        entry = {"time": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + ".%03dZ" % record.msecs,
+                 "level": record.levelname,
+                 "logger": record.name,
+                 "thread": record.threadName,
+                 "message": record.getMessage()}
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+class AsyncLogHandler(logging.Handler):
+    """Queues records for a background thread that writes them with the wrapped handlers, so request threads never
+    wait on log I/O.  When the queue is full records are dropped and counted instead."""
+    def __init__(self, handlers, queue_size=10000):
+        logging.Handler.__init__(self)
+        self._handlers = handlers
+        self._queue = queue.Queue(queue_size)
+        self.dropped = 0
+        self._thread = threading.Thread(target=self.run, name="log-writer")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def emit(self, record):
+        if record.exc_info:
+            # Format the traceback now; the frames it refers to may be gone by the time the record is written.
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def run(self):
+        while True:
+            record = self._queue.get()
+            if record is None:
+                break
+            for handler in self._handlers:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(5)
+        for handler in self._handlers:
+            handler.close()
+        logging.Handler.close(self)
+
+class DebugSampler(logging.Filter):
+    """Passes the DEBUG records of a random sample of requests.  Records logged outside of a request always pass."""
+    def __init__(self, rate):
+        logging.Filter.__init__(self)
+        self.rate = rate
+
+    def sample(self):
+        request_state.log_sampled = random.random() < self.rate
+
+    def filter(self, record):
+        return record.levelno > logging.DEBUG or getattr(request_state, "log_sampled", True)
+
+def configureLogging(config, loglevel=None):
+    """Applies --loglevel and the logging block of the config file to the root handlers.  Returns the DebugSampler, if
+    debug logging is sampled."""
+    loglevel = loglevel or config.get("level", "INFO")
+    # Debug records are only built when the level asks for them; the root handler would otherwise write them all.
+    logger.setLevel(getattr(logging, loglevel.upper(), logging.INFO))
+    logging.basicConfig(format='%(levelname)s:%(message)s', level=logging.INFO)
+    log = logging.getLogger('werkzeug')
+    if loglevel == "INFO":
+        log.setLevel(logging.INFO)
+    elif loglevel == "DEBUG":
+        log.setLevel(logging.DEBUG)
+    root = logging.getLogger()
+    handlers = list(root.handlers)
+    if config.get("format", "text") == "json":
+        for handler in handlers:
+            handler.setFormatter(JsonLogFormatter())
+    # A reload in the same process must not wrap the background handler in another one.
+    if config.get("async", True) and handlers and not any(isinstance(handler, AsyncLogHandler) for handler in handlers):
+        for handler in handlers:
+            root.removeHandler(handler)
+        root.addHandler(AsyncLogHandler(handlers, config.get("queueSize", 10000)))
+    # Likewise a reload replaces the sampler instead of adding a second one.
+    for existing in [existing for existing in logger.filters if isinstance(existing, DebugSampler)]:
+        logger.removeFilter(existing)
+    rate = config.get("debugSampleRate", 1.0)
+    if rate >= 1.0:
+        return None
+    sampler = DebugSampler(rate)
+    logger.addFilter(sampler)
+    return sampler
 
 this_directory = os.path.abspath(os.path.dirname(__file__))
-default_config = args.config
 default_tasks_dir = os.path.join(this_directory, "tasks")
 
+clock = getattr(time, "perf_counter", time.time)
+
+def toBytes(value):
+    if isinstance(value, bytes):
+        return value
+    return value.encode("utf-8")
+
+def escapeHtml(value):
+    return ("%s" % value).replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;").replace('"', "&quot;")
+
 class User(object):
-    def __init__(self, username, password):
+    def __init__(self, username, password, tokens=None, rate_limit=None):
         self._username = username
         self._password = password
+        self._tokens = [token.lower() for token in tokens or []]
+        self.rate_limit = rate_limit
     
     def getUsername(self):
         return self._username
 
+    def getTokens(self):
+        return self._tokens
+
+    def checkPassword(self, password):
+        """Supports the original hex SHA-224 hashes as well as pbkdf2_sha256$<iterations>$<salt>$<hex digest> and,
+        where hashlib has it, scrypt$<n>$<r>$<p>$<salt>$<hex digest>."""
+        stored = self._password
+        if stored.startswith("pbkdf2_sha256$"):
+            algorithm, iterations, salt, expected = stored.split("$")
+            computed = binascii.hexlify(hashlib.pbkdf2_hmac("sha256", toBytes(password), toBytes(salt), int(iterations)))
+        elif stored.startswith("scrypt$"):
+            algorithm, n, r, p, salt, expected = stored.split("$")
+            computed = binascii.hexlify(hashlib.scrypt(toBytes(password), salt=toBytes(salt), n=int(n), r=int(r), p=int(p), dklen=len(expected) // 2))
+        else:
+            expected = stored
+            computed = hashlib.sha224(toBytes(password)).hexdigest()
+        return hmac.compare_digest(toBytes(computed), toBytes(expected.lower()))
+
     def authenticate(self, username, password):
-        password = hashlib.sha224(password).hexdigest()
-        result = username and password and self._username and self._password and self._username == username and self._password == password
+        result = username and password and self._username and self._password and hmac.compare_digest(toBytes(self._username), toBytes(username)) and self.checkPassword(password)
         if not result:
-            logger.warn("Unable to authenticate user: " + username)
+            logger.warning("Unable to authenticate user: " + username)
         return result 
 
+class Authenticator(object):
+    """Resolves an Authorization header to a username.  Basic credentials are checked against the user's password
+    hash and bearer tokens against the SHA-256 hashes listed for the user.  Headers that verified recently are
+    remembered for ttl seconds under an HMAC of the header, keyed with a per-process secret, so the password hash
+    only runs once per client rather than on every request."""
+    def __init__(self, ttl=300.0, max_entries=10000):
+        self._users = {}
+        self._tokens = {}
+        self._ttl = ttl
+        self._max_entries = max(1, max_entries)
+        self._secret = os.urandom(32)
+        self._verified = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    @staticmethod
+    def createInstanceFromConfig(auth_cache_element):
+        return Authenticator(auth_cache_element.get("ttl", 300.0), auth_cache_element.get("maxEntries", 10000))
+
+    def addUser(self, user):
+        if user.getUsername() in self._users:
+            user.bit = self._users[user.getUsername()].bit
+        else:
+            user.bit = 1 << len(self._users)
+        self._users[user.getUsername()] = user
+        for token in user.getTokens():
+            self._tokens[token] = user
+
+    def getUserBits(self):
+        bits = {}
+        for username, user in self._users.items():
+            bits[username] = user.bit
+        return bits
+
+    def lookup(self, authorization):
+        """Returns the User of a header that verified recently, or None without checking the credentials."""
+        if not authorization:
+            return None
+        key = hmac.new(self._secret, toBytes(authorization), hashlib.sha256).digest()
+        with self._lock:
+            entry = self._verified.get(key)
+            if entry is not None and entry[1] > time.time():
+                self._hits += 1
+                return entry[0]
+        return None
+
+    def authenticate(self, authorization):
+        """Returns the User the header belongs to, or None."""
+        if not authorization:
+            return None
+        key = hmac.new(self._secret, toBytes(authorization), hashlib.sha256).digest()
+        now = time.time()
+        with self._lock:
+            entry = self._verified.pop(key, None)
+            if entry is not None and entry[1] > now:
+                self._verified[key] = entry
+                self._hits += 1
+                return entry[0]
+            self._misses += 1
+        user = self.verify(authorization)
+        if user and self._ttl > 0:
+            with self._lock:
+                self._verified[key] = (user, now + self._ttl)
+                while len(self._verified) > self._max_entries:
+                    self._verified.popitem(last=False)
+        return user
+
+    def verify(self, authorization):
+        scheme, separator, credentials = authorization.strip().partition(" ")
+        scheme = scheme.lower()
+        if scheme == "basic":
+            try:
+                username, separator, password = base64.b64decode(toBytes(credentials.strip())).decode("utf-8").partition(":")
+            except (TypeError, ValueError, binascii.Error):
+                return None
+            user = self._users.get(username)
+            if user and user.authenticate(username, password):
+                return user
+            return None
+        if scheme == "bearer":
+            # Tokens are long and random, so a fast hash is enough and the dictionary lookup reveals nothing useful.
+            user = self._tokens.get(hashlib.sha256(toBytes(credentials.strip())).hexdigest())
+            if not user:
+                logger.warning("Unable to authenticate bearer token.")
+            return user
+        return None
+
+    def getMetrics(self):
+        with self._lock:
+            return {"entries": len(self._verified), "hits": self._hits, "misses": self._misses}
+
+class TooManyRequests(Exception):
+    def __init__(self, reason, retry_after=1.0):
+        Exception.__init__(self, reason)
+        self.retry_after = retry_after
+
+class TokenBucket(object):
+    """Allows rate requests a second on average, and bursts of up to burst requests."""
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst or max(1.0, self.rate))
+        self._tokens = self.burst
+        self._updated = clock()
+        self._lock = threading.Lock()
+        self._limited = 0
+
+    @staticmethod
+    def createInstanceFromConfig(rate_limit_element):
+        return TokenBucket(rate_limit_element["rate"], rate_limit_element.get("burst"))
+
+    def take(self):
+        """Takes a token and returns 0, or returns the seconds until one will be available."""
+        with self._lock:
+            now = clock()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1.0:
+                self._tokens -= 1.0
+                return 0.0
+            self._limited += 1
+            return (1.0 - self._tokens) / self.rate
+
+    def getLimited(self):
+        with self._lock:
+            return self._limited
+
+class AdmissionControl(object):
+    """Runs at most max_concurrent requests at once.  Up to max_queued more wait up to queue_timeout seconds for one
+    of them to finish, and the rest are turned away at once, so an overloaded server answers quickly instead of
+    piling requests onto the database."""
+    def __init__(self, max_concurrent=64, max_queued=256, queue_timeout=1.0):
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self._condition = threading.Condition()
+        # asgi.py admits requests on its event loop and keeps these counts up to date itself.
+        self.active = 0
+        self.waiting = 0
+        self.counts = {"admitted": 0, "queued": 0, "rejected": 0, "timeouts": 0}
+
+    @staticmethod
+    def createInstanceFromConfig(admission_element):
+        if not admission_element:
+            return None
+        return AdmissionControl(admission_element.get("maxConcurrent", 64), admission_element.get("maxQueued", 256),
+                                admission_element.get("queueTimeout", 1.0))
+
+    def enter(self):
+        with self._condition:
+            if self.active >= self.max_concurrent:
+                if self.waiting >= self.max_queued:
+                    self.counts["rejected"] += 1
+                    raise TooManyRequests("the server is busy")
+                self.counts["queued"] += 1
+                self.waiting += 1
+                deadline = time.time() + self.queue_timeout
+                try:
+                    while self.active >= self.max_concurrent:
+                        remaining = deadline - time.time()
+                        if remaining <= 0:
+                            self.counts["timeouts"] += 1
+                            raise TooManyRequests("the server is busy")
+                        self._condition.wait(remaining)
+                finally:
+                    self.waiting -= 1
+            self.active += 1
+            self.counts["admitted"] += 1
+
+    def leave(self):
+        with self._condition:
+            self.active -= 1
+            self._condition.notify()
+
+    def getMetrics(self):
+        with self._condition:
+            return dict(self.counts, active=self.active, waiting=self.waiting, limit=self.max_concurrent)
+
+class PhaseTimer(object):
+    """Adds up the seconds one request spends in each phase of its handling.  A phase may be entered more than once,
+    e.g. once per streamed chunk."""
+    __slots__ = ("started", "phases")
+
+    def __init__(self):
+        self.started = clock()
+        self.phases = {}
+
+    def add(self, phase, seconds):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+class NullTimer(object):
+    def add(self, phase, seconds):
+        pass
+
+NULL_TIMER = NullTimer()
+request_state = threading.local()
+
+def currentTimer():
+    """The PhaseTimer of the request running on this thread, or one that discards everything outside of requests."""
+    return getattr(request_state, "timer", NULL_TIMER)
+
+def setCurrentTimer(timer):
+    request_state.timer = timer
+
+class LatencyHistogram(object):
+    BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    __slots__ = ("counts", "total", "count")
+
+    def __init__(self):
+        # The last slot counts observations above the largest bucket.
+        self.counts = [0] * (len(self.BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.BUCKETS, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+
+    def getCumulativeCounts(self):
+        cumulative = []
+        running = 0
+        for count in self.counts:
+            running += count
+            cumulative.append(running)
+        return cumulative
+
+class VerbMetrics(object):
+    """Responses by status code and latency histograms, overall and per phase, for one endpoint and method."""
+    PHASES = ("auth", "merge", "execute", "materialize", "serialize")
+
+    def __init__(self, path, method):
+        self.path = path
+        self.method = method
+        self.responses = {}
+        self.latency = LatencyHistogram()
+        self.phases = dict((phase, LatencyHistogram()) for phase in self.PHASES)
+        self._lock = threading.Lock()
+
+    def observe(self, status_code, timer):
+        elapsed = clock() - timer.started
+        with self._lock:
+            self.responses[status_code] = self.responses.get(status_code, 0) + 1
+            self.latency.observe(elapsed)
+            for phase, seconds in timer.phases.items():
+                self.phases[phase].observe(seconds)
+
+    def getSnapshot(self):
+        with self._lock:
+            return (dict(self.responses),
+                    (self.latency.getCumulativeCounts(), self.latency.total),
+                    dict((phase, (histogram.getCumulativeCounts(), histogram.total)) for phase, histogram in self.phases.items() if histogram.count))
+
+def formatLabels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join('%s="%s"' % (name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for name, value in labels) + "}"
+
+def formatMetricValue(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+class MetricsText(object):
+    """Builds a scrape in the Prometheus text exposition format."""
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self):
+        self._lines = []
+
+    def addFamily(self, name, kind, description, samples):
+        self._lines.append("# HELP " + name + " " + description)
+        self._lines.append("# TYPE " + name + " " + kind)
+        for labels, value in samples:
+            self._lines.append(name + formatLabels(labels) + " " + formatMetricValue(value))
+
+    def addHistogram(self, name, description, histograms):
+        self._lines.append("# HELP " + name + " " + description)
+        self._lines.append("# TYPE " + name + " histogram")
+        bounds = [repr(bound) for bound in LatencyHistogram.BUCKETS] + ["+Inf"]
+        for labels, (cumulative, total) in histograms:
+            for bound, count in zip(bounds, cumulative):
+                self._lines.append(name + "_bucket" + formatLabels(labels + [("le", bound)]) + " " + str(count))
+            self._lines.append(name + "_sum" + formatLabels(labels) + " " + repr(total))
+            self._lines.append(name + "_count" + formatLabels(labels) + " " + str(cumulative[-1]))
+
+    def render(self):
+        return "\n".join(self._lines) + "\n"
+
+class RequestMetrics(object):
+    """The VerbMetrics of every configured endpoint and method."""
+    def __init__(self):
+        self._verbs = collections.OrderedDict()
+
+    def getVerbMetrics(self, path, method):
+        key = (path, method)
+        if key not in self._verbs:
+            self._verbs[key] = VerbMetrics(path, method)
+        return self._verbs[key]
+
+    def addTo(self, text):
+        requests = []
+        errors = []
+        latencies = []
+        phases = []
+        for verb in self._verbs.values():
+            responses, latency, phase_latencies = verb.getSnapshot()
+            labels = [("path", verb.path), ("method", verb.method)]
+            for status_code in sorted(responses):
+                requests.append((labels + [("status", status_code)], responses[status_code]))
+            errors.append((labels, sum(count for status_code, count in responses.items() if status_code >= 500)))
+            latencies.append((labels, latency))
+            for phase in VerbMetrics.PHASES:
+                if phase in phase_latencies:
+                    phases.append((labels + [("phase", phase)], phase_latencies[phase]))
+        text.addFamily("ird_requests_total", "counter", "Requests by endpoint, method and response status.", requests)
+        text.addFamily("ird_request_errors_total", "counter", "Requests answered with a 5xx status.", errors)
+        text.addHistogram("ird_request_duration_seconds", "Time from the start of a request until its response body was sent.", latencies)
+        text.addHistogram("ird_request_phase_seconds", "Time a request spent authenticating, merging parameters, executing the query, reading rows and serializing.", phases)
+
+class ConnectionPoolTimeout(Exception):
+    pass
+
+class MissingParameter(Exception):
+    pass
+
+class InvalidParameter(Exception):
+    pass
+
+def splitTopLevel(text):
+    """Splits text at the commas that aren't inside parentheses or quotes."""
+    parts = [""]
+    depth = 0
+    quote = None
+    for character in text:
+        if quote is not None:
+            if character == quote:
+                quote = None
+        elif character in "'\"":
+            quote = character
+        elif character == "(":
+            depth += 1
+        elif character == ")":
+            depth -= 1
+        elif character == "," and depth == 0:
+            parts.append("")
+            continue
+        parts[-1] += character
+    return parts
+
+class QueryPlan(object):
+    """A verb's query parsed once at startup.  %(NAME)s placeholders are rewritten to positional %s markers so the
+    statement can be prepared on the server, and parameters are bound in the order they appear."""
+    PARAMETER_PATTERN = re.compile(r"%\((\w+)\)s")
+    ROW_STATEMENTS = frozenset(["SELECT", "SHOW", "DESCRIBE", "DESC", "EXPLAIN", "WITH"])
+    TABLE_PATTERNS = [re.compile(r"^(?:INSERT|REPLACE)\s+(?:IGNORE\s+)?(?:INTO\s+)?([\w.`]+)", re.I),
+                      re.compile(r"^UPDATE\s+(?:IGNORE\s+)?([\w.`]+)", re.I),
+                      re.compile(r"^DELETE\s+FROM\s+([\w.`]+)", re.I),
+                      re.compile(r"^SELECT\s.*?\sFROM\s+([\w.`]+)", re.I | re.S)]
+    JOIN_PATTERN = re.compile(r"\bJOIN\b", re.I)
+    COMPARISON_PATTERN = re.compile(r"`?(\w+)`?\s*(?:<=>|!=|<>|<=|>=|=|<|>)\s*%\((\w+)\)s")
+    VALUES_PATTERN = re.compile(r"\(([^()]*)\)\s*VALUES\s*\((.*?)\)\s*(?:ON\s+DUPLICATE\s+KEY\s+UPDATE\s.*)?$", re.I | re.S)
+
+    def __init__(self, query):
+        self.query = query
+        statement = query.strip().rstrip(";").strip()
+        self.parameter_names = tuple(QueryPlan.PARAMETER_PATTERN.findall(statement))
+        self.sql = QueryPlan.PARAMETER_PATTERN.sub("%s", statement)
+        self.statement_type = statement.split(None, 1)[0].upper() if statement else ""
+        self.returns_rows = self.statement_type in QueryPlan.ROW_STATEMENTS
+        # Multiple statements and literal percent signs can't be sent as one prepared statement.
+        self.preparable = bool(statement) and ";" not in statement and "%" not in self.sql.replace("%s", "")
+
+    def bind(self, parameters):
+        try:
+            return tuple([parameters[name] for name in self.parameter_names])
+        except KeyError as err:
+            raise MissingParameter(err.args[0])
+
+    def createKey(self, parameters):
+        """Identifies the query and the values bound to it, for requests that may share a result."""
+        return self.sql + "\0" + repr(self.bind(parameters))
+
+    def getColumnReferences(self):
+        """The table a single table statement reads or writes, and the column each parameter is compared with or
+        inserted into.  The statement is read with a few patterns rather than parsed, so parameters in expressions and
+        subqueries aren't mapped.  Returns None when no table is found or the statement joins tables."""
+        statement = self.query.strip().rstrip(";").strip()
+        for pattern in QueryPlan.TABLE_PATTERNS:
+            match = pattern.match(statement)
+            if match is not None:
+                table = match.group(1).replace("`", "")
+                break
+        else:
+            return None
+        if QueryPlan.JOIN_PATTERN.search(statement):
+            return None
+        columns = {}
+        for column, name in QueryPlan.COMPARISON_PATTERN.findall(statement):
+            columns.setdefault(name, set()).add(column.upper())
+        match = QueryPlan.VALUES_PATTERN.search(statement) if self.statement_type in ("INSERT", "REPLACE") else None
+        if match is not None:
+            values = splitTopLevel(match.group(2))
+            names = [name.strip().strip("`").upper() for name in match.group(1).split(",")]
+            for column, value in zip(names, values):
+                value_match = QueryPlan.PARAMETER_PATTERN.match(value.strip())
+                if value_match is not None and value_match.group(0) == value.strip():
+                    columns.setdefault(value_match.group(1), set()).add(column)
+        # A parameter compared with two different columns is left to MySQL.
+        return table, dict([(name, found.pop()) for name, found in columns.items() if len(found) == 1])
+
+class QueryResult(object):
+    """Column names and row tuples as the cursor returned them.  Adapters serialize straight from the tuples."""
+    def __init__(self, column_names, rows):
+        self.column_names = [str(column_name) for column_name in column_names]
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __str__(self):
+        return "{columns: %(columns)s, rows: %(rows)s}" % {"columns": self.column_names, "rows": len(self.rows)}
+
+class KeysetPagination(object):
+    """Pages through a GET query by wrapping it in a derived table ordered by a unique key column.  The first page
+    has no lower bound; later pages pass the key of the last row they received as ?after=<key>."""
+    def __init__(self, query, key, limit=100, max_limit=1000):
+        statement = query.strip().rstrip(";").strip()
+        page = "SELECT * FROM (" + statement + ") AS page"
+        order = " ORDER BY page.`" + key + "` LIMIT %(LIMIT)s"
+        self.key = key
+        self.limit = limit
+        self.max_limit = max_limit
+        self.first_plan = QueryPlan(page + order)
+        self.next_plan = QueryPlan(page + " WHERE page.`" + key + "` > %(AFTER)s" + order)
+
+    @staticmethod
+    def createInstanceFromConfig(query, pagination_element):
+        return KeysetPagination(query, pagination_element["key"],
+                                pagination_element.get("limit", 100),
+                                pagination_element.get("maxLimit", 1000))
+
+    def bind(self, parameters):
+        try:
+            limit = int(parameters.get("LIMIT", self.limit))
+        except (TypeError, ValueError):
+            limit = self.limit
+        parameters["LIMIT"] = max(1, min(limit, self.max_limit))
+        after = parameters.get("AFTER")
+        if after is None or after == "":
+            return self.first_plan
+        try:
+            parameters["AFTER"] = int(after)
+        except (TypeError, ValueError):
+            pass
+        return self.next_plan
+
+    def nextKey(self, parameters, column_names, last_row, row_count):
+        if last_row is None or row_count < parameters["LIMIT"] or self.key not in column_names:
+            return None
+        return last_row[column_names.index(self.key)]
+
 class MySqlConnection(object):
-    def __init__(self, host, database, user, password, database_pool_size, pool_name):
-        self._host = host
-        self._database = database
-        self._user = user
-        self._password = password
-        self._database_pool_size = database_pool_size
-        self._pool_name = pool_name
-        self._connection = self.createConnection()
+    """A single database connection checked out of a MySqlConnectionPool for the duration of one request.  Prepared
+    statements are cached per connection, least recently used first out."""
+    def __init__(self, connection, statement_cache_size=64, pool=None):
+        self._connection = connection
+        self.pool = pool
+        self._broken = False
+        self._statements = collections.OrderedDict()
+        self._statement_cache_size = statement_cache_size
+        self.last_used = time.time()
 
-    def createConnection(self):
-        logger.info("Connecting to database: " + self._database)
-        # Query cache is a problem.  If you don't commit after each query, you get stale data.  MySQL 8 removed query cache.
-        # http://mysqlserverteam.com/mysql-8-0-retiring-support-for-the-query-cache/
-        # https://stackoverflow.com/questions/21974169/how-to-disable-query-cache-with-mysql-connector
-        # https://bugs.mysql.com/bug.php?id=42197
-        return mysql.connector.connect(user=self._user,
-                                                   password=self._password,
-                                                   host=self._host,
-                                                   pool_name = self._pool_name,
-                                                   pool_size = self._database_pool_size,
-                                                   database=self._database,
-                                                   autocommit=True)
-    def checkConnection(self):
-        if weakref.ref(self._connection)() is None or not self._connection.is_connected():
-            self._connection = self.createConnection()
+    def isBroken(self):
+        return self._broken
+
+    def ping(self):
+        try:
+            # No reconnect: a fresh session would silently drop the prepared statements cached on this connection.
+            self._connection.ping(reconnect=False)
+            return True
+        except mysql.connector.Error as err:
+            logger.warning("Database connection failed health check: {}".format(err))
+            return False
+
+    def checkError(self):
+        # Only consult the server after a failure; a lost connection is discarded by the pool on release.
+        if not self._connection.is_connected():
+            self._broken = True
 
     def close(self):
-        self._connection.close()
-
-    def getQueryColumnInfo(self, query, parameters):
-        self.checkConnection()
-        logger.debug("Executing query: %(query)s, using parameters: %(parameters)s" % {"query": query, "parameters": parameters})
-        self._cursor = self._connection.cursor(buffered=True)
-        self._cursor.execute(query.format( ** parameters))
-        column_names = self._cursor.column_names
-        column_types = self._cursor.description
-        logger.debug("Returned column names: " + str(column_names))
-        logger.debug("Returned column types: " + str(column_types))
-        self._cursor.close()
-        return column_names, column_types
+        self._statements.clear()
+        try:
+            self._connection.close()
+        except mysql.connector.Error as err:
+            logger.warning("Unable to close database connection: {}".format(err))
+
+    def getPreparedCursor(self, sql):
+        cursor = self._statements.pop(sql, None)
+        if cursor is None:
+            if len(self._statements) >= self._statement_cache_size:
+                evicted_sql, evicted = self._statements.popitem(last=False)
+                logger.debug("Evicting prepared statement: %s", evicted_sql)
+                evicted.close()
+            cursor = self._connection.cursor(prepared=True)
+        self._statements[sql] = cursor
+        return cursor
+
+    def closePreparedCursor(self, sql):
+        cursor = self._statements.pop(sql, None)
+        if cursor is not None:
+            try:
+                cursor.close()
+            except mysql.connector.Error:
+                pass
+
+    def executePlan(self, plan, parameters, commit=False, bound=False):
+        if not plan.preparable:
+            if bound:
+                return self.execute(plan.sql, parameters, commit)
+            return self.execute(plan.query, parameters, commit)
+        values = parameters if bound else plan.bind(parameters)
+        try:
+            logger.debug("Executing prepared statement: %s, using values: %s", plan.sql, values)
+            timer = currentTimer()
+            began = clock()
+            cursor = self.getPreparedCursor(plan.sql)
+            cursor.execute(plan.sql, values)
+            executed = clock()
+            if cursor.description:
+                results = QueryResult(cursor.column_names, cursor.fetchall())
+            else:
+                results = None
+            materialized = clock()
+            if commit:
+                logger.debug("Committing transaction...")
+                self._connection.commit()
+            timer.add("materialize", materialized - executed)
+            timer.add("execute", executed - began + clock() - materialized)
+            logger.debug("Results: %s", results)
+            if not results:
+                return True, None
+            else:
+                return True, results
+        except mysql.connector.Error as err:
+            logger.error("Query operation failed: {}".format(err))
+            self.closePreparedCursor(plan.sql)
+            self.checkError()
+            return False, None
+
+    def getColumnInfo(self, plan):
+        """The name, type and nullability of each column a SELECT plan returns.  The query is wrapped in LIMIT 0, so
+        MySQL reports the columns without reading any rows."""
+        statement = "SELECT * FROM (" + plan.sql + ") AS columns LIMIT 0"
+        logger.debug("Reading columns of: %s", plan.sql)
+        cursor = self._connection.cursor()
+        try:
+            cursor.execute(statement, tuple([None for name in plan.parameter_names]))
+            cursor.fetchall()
+            return [{"name": str(column[0]), "type": FieldType.get_info(column[1]) or "UNKNOWN", "nullable": bool(column[6])} for column in cursor.description]
+        except mysql.connector.Error:
+            self.checkError()
+            raise
+        finally:
+            cursor.close()
+
+    def executeUpdate(self, query, commit=False):
+        """Runs one statement as written, with no parameters.  Returns the status and the number of rows it
+        changed."""
+        try:
+            logger.debug("Executing statement: %s", query)
+            cursor = self._connection.cursor()
+            cursor.execute(query)
+            if cursor.with_rows:
+                cursor.fetchall()
+            row_count = cursor.rowcount
+            if commit:
+                self._connection.commit()
+            cursor.close()
+            return True, row_count
+        except mysql.connector.Error as err:
+            logger.error("Statement failed: {}".format(err))
+            self.checkError()
+            return False, 0
 
     def execute(self, query, parameters, commit=False):
-        self.checkConnection()
         try:
-            logger.debug("Executing query: %(query)s, using parameters: %(parameters)s" % {"query": query, "parameters": parameters})
-            self._cursor = self._connection.cursor()
+            logger.debug("Executing query: %s, using parameters: %s", query, parameters)
+            timer = currentTimer()
+            began = clock()
+            fetching = 0.0
+            cursor = self._connection.cursor()
             column_names = []
             rows = []
-            for result in self._cursor.execute(query, parameters, multi=True):
+            for result in cursor.execute(query, parameters, multi=True):
                 if result.with_rows:
-                    column_names.extend(self._cursor.column_names)
-                    logger.debug("Returned column names: " + str(column_names))
-                    rows.extend(self._cursor.fetchall())
-                    logger.debug("Returned column rows: " + str(rows))
-            results = self.createResults(column_names, rows)
+                    fetch_began = clock()
+                    column_names.extend(cursor.column_names)
+                    rows.extend(cursor.fetchall())
+                    fetching += clock() - fetch_began
+            results = QueryResult(column_names, rows)
             if commit:
                 logger.debug("Committing transaction...")
                 self._connection.commit()
+            timer.add("materialize", fetching)
+            timer.add("execute", clock() - began - fetching)
             logger.debug("Closing cursor...")
-            self._cursor.close()
-            logger.debug("Results: " + str(results))
+            cursor.close()
+            logger.debug("Results: %s", results)
             if not results:
                 return True, None
             else:
                 return True, results
         except mysql.connector.Error as err:
             logger.error("Query operation failed: {}".format(err))
+            self.checkError()
             return False, None
 
+    def executeStream(self, plan, parameters, fetch_size=1000):
+        """Runs a plan on an unbuffered cursor.  Returns the column names and a generator that fetches the rows in
+        chunks of fetch_size, so the full result set is never held in memory."""
+        values = plan.bind(parameters)
+        try:
+            logger.debug("Streaming prepared statement: %s, using values: %s", plan.sql, values)
+            timer = currentTimer()
+            began = clock()
+            cursor = self.getPreparedCursor(plan.sql)
+            cursor.execute(plan.sql, values)
+            timer.add("execute", clock() - began)
+            column_names = [str(column_name) for column_name in cursor.column_names]
+            return True, column_names, self.fetchChunks(cursor, plan.sql, fetch_size, timer)
+        except mysql.connector.Error as err:
+            logger.error("Query operation failed: {}".format(err))
+            self.closePreparedCursor(plan.sql)
+            self.checkError()
+            return False, None, None
+
+    def fetchChunks(self, cursor, sql, fetch_size, timer=NULL_TIMER):
+        complete = False
+        try:
+            while True:
+                began = clock()
+                rows = cursor.fetchmany(fetch_size)
+                timer.add("materialize", clock() - began)
+                if not rows:
+                    break
+                yield rows
+            complete = True
+        except mysql.connector.Error as err:
+            logger.error("Streaming query failed: {}".format(err))
+        finally:
+            if not complete:
+                # The client went away or the query failed part way through.  Unread rows would break the next
+                # request on this connection, so let the pool discard it instead of draining millions of rows.
+                self._broken = True
+
     def executeMany(self, query, parameters, commit=False):
-        self.checkConnection()
         try:
-            logger.debug("Executing query: %(query)s, using parameters: %(parameters)s" % {"query": query, "parameters": parameters})
-            self._cursor = self._connection.cursor()
-            self._cursor.executemany(query, parameters)
+            logger.debug("Executing query: %s, using parameters: %s", query, parameters)
+            began = clock()
+            cursor = self._connection.cursor()
+            cursor.executemany(query, parameters)
             if commit:
                 self._connection.commit()
-            self._cursor.close()
+            cursor.close()
+            currentTimer().add("execute", clock() - began)
             return True, None
         except mysql.connector.Error as err:
             logger.error("Query operation failed: {}".format(err))
+            self.checkError()
             return False, None
 
-    def createResults(self, column_names, rows):
-        results = []
-        for row in rows:
-            nextItem = {}
-            for item, column_name in zip(row, column_names):
-                nextItem[str(column_name)] = item
-            results.append(nextItem)
-        return results
+    def executeChunks(self, query, rows, chunk_size):
+        """Writes rows with one executemany per chunk_size rows, in a single transaction.  Returns the status and a
+        report for each chunk that was tried; when a chunk fails the ones before it are rolled back."""
+        reports = []
+        began = clock()
+        cursor = None
+        try:
+            self._connection.start_transaction()
+            cursor = self._connection.cursor()
+            for start in range(0, len(rows), chunk_size):
+                chunk = rows[start:start + chunk_size]
+                reports.append({"chunk": len(reports), "first_row": start, "rows": len(chunk), "status": "success"})
+                cursor.executemany(query, chunk)
+            self._connection.commit()
+            return True, reports
+        except mysql.connector.Error as err:
+            logger.error("Bulk write failed in chunk %(chunk)s: %(error)s" % {"chunk": len(reports) - 1, "error": err})
+            for report in reports:
+                report["status"] = "rolled_back"
+            if reports:
+                reports[-1]["status"] = "failure"
+                reports[-1]["error"] = str(err)
+            try:
+                self._connection.rollback()
+            except mysql.connector.Error:
+                pass
+            self.checkError()
+            return False, reports
+        finally:
+            if cursor is not None:
+                cursor.close()
+            currentTimer().add("execute", clock() - began)
 
+    def loadData(self, statement, path):
+        """Runs a LOAD DATA LOCAL INFILE statement for the file at path.  Returns the status and the rows loaded."""
+        try:
+            logger.debug("Loading %s with: %s", path, statement)
+            began = clock()
+            cursor = self._connection.cursor()
+            cursor.execute(statement, (path,))
+            row_count = cursor.rowcount
+            cursor.close()
+            self._connection.commit()
+            currentTimer().add("execute", clock() - began)
+            return True, row_count
+        except mysql.connector.Error as err:
+            logger.error("Bulk load failed: {}".format(err))
+            self.checkError()
+            return False, 0
+
+class MySqlConnectionPool(object):
+    """Hands out one MySqlConnection per request.  Connections are opened lazily up to database_pool_size; when all of
+    them are in use a checkout waits up to checkout_timeout seconds before giving up."""
+    def __init__(self, host, database, user, password, database_pool_size, pool_name, checkout_timeout=5.0, ping_interval=30.0, statement_cache_size=64, allow_local_infile=False):
+        self._host = host
+        self._database = database
+        self._user = user
+        self._password = password
+        self._database_pool_size = max(1, database_pool_size)
+        self._pool_name = pool_name
+        self._checkout_timeout = checkout_timeout
+        self._ping_interval = ping_interval
+        self._statement_cache_size = statement_cache_size
+        self._allow_local_infile = allow_local_infile
+        # LIFO so the most recently used (and most likely still alive) connection is handed out first.
+        self._idle = queue.LifoQueue(self._database_pool_size)
+        self._lock = threading.Lock()
+        self._opened = 0
+        self._checkouts = 0
+        self._waits = 0
+        self._timeouts = 0
+        self._discarded = 0
+        self._wait_seconds = 0.0
 
-class JsonAdapter(object):
     @staticmethod
-    def serialize(column_names, rows):
-        jsonobject = []
-        for row in rows:
-            counter = 0
-            rowdict = {}
-            for column in row:
-                rowdict[str(column_names[counter])] = column
-                counter += 1
-            jsonobject.append(rowdict)
-        return json.dumps(jsonobject)
+    def createInstanceFromConfig(config, pool_name, allow_local_infile=False):
+        return MySqlConnectionPool(config["database_ip_address"], config["database"], config["database_user"],
+                                   config["database_password"], config["database_pool_size"], pool_name,
+                                   config.get("database_pool_timeout", 5.0),
+                                   config.get("database_pool_ping_interval", 30.0),
+                                   config.get("database_statement_cache_size", 64),
+                                   allow_local_infile)
+
+    def createConnection(self):
+        logger.info("Connecting to database: " + self._database + " at " + self._host)
+        # Query cache is a problem.  If you don't commit after each query, you get stale data.  MySQL 8 removed query cache.
+        # http://mysqlserverteam.com/mysql-8-0-retiring-support-for-the-query-cache/
+        # https://stackoverflow.com/questions/21974169/how-to-disable-query-cache-with-mysql-connector
+        # https://bugs.mysql.com/bug.php?id=42197
+        return MySqlConnection(mysql.connector.connect(user=self._user,
+                                                       password=self._password,
+                                                       host=self._host,
+                                                       database=self._database,
+                                                       autocommit=True,
+                                                       allow_local_infile=self._allow_local_infile), self._statement_cache_size, self)
+
+    def openConnection(self):
+        try:
+            return self.createConnection()
+        except mysql.connector.Error:
+            with self._lock:
+                self._opened -= 1
+            raise
+
+    def checkout(self, timeout=None):
+        if timeout is None:
+            timeout = self._checkout_timeout
+        connection = None
+        try:
+            connection = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_open = self._opened < self._database_pool_size
+                if can_open:
+                    self._opened += 1
+            if can_open:
+                connection = self.openConnection()
+            else:
+                start = time.time()
+                try:
+                    connection = self._idle.get(timeout=timeout)
+                except queue.Empty:
+                    with self._lock:
+                        self._timeouts += 1
+                    logger.warning("Timed out after %(timeout)s seconds waiting for a connection from pool: %(pool)s" % {"timeout": timeout, "pool": self._pool_name})
+                    raise ConnectionPoolTimeout(self._pool_name)
+                finally:
+                    with self._lock:
+                        self._waits += 1
+                        self._wait_seconds += time.time() - start
+        if time.time() - connection.last_used > self._ping_interval and not connection.ping():
+            connection.close()
+            with self._lock:
+                self._discarded += 1
+            connection = self.openConnection()
+        with self._lock:
+            self._checkouts += 1
+        return connection
+
+    def release(self, connection):
+        if connection.isBroken():
+            connection.close()
+            with self._lock:
+                self._opened -= 1
+                self._discarded += 1
+            return
+        connection.last_used = time.time()
+        self._idle.put_nowait(connection)
+
+    def getMetrics(self):
+        with self._lock:
+            idle = self._idle.qsize()
+            return {"size": self._database_pool_size,
+                    "open": self._opened,
+                    "idle": idle,
+                    "in_use": self._opened - idle,
+                    "checkouts": self._checkouts,
+                    "waits": self._waits,
+                    "timeouts": self._timeouts,
+                    "discarded": self._discarded,
+                    "wait_seconds": round(self._wait_seconds, 6)}
+
+    def close(self):
+        while True:
+            try:
+                connection = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            connection.close()
+            with self._lock:
+                self._opened -= 1
+
+class DatabaseCluster(object):
+    """A primary database and its read replicas.  Reads take the replicas in turn.  A replica that can't be reached is
+    skipped for retry_interval seconds, and reads fall back to the primary while no replica is available.  Writes
+    always go to the primary.  The pools only need checkout and release, so the asyncio server shares this class."""
+    def __init__(self, name, primary, replicas=None, retry_interval=10.0):
+        self.name = name
+        self.primary = primary
+        self.replicas = replicas or []
+        self._retry_interval = retry_interval
+        self._down_until = [0.0 for replica in self.replicas]
+        self._next = 0
+        self._failovers = 0
+        self._lock = threading.Lock()
 
     @staticmethod
-    def parse(json_str):
+    def createInstanceFromConfig(name, config, database_element, replica_elements, create_pool):
+        """Settings missing from database_element and each replica element are taken from the top level config."""
+        settings = dict(config)
+        settings.update(database_element)
+        replicas = []
+        for index, replica_element in enumerate(replica_elements):
+            replica_settings = dict(settings)
+            replica_settings.update(replica_element)
+            replicas.append(create_pool(replica_settings, name + "-replica-" + str(index)))
+        return DatabaseCluster(name, create_pool(settings, name), replicas,
+                               config.get("database_replica_retry_interval", 10.0))
+
+    def candidates(self, read):
+        """The pools to try in order: the available replicas, starting with the next in turn, then the primary."""
+        if not read or not self.replicas:
+            return [self.primary]
+        now = time.time()
+        with self._lock:
+            start = self._next
+            self._next = (self._next + 1) % len(self.replicas)
+            down_until = list(self._down_until)
+        count = len(self.replicas)
+        order = [(start + offset) % count for offset in range(count)]
+        return [self.replicas[index] for index in order if down_until[index] <= now] + [self.primary]
+
+    def markDown(self, pool, err):
+        index = self.replicas.index(pool)
+        logger.warning("Read replica %(name)s is unavailable for %(interval)s seconds: %(error)s" % {"name": self.name + "-replica-" + str(index), "interval": self._retry_interval, "error": err})
+        with self._lock:
+            self._down_until[index] = time.time() + self._retry_interval
+            self._failovers += 1
+
+    def checkout(self, read=False):
+        for pool in self.candidates(read):
+            try:
+                return pool.checkout()
+            except mysql.connector.Error as err:
+                if pool is self.primary:
+                    raise
+                self.markDown(pool, err)
+
+    def getPools(self):
+        return [(self.name, self.primary)] + [(self.name + "-replica-" + str(index), replica) for index, replica in enumerate(self.replicas)]
+
+    def getMetrics(self):
+        now = time.time()
+        with self._lock:
+            down_until = list(self._down_until)
+            failovers = self._failovers
+        replicas = []
+        for replica, until in zip(self.replicas, down_until):
+            metrics = replica.getMetrics()
+            metrics["available"] = until <= now
+            replicas.append(metrics)
+        return {"primary": self.primary.getMetrics(), "replicas": replicas, "failovers": failovers}
+
+    def close(self):
+        for name, pool in self.getPools():
+            pool.close()
+
+class ShardMap(object):
+    """Spreads an endpoint's rows over several databases by the hash of a key parameter.  Keys are hashed as text,
+    so 42 and "42" land on the same shard."""
+    def __init__(self, name, key, count):
+        self.name = name
+        self.key = key.upper()
+        self.count = count
+
+    def locate(self, parameters):
+        if self.key not in parameters:
+            raise MissingParameter(self.key)
+        value = parameters[self.key]
+        if not isinstance(value, (bytes, type(u""))):
+            value = str(value)
+        return (zlib.crc32(toBytes(value)) & 0xffffffff) % self.count
+
+class IngestQueueFull(Exception):
+    pass
+
+class PendingWrite(object):
+    """Lets a request thread wait for the batch containing its row when a verb acknowledges on flush."""
+    def __init__(self):
+        self.event = threading.Event()
+        self.status = False
+
+    def complete(self, status):
+        self.status = status
+        self.event.set()
+
+class BufferedWriter(object):
+    """Queues rows for one write verb and inserts them from a background thread with executemany, which
+    mysql.connector rewrites into a multi-row INSERT.  A batch is flushed once batch_size rows are queued or
+    flush_interval seconds after its first row arrived, whichever comes first."""
+    _STOP = object()
+
+    def __init__(self, name, plan, pool, commit=False, queue_size=10000, batch_size=500, flush_interval=0.05, ack="enqueue", flush_timeout=30.0):
+        self._name = name
+        self._plan = plan
+        self._pool = pool
+        self._commit = commit
+        # The queue itself is unbounded; submit() admits a whole request or none of it against queue_size.
+        self._queue = queue.Queue()
+        self._queue_size = queue_size
+        self._batch_size = max(1, batch_size)
+        self._flush_interval = flush_interval
+        self._ack_on_flush = ack == "flush"
+        self._flush_timeout = flush_timeout
+        self._stopping = False
+        self._lock = threading.Lock()
+        self._enqueued = 0
+        self._rejected = 0
+        self._batches = 0
+        self._flushed = 0
+        self._failed = 0
+        self.on_flush = None
+        self.observers = []
+        self._thread = threading.Thread(target=self.run, name="ingest " + name)
+        self._thread.daemon = True
+
+    @staticmethod
+    def createInstanceFromConfig(name, plan, pool, commit, buffered_element):
+        return BufferedWriter(name, plan, pool, commit,
+                              buffered_element.get("queueSize", 10000),
+                              buffered_element.get("batchSize", 500),
+                              buffered_element.get("flushInterval", 0.05),
+                              buffered_element.get("ack", "enqueue"),
+                              buffered_element.get("flushTimeout", 30.0))
+
+    def acksOnFlush(self):
+        return self._ack_on_flush
+
+    def start(self):
+        logger.info("Starting buffered writer: " + self._name)
+        self._thread.start()
+
+    def submit(self, rows):
+        # Only the values the query uses are queued, not every merged URL argument and header.
+        rows = [self._plan.bind(row) for row in rows]
+        pending = [PendingWrite() for row in rows] if self._ack_on_flush else [None for row in rows]
+        with self._lock:
+            # Only submitters add to the queue and they hold the lock, so the rows fit once this check passes.
+            if self._queue.qsize() + len(rows) > self._queue_size:
+                self._rejected += 1
+                raise IngestQueueFull(self._name)
+            for row, waiter in zip(rows, pending):
+                self._queue.put_nowait((row, waiter))
+            self._enqueued += len(rows)
+        if not self._ack_on_flush:
+            return True
+        deadline = time.time() + self._flush_timeout
+        for waiter in pending:
+            if not waiter.event.wait(max(0.0, deadline - time.time())):
+                logger.error("Timed out waiting for buffered write to flush: " + self._name)
+                return False
+            if not waiter.status:
+                return False
+        return True
+
+    def run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is self._STOP:
+                break
+            batch = [item]
+            deadline = time.time() + self._flush_interval
+            while len(batch) < self._batch_size:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is self._STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            self.flush(batch)
+        # Drain whatever was queued before the stop request.
+        batch = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not self._STOP:
+                batch.append(item)
+        for start in range(0, len(batch), self._batch_size):
+            self.flush(batch[start:start + self._batch_size])
+
+    def checkout(self):
+        while True:
+            try:
+                return self._pool.checkout()
+            except (ConnectionPoolTimeout, mysql.connector.Error) as err:
+                if self._stopping:
+                    return None
+                logger.error("Buffered writer %(name)s is unable to get a database connection: %(error)s" % {"name": self._name, "error": err})
+                time.sleep(1.0)
+
+    def flush(self, batch):
+        connection = self.checkout()
+        if connection is None:
+            statuses = [False for item in batch]
+        else:
+            try:
+                status, data = connection.executeMany(self._plan.sql, [row for row, waiter in batch], self._commit)
+                if status:
+                    statuses = [True for item in batch]
+                else:
+                    # Retry row by row so one bad row does not reject the rest of the batch.
+                    statuses = [connection.executePlan(self._plan, row, self._commit, bound=True)[0] for row, waiter in batch]
+            finally:
+                self._pool.release(connection)
+        if self.on_flush is not None:
+            self.on_flush()
+        failed = statuses.count(False)
+        with self._lock:
+            self._batches += 1
+            self._flushed += len(batch) - failed
+            self._failed += failed
+        if failed:
+            logger.error("Buffered writer %(name)s failed to write %(failed)s of %(count)s rows" % {"name": self._name, "failed": failed, "count": len(batch)})
+        for observer in self.observers:
+            observer.observe([row for (row, waiter), status in zip(batch, statuses) if status], self._plan.parameter_names)
+        for (row, waiter), status in zip(batch, statuses):
+            if waiter is not None:
+                waiter.complete(status)
+
+    def stop(self, timeout=30.0):
+        if self._stopping:
+            return
+        logger.info("Stopping buffered writer: " + self._name)
+        self._stopping = True
+        self._queue.put(self._STOP)
+        self._thread.join(timeout)
+
+    def getMetrics(self):
+        with self._lock:
+            return {"queued": self._queue.qsize(),
+                    "enqueued": self._enqueued,
+                    "rejected": self._rejected,
+                    "batches": self._batches,
+                    "flushed": self._flushed,
+                    "failed": self._failed}
+
+class SpoolSegment(object):
+    """One preallocated spool file, mapped into memory.  A record is a 4 byte length, a 4 byte CRC32 and the payload;
+    a zero length, or a record whose checksum doesn't match, marks the end of the segment."""
+    HEADER = struct.Struct("<II")
+
+    def __init__(self, path, size):
+        self.path = path
+        if not os.path.exists(path):
+            with open(path, "wb") as f:
+                f.truncate(size)
+        self._file = open(path, "r+b")
+        self.size = os.fstat(self._file.fileno()).st_size
+        self._map = mmap.mmap(self._file.fileno(), self.size)
+
+    def read(self, offset, limit=None):
+        """Returns (next_offset, payload) for up to limit records starting at offset."""
+        records = []
+        header_size = SpoolSegment.HEADER.size
+        while limit is None or len(records) < limit:
+            if offset + header_size > self.size:
+                break
+            length, checksum = SpoolSegment.HEADER.unpack(self._map[offset:offset + header_size])
+            end = offset + header_size + length
+            if length == 0 or end > self.size:
+                break
+            payload = self._map[offset + header_size:end]
+            if zlib.crc32(payload) & 0xffffffff != checksum:
+                break
+            records.append((end, payload))
+            offset = end
+        return records
+
+    def append(self, offset, payload):
+        """Writes a record at offset and returns the offset after it, or None if it doesn't fit."""
+        end = offset + SpoolSegment.HEADER.size + len(payload)
+        if end > self.size:
+            return None
+        self._map[offset + SpoolSegment.HEADER.size:end] = payload
+        # The header goes in last, so a record is never seen before its payload is complete.
+        self._map[offset:offset + SpoolSegment.HEADER.size] = SpoolSegment.HEADER.pack(len(payload), zlib.crc32(payload) & 0xffffffff)
+        return end
+
+    def truncate(self, offset):
+        self._map[offset:self.size] = b"\0" * (self.size - offset)
+
+    def sync(self):
+        self._map.flush()
+
+    def close(self):
+        self._map.flush()
+        self._map.close()
+        self._file.close()
+
+class WriteSpool(object):
+    """A durable queue of rows for one write verb, kept in append-only, memory-mapped segment files.  A request is
+    acknowledged as soon as its rows are appended; a replayer thread writes them to MySQL in batches of batch_size,
+    at most replay_rate rows a second, and backs off while the database can't be reached.
+
+    The replay position is saved after each batch, so every row is written at least once.  Requests that repeat an
+    Idempotency-Key seen in the last dedupe_window requests are not appended again, and the key is passed to the
+    query as IDEMPOTENCY_KEY so a unique index can drop rows replayed twice after a crash.
+
+    Each process claims a subdirectory of directory with a file lock, so a worker that is restarted or replaced
+    picks up the rows an earlier one left behind."""
+    CHECKPOINT = "checkpoint"
+    REJECTED = "rejected.ndjson"
+
+    def __init__(self, name, directory, plan, commit=False, segment_size=16777216, max_bytes=1073741824, batch_size=500,
+                 replay_rate=1000, sync_interval=1.0, idempotency_header="Idempotency-Key", dedupe_window=100000):
+        self._name = name
+        self._base_directory = directory
+        self._plan = plan
+        self._commit = commit
+        self._segment_size = segment_size
+        self._max_segments = max(2, max_bytes // segment_size)
+        self._batch_size = max(1, batch_size)
+        self._replay_rate = replay_rate
+        self._sync_interval = sync_interval
+        self.idempotency_header = idempotency_header
+        self._dedupe_window = dedupe_window
+        self._keys = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self.run, name="spool " + name)
+        self._thread.daemon = True
+        self._directory = None
+        self._lock_file = None
+        self._segments = {}
+        self._write_sequence = 0
+        self._write_offset = 0
+        self._checkpoint = (0, 0)
+        self._last_sync = time.time()
+        self._unsynced = False
+        self._pending = 0
+        self._appended = 0
+        self._duplicates = 0
+        self._replayed = 0
+        self._rejected = 0
+        self._retries = 0
+        self.get_pool = None
+        self.on_flush = None
+        self.observers = []
+
+    @staticmethod
+    def createInstanceFromConfig(name, plan, commit, spool_element):
+        return WriteSpool(name, spool_element["directory"], plan, commit,
+                          spool_element.get("segmentSize", 16777216),
+                          spool_element.get("maxBytes", 1073741824),
+                          spool_element.get("batchSize", 500),
+                          spool_element.get("replayRate", 1000),
+                          spool_element.get("syncInterval", 1.0),
+                          spool_element.get("idempotencyHeader", "Idempotency-Key"),
+                          spool_element.get("dedupeWindow", 100000))
+
+    def syncsEveryWrite(self):
+        return self._sync_interval <= 0
+
+    def claimDirectory(self):
+        if not os.path.isdir(self._base_directory):
+            os.makedirs(self._base_directory)
+        names = sorted([name for name in os.listdir(self._base_directory) if name.isdigit()], key=int)
+        for name in names + [str(int(names[-1]) + 1 if names else 0)]:
+            directory = os.path.join(self._base_directory, name)
+            if not os.path.isdir(directory):
+                os.mkdir(directory)
+            lock_file = open(os.path.join(directory, "lock"), "a")
+            if fcntl is None:
+                return directory, lock_file
+            try:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return directory, lock_file
+            except (IOError, OSError):
+                lock_file.close()
+
+    def segmentPath(self, sequence):
+        return os.path.join(self._directory, "%012d.seg" % sequence)
+
+    def getSegment(self, sequence):
+        segment = self._segments.get(sequence)
+        if segment is None:
+            segment = SpoolSegment(self.segmentPath(sequence), self._segment_size)
+            self._segments[sequence] = segment
+        return segment
+
+    def dropSegment(self, sequence):
+        segment = self._segments.pop(sequence, None)
+        if segment is not None:
+            segment.close()
+        if os.path.exists(self.segmentPath(sequence)):
+            os.remove(self.segmentPath(sequence))
+
+    def open(self):
+        """Claims a directory, finds where replay and appends left off, and starts the replayer."""
+        self._directory, self._lock_file = self.claimDirectory()
+        sequences = sorted([int(name[:-4]) for name in os.listdir(self._directory) if name.endswith(".seg")])
+        checkpoint_path = os.path.join(self._directory, WriteSpool.CHECKPOINT)
+        if os.path.exists(checkpoint_path):
+            with open(checkpoint_path, "r") as f:
+                checkpoint = json.load(f)
+            self._checkpoint = (checkpoint["segment"], checkpoint["offset"])
+        elif sequences:
+            self._checkpoint = (sequences[0], 0)
+        for sequence in sequences:
+            if sequence < self._checkpoint[0]:
+                self.dropSegment(sequence)
+        sequences = [sequence for sequence in sequences if sequence >= self._checkpoint[0]] or [self._checkpoint[0]]
+        for sequence in sequences:
+            offset = self._checkpoint[1] if sequence == self._checkpoint[0] else 0
+            records = self.getSegment(sequence).read(offset)
+            for next_offset, payload in records:
+                self.rememberKey(json.loads(payload.decode("utf-8"))[1])
+            self._pending += len(records)
+            self._write_sequence = sequence
+            self._write_offset = records[-1][0] if records else offset
+            if sequence != sequences[-1]:
+                self._segments.pop(sequence).close()
+        # Anything after the last good record is a write cut short by a crash.
+        self.getSegment(self._write_sequence).truncate(self._write_offset)
+        logger.info("Spool {} has {} rows to replay in {}".format(self._name, self._pending, self._directory))
+        self._thread.start()
+
+    def rememberKey(self, key):
+        if key is None or self._dedupe_window <= 0:
+            return
+        self._keys[key] = True
+        while len(self._keys) > self._dedupe_window:
+            self._keys.popitem(last=False)
+
+    def submit(self, rows, shards, key=None):
+        """Appends rows and their shards.  Returns False, without appending, if key was already seen."""
+        payloads = [toBytes(json.dumps([shard, key, self._plan.bind(row)], default=str)) for row, shard in zip(rows, shards)]
+        with self._lock:
+            if key is not None and key in self._keys:
+                self._duplicates += 1
+                return False
+            # A request is appended whole or not at all, so a client that is told to retry never duplicates rows.
+            self.checkSpace(payloads)
+            for payload in payloads:
+                segment = self.getSegment(self._write_sequence)
+                end = segment.append(self._write_offset, payload)
+                if end is None:
+                    # The full segment stays mapped until replay has passed it, since the replayer may be reading it.
+                    segment.sync()
+                    self._write_sequence += 1
+                    self._write_offset = 0
+                    end = self.getSegment(self._write_sequence).append(0, payload)
+                self._write_offset = end
+                self._pending += 1
+                self._appended += 1
+            self.rememberKey(key)
+            self._unsynced = True
+            if self._sync_interval <= 0:
+                self.getSegment(self._write_sequence).sync()
+                self._unsynced = False
+        self._wakeup.set()
+        return True
+
+    def checkSpace(self, payloads):
+        """Raises UploadTooLarge or IngestQueueFull, before anything is appended, unless all of payloads fit.  Called
+        with the lock held; replay only ever frees segments, so the answer holds until the lock is released."""
+        sequence, offset = self._write_sequence, self._write_offset
+        size = self.getSegment(sequence).size
+        for payload in payloads:
+            length = SpoolSegment.HEADER.size + len(payload)
+            if length > self._segment_size:
+                raise UploadTooLarge("row is larger than a spool segment")
+            if offset + length > size:
+                if sequence - self._checkpoint[0] + 1 >= self._max_segments:
+                    raise IngestQueueFull(self._name)
+                sequence, offset, size = sequence + 1, 0, self._segment_size
+            offset += length
+
+    def syncIfDue(self):
+        with self._lock:
+            if self._unsynced and time.time() - self._last_sync >= self._sync_interval:
+                self.getSegment(self._write_sequence).sync()
+                self._unsynced = False
+                self._last_sync = time.time()
+
+    def readBatch(self):
+        """Returns up to batch_size (sequence, next_offset, payload) records from the replay position on."""
+        batch = []
+        sequence, offset = self._checkpoint
+        while len(batch) < self._batch_size:
+            with self._lock:
+                if sequence == self._write_sequence and offset >= self._write_offset:
+                    break
+                active = sequence == self._write_sequence
+                limit = self._write_offset if active else None
+                segment = self.getSegment(sequence)
+            records = segment.read(offset, self._batch_size - len(batch))
+            if limit is not None:
+                records = [record for record in records if record[0] <= limit]
+            batch.extend([(sequence, next_offset, payload) for next_offset, payload in records])
+            if records:
+                offset = records[-1][0]
+            if active or (records and len(batch) >= self._batch_size):
+                break
+            if not records:
+                sequence, offset = sequence + 1, 0
+        return batch
+
+    def saveCheckpoint(self, sequence, offset):
+        path = os.path.join(self._directory, WriteSpool.CHECKPOINT)
+        with open(path + ".tmp", "w") as f:
+            json.dump({"segment": sequence, "offset": offset}, f)
+        os.rename(path + ".tmp", path)
+        with self._lock:
+            for finished in range(self._checkpoint[0], sequence):
+                self.dropSegment(finished)
+            self._checkpoint = (sequence, offset)
+
+    def run(self):
+        delay = 0.0
+        while not self._stopping.is_set():
+            self.syncIfDue()
+            batch = self.readBatch()
+            if not batch:
+                self._wakeup.wait(0.5 if self._sync_interval <= 0 else min(0.5, self._sync_interval))
+                self._wakeup.clear()
+                continue
+            began = time.time()
+            try:
+                written = self.write([json.loads(payload.decode("utf-8")) for sequence, offset, payload in batch])
+            except Exception:
+                # The spooled rows are safe on disk, so keep the replayer alive and try the batch again.
+                logger.exception("Spool {} failed to replay a batch".format(self._name))
+                written = False
+            if not written:
+                with self._lock:
+                    self._retries += 1
+                delay = min(30.0, max(0.5, delay * 2))
+                logger.warning("Spool {} can't reach the database, retrying in {:.1f} seconds".format(self._name, delay))
+                self._stopping.wait(delay * random.uniform(0.5, 1.0))
+                continue
+            delay = 0.0
+            sequence, offset, payload = batch[-1]
+            self.saveCheckpoint(sequence, offset)
+            with self._lock:
+                self._pending -= len(batch)
+                self._replayed += len(batch)
+            if self.on_flush is not None:
+                self.on_flush()
+            if self._replay_rate:
+                self._stopping.wait(max(0.0, len(batch) / float(self._replay_rate) - (time.time() - began)))
+
+    def write(self, records):
+        """Writes a batch, one executemany per shard.  Returns False if the database couldn't be reached; rows it
+        refuses one by one are set aside in rejected.ndjson."""
+        groups = collections.OrderedDict()
+        for shard, key, values in records:
+            groups.setdefault(shard, []).append(tuple(values))
+        for shard, rows in groups.items():
+            pool = self.get_pool(shard)
+            try:
+                connection = pool.checkout()
+            except (ConnectionPoolTimeout, mysql.connector.Error) as err:
+                logger.error("Spool {} is unable to get a database connection: {}".format(self._name, err))
+                return False
+            try:
+                written = rows
+                status, data = connection.executeMany(self._plan.sql, rows, self._commit)
+                if not status:
+                    if connection.isBroken():
+                        return False
+                    # Retry row by row so one bad row does not hold up the rest of the spool.
+                    written = []
+                    rejected = []
+                    for row in rows:
+                        if connection.executePlan(self._plan, row, self._commit, bound=True)[0]:
+                            written.append(row)
+                        elif connection.isBroken():
+                            return False
+                        else:
+                            rejected.append(row)
+                    self.reject(shard, rejected)
+            finally:
+                pool.release(connection)
+            for observer in self.observers:
+                observer.observe(written, self._plan.parameter_names)
+        return True
+
+    def reject(self, shard, rows):
+        if not rows:
+            return
+        logger.error("Spool {} set aside {} rows the database refused".format(self._name, len(rows)))
+        with open(os.path.join(self._directory, WriteSpool.REJECTED), "a") as f:
+            for row in rows:
+                f.write(json.dumps({"shard": shard, "row": dict(zip(self._plan.parameter_names, row))}, default=str) + "\n")
+        with self._lock:
+            self._rejected += len(rows)
+
+    def stop(self, timeout=30.0):
+        if self._directory is None:
+            return
+        logger.info("Stopping spool: " + self._name)
+        self._stopping.set()
+        self._wakeup.set()
+        self._thread.join(timeout)
+        with self._lock:
+            for sequence in list(self._segments):
+                self._segments.pop(sequence).close()
+        self._lock_file.close()
+        self._directory = None
+
+    def getMetrics(self):
+        with self._lock:
+            return {"pending": self._pending,
+                    "segments": self._write_sequence - self._checkpoint[0] + 1,
+                    "appended": self._appended,
+                    "duplicates": self._duplicates,
+                    "replayed": self._replayed,
+                    "rejected": self._rejected,
+                    "retries": self._retries}
+
+class InvalidUpload(Exception):
+    pass
+
+class UploadTooLarge(Exception):
+    pass
+
+class BulkInsert(object):
+    """How a write verb handles a list body: at most max_rows rows, bound row by row and written chunk_size rows per
+    executemany, all in one transaction.  With a load block, NDJSON and CSV bodies are loaded with LOAD DATA."""
+    def __init__(self, chunk_size=500, max_rows=100000, load=None):
+        self.chunk_size = max(1, chunk_size)
+        self.max_rows = max_rows
+        self.load = load
+
+    @staticmethod
+    def createInstanceFromConfig(bulk_element):
+        load = BulkLoad.createInstanceFromConfig(bulk_element["load"]) if "load" in bulk_element else None
+        return BulkInsert(bulk_element.get("chunkSize", 500), bulk_element.get("maxRows", 100000), load)
+
+    def checkSize(self, rows):
+        if len(rows) > self.max_rows:
+            raise UploadTooLarge("{} rows, the limit is {}".format(len(rows), self.max_rows))
+
+class BulkLoad(object):
+    """Loads NDJSON and CSV uploads into one table.  The body is rewritten line by line into a temporary file in the
+    format the LOAD DATA statement expects, so the upload is never held in memory."""
+    FORMATS = {"application/x-ndjson": "ndjson", "text/csv": "csv"}
+    NAME_PATTERN = re.compile(r"^\w+$")
+
+    def __init__(self, table, columns, max_bytes=1073741824):
+        names = table.split(".") + list(columns)
+        for name in names:
+            if not BulkLoad.NAME_PATTERN.match(name):
+                raise Exception("Invalid table or column name for bulk load: " + name)
+        self.table = ".".join(["`" + name + "`" for name in table.split(".")])
+        self.columns = [column.upper() for column in columns]
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def createInstanceFromConfig(load_element):
+        return BulkLoad(load_element["table"], load_element["columns"], load_element.get("maxBytes", 1073741824))
+
+    def createStatement(self, columns):
+        return ("LOAD DATA LOCAL INFILE %s INTO TABLE " + self.table + " CHARACTER SET utf8mb4 "
+                "FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' ESCAPED BY '' LINES TERMINATED BY '\\n' "
+                "(" + ", ".join(["`" + column + "`" for column in columns]) + ")")
+
+    @staticmethod
+    def formatField(value):
+        # With ESCAPED BY '' an unquoted NULL loads as NULL and quotes are escaped by doubling them.
+        if value is None:
+            return "NULL"
+        if isinstance(value, bool):
+            return "1" if value else "0"
+        if isinstance(value, (int, float)):
+            return repr(value)
+        if isinstance(value, (dict, list)):
+            value = json.dumps(value)
+        elif not isinstance(value, type(u"")):
+            value = str(value)
+        return '"' + value.replace('"', '""') + '"'
+
+    def readLines(self, stream):
+        size = 0
+        for line in iter(stream.readline, b""):
+            size += len(line)
+            if size > self.max_bytes:
+                raise UploadTooLarge("the upload is larger than {} bytes".format(self.max_bytes))
+            # csv wants bytes on Python 2 and text on Python 3.
+            yield line if isinstance(line, str) else line.decode("utf-8")
+
+    def readNdjson(self, lines):
+        columns = self.columns
+        allowed = frozenset(columns)
+        for number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as err:
+                raise InvalidUpload("line {}: {}".format(number, err))
+            if not isinstance(row, dict):
+                raise InvalidUpload("line {} is not an object".format(number))
+            row = dict([(key.upper(), value) for key, value in row.items()])
+            unknown = [key for key in row if key not in allowed]
+            if unknown:
+                raise InvalidUpload("line {} has unknown column {}".format(number, unknown[0]))
+            yield [row.get(column) for column in columns]
+
+    def readCsv(self, lines, header):
+        for number, row in enumerate(csv.reader(lines), 2):
+            if not row:
+                continue
+            if len(row) != len(header):
+                raise InvalidUpload("line {} has {} fields, the header has {}".format(number, len(row), len(header)))
+            yield [field if field != "" else None for field in row]
+
+    def spool(self, stream, mimetype):
+        """Copies an upload into a temporary file.  Returns the file's path, the columns it holds and its row count."""
+        lines = self.readLines(stream)
+        if BulkLoad.FORMATS[mimetype] == "csv":
+            header = [column.strip().upper() for column in next(csv.reader(lines), [])]
+            for column in header:
+                if column not in self.columns:
+                    raise InvalidUpload("unknown column " + column)
+            if not header or len(set(header)) != len(header):
+                raise InvalidUpload("the first line must name each column once")
+            columns, rows = header, self.readCsv(lines, header)
+        else:
+            columns, rows = self.columns, self.readNdjson(lines)
+        handle, path = tempfile.mkstemp(prefix="ird-load-", suffix=".csv")
+        count = 0
+        complete = False
+        try:
+            with os.fdopen(handle, "wb") as f:
+                for row in rows:
+                    f.write(toBytes(",".join([BulkLoad.formatField(value) for value in row]) + "\n"))
+                    count += 1
+            complete = True
+        finally:
+            if not complete:
+                os.remove(path)
+        return path, columns, count
+
+def encodeValue(value):
+    # Dates are written the way flask.jsonify writes them so clients see the same format from every encoder.
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return http_date(value.timetuple())
+    if isinstance(value, (decimal.Decimal, datetime.time, datetime.timedelta, uuid.UUID)):
+        return str(value)
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode("utf-8", "replace")
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    raise TypeError(repr(value) + " is not JSON serializable")
+
+def encodeJsonFloat(value):
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "Infinity" if value > 0 else "-Infinity"
+    return float.__repr__(value)
+
+# Cells of these exact types are written without going through the encoder, as the json module writes them.
+JSON_CELL_ENCODERS = {type(None): lambda value: "null", bool: lambda value: "true" if value else "false",
+                      int: int.__repr__, float: encodeJsonFloat, type(u""): json.encoder.encode_basestring_ascii}
+
+def encodeCborHead(major, length):
+    if length < 24:
+        return struct.pack(">B", major << 5 | length)
+    for info, size_format, limit in [(24, "B", 0x100), (25, "H", 0x10000), (26, "I", 0x100000000)]:
+        if length < limit:
+            return struct.pack(">B" + size_format, major << 5 | info, length)
+    return struct.pack(">BQ", major << 5 | 27, length)
+
+class FormatAdapter(object):
+    """Turns query results into a response body.  Subclasses provide the mimetypes they answer to and the encoder.
+
+    Rows are written straight from their tuples.  The keys of a result are encoded once into a row template with a
+    slot for each value, and a body is the template repeated for every row, filled in with the encoded cells in one
+    formatting operation, so no dict is built per row.  Bodies are built from pieces that subclasses encode with
+    _encodePiece and _encodeCell, joined and turned into bytes by _finish."""
+    mimetype = None
+    mimetypes = ()
+    # Separator between rows when a result is streamed as a sequence of encoded rows.
+    separator = b""
+    _empty = b""
+    _line_separator = b""
+    # Between the rows of a whole body; binary formats have an array header instead.
+    _rows_separator = b""
+    # Encoders for cells of exact types that are faster than _encodeCell.
+    _cell_encoders = {}
+
+    def encode(self, obj):
+        return self._dumps(obj)
+
+    def _finish(self, body):
+        return body
+
+    def _literal(self, text):
+        return toBytes(text)
+
+    def encodeKeys(self, column_names):
+        """The encoded key of each column, the first after the header of a map with one key per column, and what
+        follows the last value."""
+        keys = [self._encodePiece(name) for name in column_names]
+        if not keys:
+            return keys, self._mapHeader(0)
+        keys[0] = self._mapHeader(len(keys)) + keys[0]
+        return keys, b""
+
+    def createRowTemplate(self, column_names):
+        """A format string that writes one row as an object keyed by column_names."""
+        keys, closing = self.encodeKeys(column_names)
+        percent, slot = self._literal("%"), self._literal("%s")
+        escape = lambda piece: piece.replace(percent, percent + percent)
+        return self._empty.join([escape(key) + slot for key in keys]) + escape(closing)
+
+    def encodeRows(self, template, rows, separator):
+        """The rows written with a row template and joined by separator."""
+        if not rows:
+            return self._empty
+        get = self._cell_encoders.get
+        encode = self._encodeCell
+        return separator.join([template] * len(rows)) % tuple([get(type(value), encode)(value) for row in rows for value in row])
+
+    def serialize(self, status, result=None, extra=None, columnar=False):
+        if result is None or columnar:
+            body = {"status": status, "data": None if result is None else {"columns": result.column_names, "rows": result.rows}}
+            if extra:
+                body.update(extra)
+            return self._dumps(body)
+        rows = self.encodeRows(self.createRowTemplate(result.column_names), result.rows, self._rows_separator)
+        return self.serializeRows(status, len(result.rows), rows, extra)
+
+    def serializeRows(self, status, row_count, rows, extra=None):
+        """The body {"status": status, "data": [...], ...extra} around row_count rows that are already encoded."""
+        extra = extra or {}
+        pieces = [self._mapHeader(2 + len(extra)), self._dumps("status"), self._dumps(status), self._dumps("data"), self._arrayHeader(row_count), rows]
+        for key, value in extra.items():
+            pieces.extend([self._dumps(key), self._dumps(value)])
+        return b"".join(pieces)
+
+    def serializeLines(self, column_names, rows, columnar=False, template=None):
+        if columnar:
+            body = self._line_separator.join([self._encodePiece(row) for row in rows])
+        else:
+            body = self.encodeRows(template or self.createRowTemplate(column_names), rows, self._line_separator)
+        return self._finish(body + self._line_separator)
+
+class JsonAdapter(FormatAdapter):
+    """Serializes query results to JSON with the fastest encoder available: orjson, then simplejson's C speedups,
+    then the standard library's C encoder."""
+    mimetype = "application/json"
+    mimetypes = ("application/json",)
+    separator = b"\n"
+
+    def __init__(self, encoder="auto"):
+        self.encoder, self._encodePiece, self._encodeCell, text = JsonAdapter.createEncoder(encoder)
+        # The json and simplejson encoders write text, so their pieces are joined as text and encoded once per body.
+        self._literal = (lambda value: value) if text else toBytes
+        self._finish = toBytes if text else (lambda body: body)
+        self._cell_encoders = JSON_CELL_ENCODERS if text else {}
+        self._dumps = lambda obj: self._finish(self._encodePiece(obj))
+        self._empty, self._comma, self._colon, self._line_separator = [self._literal(value) for value in ["", ",", ":", "\n"]]
+        self._object_open, self._object_close, self._empty_object = [self._literal(value) for value in ["{", "}", "{}"]]
+        self._body_open, self._rows_open, self._rows_close = [self._literal(value) for value in ['{"status":', ',"data":[', "]"]]
+        self._rows_separator = self._comma
+
+    @staticmethod
+    def createEncoder(name):
+        """The encoder's name, its object and cell encoders, and whether they write text rather than bytes."""
+        if name in ("auto", "orjson"):
+            try:
+                import orjson
+                option = orjson.OPT_PASSTHROUGH_DATETIME
+                dumps = lambda obj: orjson.dumps(obj, default=encodeValue, option=option)
+                return "orjson", dumps, dumps, False
+            except ImportError:
+                if name == "orjson":
+                    logger.warning("orjson is not installed, falling back to the json module.")
+        if name in ("auto", "simplejson"):
+            try:
+                import simplejson
+                encode = simplejson.JSONEncoder(default=encodeValue, separators=(",", ":"), use_decimal=False).encode
+                return "simplejson", encode, encode, True
+            except ImportError:
+                if name == "simplejson":
+                    logger.warning("simplejson is not installed, falling back to the json module.")
+        encode = json.JSONEncoder(default=encodeValue, separators=(",", ":")).encode
+        return "json", encode, encode, True
+
+    def encodeKeys(self, column_names):
+        if not column_names:
+            return [], self._empty_object
+        return [(self._comma if index else self._object_open) + self._encodePiece(name) + self._colon
+                for index, name in enumerate(column_names)], self._object_close
+
+    def serializeRows(self, status, row_count, rows, extra=None):
+        pieces = [self._body_open, self._encodePiece(status), self._rows_open, rows, self._rows_close]
+        for key, value in (extra or {}).items():
+            pieces.extend([self._comma, self._encodePiece(key), self._colon, self._encodePiece(value)])
+        pieces.append(self._object_close)
+        return self._finish(self._empty.join(pieces))
+
+    def serializeChunk(self, column_names, rows, columnar=False, template=None):
+        # The encoded rows without the list brackets, so chunks can be joined into one streamed array.
+        if columnar:
+            return self._finish(self._encodePiece(rows)[1:-1])
+        return self._finish(self.encodeRows(template or self.createRowTemplate(column_names), rows, self._comma))
+
+    def parse(self, json_str):
         if json_str:
-            return json.loads(json_str, encoding="utf-8")
+            return json.loads(json_str)
         else:
             return {}
 
+class MessagePackAdapter(FormatAdapter):
+    mimetype = "application/msgpack"
+    mimetypes = ("application/msgpack", "application/x-msgpack")
+
+    def __init__(self):
+        import msgpack
+        self._msgpack = msgpack
+        self._dumps = lambda obj: msgpack.packb(obj, default=encodeValue, use_bin_type=True)
+        self._encodePiece = self._encodeCell = self._dumps
+
+    def _mapHeader(self, length):
+        return self._msgpack.Packer().pack_map_header(length)
+
+    def _arrayHeader(self, length):
+        return self._msgpack.Packer().pack_array_header(length)
+
+    def parse(self, data):
+        if data:
+            return self._msgpack.unpackb(data, raw=False)
+        else:
+            return {}
+
+class UtcZone(datetime.tzinfo):
+    """UTC as a tzinfo; datetime.timezone.utc only exists on Python 3."""
+    def utcoffset(self, value):
+        return datetime.timedelta(0)
+
+    def dst(self, value):
+        return datetime.timedelta(0)
+
+    def tzname(self, value):
+        return "UTC"
+
+UTC = UtcZone()
+
+class CborAdapter(FormatAdapter):
+    mimetype = "application/cbor"
+    mimetypes = ("application/cbor",)
+
+    def __init__(self):
+        import cbor2
+        self._cbor2 = cbor2
+        # CBOR has native date and decimal types.  MySQL datetimes are naive, so they are tagged as UTC.
+        self._dumps = lambda obj: cbor2.dumps(obj, timezone=UTC, default=lambda encoder, value: encoder.encode(encodeValue(value)))
+        self._encodePiece = self._encodeCell = self._dumps
+
+    def _mapHeader(self, length):
+        return encodeCborHead(5, length)
+
+    def _arrayHeader(self, length):
+        return encodeCborHead(4, length)
+
+    def parse(self, data):
+        if data:
+            return self._cbor2.loads(data)
+        else:
+            return {}
+
+class FormatAdapters(object):
+    """The adapters a server can speak, looked up by Content-Type for request bodies and by Accept for responses."""
+    def __init__(self, default_adapter):
+        self.default = default_adapter
+        self._adapters = collections.OrderedDict()
+        self.add(default_adapter)
+
+    @staticmethod
+    def createInstanceFromConfig(json_adapter):
+        adapters = FormatAdapters(json_adapter)
+        for adapter_class, module in [(MessagePackAdapter, "msgpack"), (CborAdapter, "cbor2")]:
+            try:
+                adapters.add(adapter_class())
+            except ImportError:
+                logger.info(module + " is not installed, " + adapter_class.mimetype + " is disabled.")
+        return adapters
+
+    def add(self, adapter):
+        for mimetype in adapter.mimetypes:
+            self._adapters[mimetype] = adapter
+
+    def forContentType(self, mimetype):
+        return self._adapters.get(mimetype)
+
+    def negotiate(self, accept):
+        if not accept:
+            return self.default
+        best = parse_accept_header(accept, MIMEAccept).best_match(list(self._adapters.keys()), default=self.default.mimetype)
+        return self._adapters.get(best, self.default)
+
+class ResponseCompressor(object):
+    """Compresses response bodies of at least minimum_size bytes with gzip or deflate, whichever the client prefers.
+    Streamed bodies are compressed chunk by chunk so rows still reach the client as they are read."""
+    def __init__(self, minimum_size=1024, level=6):
+        self._minimum_size = minimum_size
+        self._level = level
+
+    @staticmethod
+    def createInstanceFromConfig(compression_element):
+        if compression_element is False:
+            return None
+        if not isinstance(compression_element, dict):
+            compression_element = {}
+        return ResponseCompressor(compression_element.get("minimumSize", 1024), compression_element.get("level", 6))
+
+    def chooseEncoding(self, accept_encoding):
+        accepted = parse_accept_header(accept_encoding)
+        for encoding in ["gzip", "deflate"]:
+            if accepted[encoding] > 0:
+                return encoding
+        return None
+
+    def createCompressor(self, encoding):
+        if encoding == "gzip":
+            return zlib.compressobj(self._level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return zlib.compressobj(self._level)
+
+    def compress(self, response, accept_encoding):
+        if response.status_code < 200 or response.status_code in (204, 304) or "Content-Encoding" in response.headers:
+            return response
+        # Events are small and sent one at a time, and some proxies hold back a compressed event stream.
+        if response.mimetype == EVENT_STREAM:
+            return response
+        response.vary.add("Accept-Encoding")
+        encoding = self.chooseEncoding(accept_encoding) if accept_encoding else None
+        if encoding is None:
+            return response
+        if response.is_streamed:
+            response.response = self.compressStream(response.response, encoding)
+            response.headers.pop("Content-Length", None)
+        else:
+            data = response.get_data()
+            if len(data) < self._minimum_size:
+                return response
+            compressor = self.createCompressor(encoding)
+            response.set_data(compressor.compress(data) + compressor.flush())
+        response.headers["Content-Encoding"] = encoding
+        etag = response.headers.get("ETag")
+        if etag and not etag.startswith("W/"):
+            # The compressed bytes differ from the ones the strong ETag was computed over.
+            response.headers["ETag"] = "W/" + etag
+        return response
+
+    def compressStream(self, chunks, encoding):
+        compressor = self.createCompressor(encoding)
+        try:
+            for chunk in chunks:
+                if not isinstance(chunk, bytes):
+                    chunk = chunk.encode("utf-8")
+                data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+                if data:
+                    yield data
+            yield compressor.flush()
+        finally:
+            if hasattr(chunks, "close"):
+                chunks.close()
+
+class CachedResponse(object):
+    def __init__(self, body, mimetype, expires):
+        self.body = body
+        self.mimetype = mimetype
+        self.expires = expires
+        self.etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+
+    def matches(self, if_none_match):
+        if not if_none_match:
+            return False
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in tags or self.etag in tags or "W/" + self.etag in tags
+
+    def createResponse(self, if_none_match=None):
+        if self.matches(if_none_match):
+            response = Response(status=304)
+        else:
+            response = Response(self.body, 200, mimetype=self.mimetype)
+        response.headers['ETag'] = self.etag
+        response.headers['Cache-Control'] = 'private, no-cache, no-transform'
+        return response
+
+class ResponseCache(object):
+    """A size bounded LRU of rendered GET responses keyed on the query and the values bound to it.  Entries expire
+    after ttl seconds or when a write to one of the invalidating endpoints clears the cache."""
+    def __init__(self, ttl=5.0, max_entries=1000, invalidated_by=None):
+        self.ttl = ttl
+        self.max_entries = max(1, max_entries)
+        self.invalidated_by = invalidated_by
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._hits = 0
+        self._misses = 0
+        self._invalidations = 0
+
+    @staticmethod
+    def createInstanceFromConfig(cache_element):
+        return ResponseCache(cache_element.get("ttl", 5.0),
+                             cache_element.get("maxEntries", 1000),
+                             cache_element.get("invalidatedBy"))
+
+    def createKey(self, plan, parameters):
+        return plan.createKey(parameters)
+
+    def getGeneration(self):
+        return self._generation
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or entry.expires <= now:
+                self._misses += 1
+                return None
+            self._entries[key] = entry
+            self._hits += 1
+            return entry
+
+    def put(self, key, body, mimetype, generation):
+        entry = CachedResponse(body, mimetype, time.time() + self.ttl)
+        with self._lock:
+            # Skip storing a result that was read before a write invalidated the cache.
+            if generation == self._generation:
+                self._entries.pop(key, None)
+                self._entries[key] = entry
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return entry
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+            self._invalidations += 1
+
+    def getMetrics(self):
+        with self._lock:
+            return {"entries": len(self._entries),
+                    "hits": self._hits,
+                    "misses": self._misses,
+                    "invalidations": self._invalidations}
+
+class Flight(object):
+    """One query in progress, and the response it produced once done is set."""
+    __slots__ = ("done", "status_code", "body", "headers", "callbacks")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.status_code = None
+        self.body = None
+        self.headers = None
+        self.callbacks = []
+
+    def createResponse(self):
+        return Response(self.body, self.status_code, headers=self.headers)
+
+class SingleFlight(object):
+    """Lets concurrent identical GET requests share one query.  The first request for a key runs it, and requests
+    that arrive before it finishes wait up to timeout seconds for its response instead of running the query again.
+    A write to one of the invalidating endpoints lets the requests after it start a new query."""
+    def __init__(self, timeout=30.0, invalidated_by=None):
+        self.timeout = timeout
+        self.invalidated_by = invalidated_by
+        self._flights = {}
+        self._lock = threading.Lock()
+        self._queries = 0
+        self._coalesced = 0
+        self._timeouts = 0
+
+    @staticmethod
+    def createInstanceFromConfig(single_flight_element):
+        if not isinstance(single_flight_element, dict):
+            single_flight_element = {}
+        return SingleFlight(single_flight_element.get("timeout", 30.0), single_flight_element.get("invalidatedBy"))
+
+    def join(self, key):
+        """Returns the flight for key and whether the caller leads it, in which case it must land it."""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                self._coalesced += 1
+                return flight, False
+            flight = Flight()
+            self._flights[key] = flight
+            self._queries += 1
+            return flight, True
+
+    def land(self, key, flight, response):
+        """Hands the leader's response to the waiting requests.  Without one they run the query themselves."""
+        if response is not None and not response.is_streamed:
+            flight.status_code = response.status_code
+            flight.body = response.get_data()
+            flight.headers = [(name, value) for name, value in response.headers.items() if name != "Content-Length"]
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            flight.done.set()
+            callbacks, flight.callbacks = flight.callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def onLanding(self, flight, callback):
+        """Calls callback once flight has landed, for waiters that can't block in wait()."""
+        with self._lock:
+            if not flight.done.is_set():
+                flight.callbacks.append(callback)
+                return
+        callback()
+
+    def wait(self, flight):
+        """The response of a flight the caller joined, or None if it timed out or the leader had none."""
+        if not flight.done.wait(self.timeout):
+            self.timedOut()
+            return None
+        return flight.createResponse() if flight.body is not None else None
+
+    def timedOut(self):
+        with self._lock:
+            self._timeouts += 1
+
+    def invalidate(self):
+        with self._lock:
+            self._flights.clear()
+
+    def getMetrics(self):
+        with self._lock:
+            return {"in_flight": len(self._flights), "queries": self._queries, "coalesced": self._coalesced, "timeouts": self._timeouts}
+
+def parseDuration(value):
+    """Seconds in a duration such as 90, "30s", "5m", "1h" or "1d"."""
+    match = re.match(r"^\s*(\d+)\s*([smhd]?)\s*$", str(value))
+    if match is None or int(match.group(1)) == 0:
+        raise InvalidParameter("not a duration: {}".format(value))
+    return int(match.group(1)) * {"": 1, "s": 1, "m": 60, "h": 3600, "d": 86400}[match.group(2)]
+
+def parseTime(value):
+    """Seconds since the epoch of a number, a datetime, or an ISO 8601 string.  Times without a zone are UTC."""
+    if isinstance(value, datetime.datetime):
+        return calendar.timegm(value.utctimetuple()) + value.microsecond / 1000000.0
+    if isinstance(value, (int, float, decimal.Decimal)):
+        return float(value)
+    text = str(value).strip()
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    text = text.replace("T", " ")
+    if text.endswith("Z"):
+        text = text[:-1]
+    for pattern in ["%Y-%m-%d %H:%M:%S.%f", "%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d"]:
+        try:
+            return parseTime(datetime.datetime.strptime(text, pattern))
+        except ValueError:
+            pass
+    raise InvalidParameter("not a time: {}".format(value))
+
+def loadNumpy():
+    try:
+        import numpy
+        return numpy
+    except ImportError:
+        return None
+
+class Rollup(object):
+    """The count, sum, minimum and maximum of one value column in time buckets, kept for each configured resolution
+    as rows are written through the source verbs.  Every flush_interval seconds each process adds what it has seen
+    to the rollup table with an upsert, so prefork workers and restarts only ever add to the stored buckets.  Buckets
+    being written stay visible to queries until the upsert commits, and go back to the pending ones if it fails."""
+    COLUMNS = ["BUCKET", "COUNT", "SUM", "AVG", "MIN", "MAX"]
+    NAME_PATTERN = re.compile(r"^\w+(\.\w+)?$")
+
+    def __init__(self, table, value, time_column=None, key=None, resolutions=(60, 3600), sources=None, flush_interval=1.0, max_buckets=10000,
+                 raw_time=None, raw_value=None):
+        if not Rollup.NAME_PATTERN.match(table):
+            raise Exception("Invalid rollup table name: " + table)
+        self.value = value.upper()
+        self.time_column = time_column.upper() if time_column else None
+        # The columns of the verb's query that raw rows are aggregated from.
+        self.raw_time = (raw_time or time_column or "").upper() or None
+        self.raw_value = (raw_value or value).upper()
+        self.key = key.upper() if key else None
+        self.resolutions = sorted([parseDuration(resolution) for resolution in resolutions])
+        self.sources = sources or []
+        self._flush_interval = flush_interval
+        self._max_buckets = max_buckets
+        self._select = QueryPlan("SELECT BUCKET, N, TOTAL, MIN_VALUE, MAX_VALUE FROM " + table
+                                 + " WHERE RESOLUTION = %(RESOLUTION)s AND GROUP_KEY = %(GROUP_KEY)s"
+                                 + " AND BUCKET >= %(FROM)s AND BUCKET < %(TO)s ORDER BY BUCKET")
+        self._upsert = ("INSERT INTO " + table + " (RESOLUTION, GROUP_KEY, BUCKET, N, TOTAL, MIN_VALUE, MAX_VALUE)"
+                        " VALUES (%s, %s, %s, %s, %s, %s, %s) ON DUPLICATE KEY UPDATE N = N + VALUES(N),"
+                        " TOTAL = TOTAL + VALUES(TOTAL), MIN_VALUE = LEAST(MIN_VALUE, VALUES(MIN_VALUE)),"
+                        " MAX_VALUE = GREATEST(MAX_VALUE, VALUES(MAX_VALUE))")
+        self._numpy = loadNumpy()
+        self._pending = {}
+        self._flushing = {}
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._pool = None
+        self._thread = None
+        self._observed = 0
+        self._flushes = 0
+        self._failures = 0
+
+    @staticmethod
+    def createInstanceFromConfig(rollup_element):
+        return Rollup(rollup_element["table"], rollup_element["value"], rollup_element.get("time"),
+                      rollup_element.get("key"), rollup_element.get("resolutions", ["1m", "1h"]),
+                      rollup_element.get("sources", []), rollup_element.get("flushInterval", 1.0),
+                      rollup_element.get("maxBuckets", 10000), rollup_element.get("rawTime"), rollup_element.get("rawValue"))
+
+    def checkQuery(self, query):
+        """Fails at startup unless the verb's query names the columns raw rows are read from."""
+        if self.raw_time is None:
+            raise Exception("A rollup with a query needs rawTime or time to name the query's time column")
+        for column in [self.raw_time, self.raw_value]:
+            if not re.search(r"\b" + re.escape(column) + r"\b", query, re.IGNORECASE):
+                raise Exception("Rollup column " + column + " is not in the query: " + query)
+
+    def getFieldNames(self):
+        return [name for name in [self.value, self.time_column, self.key] if name is not None]
+
+    def observe(self, rows, names=None):
+        """Adds written rows to the pending buckets.  Rows are dictionaries, or tuples of the values of names."""
+        now = time.time()
+        observed = 0
+        with self._lock:
+            pending = self._pending
+            for row in rows:
+                if names is not None:
+                    row = dict(zip(names, row))
+                try:
+                    value = float(row.get(self.value))
+                except (TypeError, ValueError):
+                    continue
+                moment = now
+                if self.time_column is not None and row.get(self.time_column) is not None:
+                    try:
+                        moment = parseTime(row[self.time_column])
+                    except InvalidParameter:
+                        pass
+                keys = [""]
+                if self.key is not None and row.get(self.key) is not None:
+                    keys.append(str(row[self.key]))
+                for resolution in self.resolutions:
+                    bucket = int(moment // resolution) * resolution
+                    for key in keys:
+                        entry = pending.get((resolution, key, bucket))
+                        if entry is None:
+                            pending[(resolution, key, bucket)] = [1, value, value, value]
+                        else:
+                            entry[0] += 1
+                            entry[1] += value
+                            entry[2] = min(entry[2], value)
+                            entry[3] = max(entry[3], value)
+                observed += 1
+            self._observed += observed
+
+    def merge(self, pending):
+        """Adds buckets to the pending ones.  The caller holds the lock."""
+        for bucket, (count, total, minimum, maximum) in pending.items():
+            entry = self._pending.get(bucket)
+            if entry is None:
+                self._pending[bucket] = [count, total, minimum, maximum]
+            else:
+                entry[0] += count
+                entry[1] += total
+                entry[2] = min(entry[2], minimum)
+                entry[3] = max(entry[3], maximum)
+
+    def start(self, pool):
+        self._pool = pool
+        self._thread = threading.Thread(target=self.run, name="rollup " + ", ".join(self.sources))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def run(self):
+        while not self._stopping.wait(self._flush_interval):
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            if not self._pending:
+                return
+            pending = self._flushing = self._pending
+            self._pending = {}
+        rows = [(resolution, key, bucket, entry[0], entry[1], entry[2], entry[3]) for (resolution, key, bucket), entry in pending.items()]
+        status = False
+        try:
+            connection = self._pool.checkout()
+            try:
+                status = connection.executeMany(self._upsert, rows, True)[0]
+            finally:
+                self._pool.release(connection)
+        except (ConnectionPoolTimeout, mysql.connector.Error) as err:
+            logger.error("Unable to write rollup buckets: {}".format(err))
+        with self._lock:
+            self._flushes += 1
+            self._flushing = {}
+            if not status:
+                self._failures += 1
+                # Keep the buckets for the next flush rather than losing them.
+                self.merge(pending)
+
+    def stop(self, timeout=30.0):
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._thread.join(timeout)
+        self.flush()
+
+    def aggregate(self, buckets, counts, totals, minimums, maximums, resolution):
+        """Combines partial aggregates into buckets of resolution seconds.  Returns (bucket, count, sum, minimum,
+        maximum) tuples in bucket order, computed with NumPy when it is installed."""
+        if not buckets:
+            return []
+        np = self._numpy
+        if np is None:
+            combined = {}
+            for bucket, count, total, minimum, maximum in zip(buckets, counts, totals, minimums, maximums):
+                bucket = int(bucket // resolution) * resolution
+                entry = combined.get(bucket)
+                if entry is None:
+                    combined[bucket] = [count, total, minimum, maximum]
+                else:
+                    entry[0] += count
+                    entry[1] += total
+                    entry[2] = min(entry[2], minimum)
+                    entry[3] = max(entry[3], maximum)
+            return [tuple([bucket] + combined[bucket]) for bucket in sorted(combined)]
+        starts = (np.floor(np.asarray(buckets, dtype=np.float64) / resolution) * resolution).astype(np.int64)
+        order = np.argsort(starts, kind="mergesort")
+        starts = starts[order]
+        first = np.flatnonzero(np.concatenate(([True], starts[1:] != starts[:-1])))
+        return list(zip(starts[first].tolist(),
+                        np.add.reduceat(np.asarray(counts, dtype=np.int64)[order], first).tolist(),
+                        np.add.reduceat(np.asarray(totals, dtype=np.float64)[order], first).tolist(),
+                        np.minimum.reduceat(np.asarray(minimums, dtype=np.float64)[order], first).tolist(),
+                        np.maximum.reduceat(np.asarray(maximums, dtype=np.float64)[order], first).tolist()))
+
+    def readStored(self, connection, resolution, key, start, end):
+        """The stored buckets of one resolution plus this process's pending and flushing ones, as aggregate() tuples."""
+        combined = {}
+        status, data = connection.executePlan(self._select, {"RESOLUTION": resolution, "GROUP_KEY": key, "FROM": start, "TO": end})
+        if not status:
+            return None
+        for bucket, count, total, minimum, maximum in (data.rows if data else []):
+            combined[int(bucket)] = [int(count), float(total), float(minimum), float(maximum)]
+        with self._lock:
+            for unwritten in (self._pending, self._flushing):
+                for (pending_resolution, pending_key, bucket), entry in unwritten.items():
+                    if pending_resolution != resolution or pending_key != key or not start <= bucket < end:
+                        continue
+                    stored = combined.get(bucket)
+                    if stored is None:
+                        combined[bucket] = list(entry)
+                    else:
+                        combined[bucket] = [stored[0] + entry[0], stored[1] + entry[1], min(stored[2], entry[2]), max(stored[3], entry[3])]
+        return [tuple([bucket] + combined[bucket]) for bucket in sorted(combined)]
+
+    def readRaw(self, connection, plan, parameters):
+        status, data = connection.executePlan(plan, parameters)
+        if not status:
+            return None
+        if not data:
+            return [], [], [], [], []
+        names = [str(name).upper() for name in data.column_names]
+        if self.raw_time not in names or self.raw_value not in names:
+            logger.error("Rollup query returned {} instead of {} and {}".format(names, self.raw_time, self.raw_value))
+            return None
+        time_index, value_index = names.index(self.raw_time), names.index(self.raw_value)
+        times = [parseTime(row[time_index]) for row in data.rows]
+        values = [float(row[value_index]) for row in data.rows]
+        return times, [1] * len(data.rows), values, values, values
+
+    def query(self, connection, parameters, plan=None):
+        """Aggregates ?bucket=&from=&to= from the finest stored resolution that divides the bucket, or from the raw
+        rows of plan when none does or the request asks for raw=true.  Returns the status and a QueryResult."""
+        resolution = parseDuration(parameters.get("BUCKET", self.resolutions[0]))
+        end = parseTime(parameters["TO"]) if parameters.get("TO") else time.time()
+        start = parseTime(parameters["FROM"]) if parameters.get("FROM") else end - 86400
+        start = int(start // resolution) * resolution
+        end = int(math.ceil(end / float(resolution))) * resolution
+        if end <= start:
+            raise InvalidParameter("from must be before to")
+        if (end - start) // resolution > self._max_buckets:
+            raise InvalidParameter("more than {} buckets".format(self._max_buckets))
+        key = str(parameters[self.key]) if self.key is not None and parameters.get(self.key) is not None else ""
+        stored = [candidate for candidate in self.resolutions if resolution % candidate == 0]
+        raw = str(parameters.get("RAW", "")).lower() in ("1", "true", "yes")
+        if stored and not raw:
+            rows = self.readStored(connection, stored[-1], key, start, end)
+            if rows is None:
+                return False, None
+            if stored[-1] != resolution:
+                rows = self.aggregate(*(list(zip(*rows)) + [resolution])) if rows else []
+        elif plan is not None:
+            parameters = dict(parameters, FROM=start, TO=end)
+            columns = self.readRaw(connection, plan, parameters)
+            if columns is None:
+                return False, None
+            rows = self.aggregate(*(list(columns) + [resolution]))
+        else:
+            raise InvalidParameter("bucket must be a multiple of {} seconds".format(self.resolutions[0]))
+        return True, QueryResult(Rollup.COLUMNS, [(datetime.datetime.utcfromtimestamp(bucket), count, total, total / count, minimum, maximum)
+                                                  for bucket, count, total, minimum, maximum in rows])
+
+    def getMetrics(self):
+        with self._lock:
+            return {"pending": len(self._pending) + len(self._flushing), "observed": self._observed, "flushes": self._flushes, "failures": self._failures}
+
+class TooManySubscribers(Exception):
+    pass
+
+EVENT_STREAM = "text/event-stream"
+
+class PushEvent(object):
+    """One event, encoded once however many subscribers it is sent to."""
+    __slots__ = ("id", "name", "data", "sse", "message")
+
+    def __init__(self, event_id, name, data):
+        self.id = event_id
+        self.name = name
+        self.data = data
+        lines = [b"event: " + toBytes(name), b"data: " + data, b"", b""]
+        if event_id is not None:
+            lines.insert(0, b"id: " + toBytes(str(event_id)))
+        self.sse = b"\n".join(lines)
+        # WebSocket messages are text frames.
+        self.message = '{"id":' + ("null" if event_id is None else str(event_id)) + ',"event":"' + name + '","data":' + data.decode("utf-8") + '}'
+
+class Subscription(object):
+    """The events waiting to be sent to one client, at most buffer_size of them.  When a slow client falls that far
+    behind, the drop overflow discards its oldest events and sends a dropped event with their count before the next
+    ones; coalesce discards all of them and sends a single resync event, after which the client should read the
+    endpoint again."""
+    def __init__(self, channel, buffer_size=100, overflow="drop"):
+        self.channel = channel
+        self._buffer_size = max(1, buffer_size)
+        self._coalesce = overflow == "coalesce"
+        self._events = collections.deque()
+        self._condition = threading.Condition()
+        self._dropped = 0
+        self._resync = False
+        self.closed = False
+        # Called after each push, for servers that don't wait in wait().
+        self.on_push = None
+
+    def push(self, event):
+        """Adds an event and returns how many were discarded to make room for it."""
+        with self._condition:
+            if self.closed:
+                return 0
+            discarded = 0
+            if len(self._events) >= self._buffer_size:
+                if self._coalesce:
+                    discarded = len(self._events)
+                    self._events.clear()
+                    self._resync = True
+                else:
+                    discarded = 1
+                    self._events.popleft()
+                self._dropped += discarded
+            self._events.append(event)
+            self._condition.notify()
+        if self.on_push is not None:
+            self.on_push()
+        return discarded
+
+    def take(self, encode):
+        """Returns the waiting events without blocking, after a dropped or resync event when some were discarded."""
+        with self._condition:
+            events = list(self._events)
+            self._events.clear()
+            if self._resync:
+                events.insert(0, PushEvent(None, "resync", encode({"dropped": self._dropped})))
+            elif self._dropped:
+                events.insert(0, PushEvent(None, "dropped", encode({"count": self._dropped})))
+            self._dropped = 0
+            self._resync = False
+            return events
+
+    def wait(self, timeout, encode):
+        with self._condition:
+            if not self._events and not self.closed:
+                self._condition.wait(timeout)
+        return self.take(encode)
+
+    def close(self):
+        with self._condition:
+            self.closed = True
+            self._condition.notify_all()
+        if self.on_push is not None:
+            self.on_push()
+
+class EventBroadcaster(object):
+    """Fans the events published on a channel out to every subscription to it.  Channels are endpoint paths, and an
+    event is encoded once and skipped altogether while a channel has no subscribers."""
+    def __init__(self, encode, buffer_size=100, overflow="drop", keep_alive=15.0, max_subscribers=1000):
+        self.encode = encode
+        self._buffer_size = buffer_size
+        self._overflow = overflow
+        self.keep_alive = keep_alive
+        self._max_subscribers = max_subscribers
+        self._lock = threading.Lock()
+        self._channels = {}
+        self._subscriptions = {}
+        self._sequences = {}
+        self._published = {}
+        self._dropped = {}
+        self._closed = False
+
+    @staticmethod
+    def createInstanceFromConfig(push_element, encode):
+        overflow = push_element.get("overflow", "drop")
+        if overflow not in ("drop", "coalesce"):
+            raise Exception("Unknown push overflow, expected drop or coalesce: " + overflow)
+        return EventBroadcaster(encode, push_element.get("bufferSize", 100), overflow,
+                                push_element.get("keepAlive", 15.0), push_element.get("maxSubscribers", 1000))
+
+    def addChannel(self, channel):
+        with self._lock:
+            if channel not in self._channels:
+                self._channels[channel] = ()
+                self._sequences[channel] = 0
+                self._published[channel] = 0
+                self._dropped[channel] = 0
+
+    def publishes(self, channel):
+        return channel in self._channels
+
+    def hasSubscribers(self, channel):
+        return len(self._channels.get(channel, ())) > 0
+
+    def subscribe(self, channel):
+        subscription = Subscription(channel, self._buffer_size, self._overflow)
+        with self._lock:
+            if self._closed or len(self._subscriptions) >= self._max_subscribers:
+                raise TooManySubscribers(channel)
+            self._subscriptions[subscription] = channel
+            # Publishers read the tuple without the lock, so it is replaced rather than changed.
+            self._channels[channel] = self._channels[channel] + (subscription,)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            if self._subscriptions.pop(subscription, None) is not None:
+                self._channels[subscription.channel] = tuple([s for s in self._channels[subscription.channel] if s is not subscription])
+
+    def publish(self, channel, name, data):
+        subscriptions = self._channels.get(channel)
+        if not subscriptions:
+            return
+        encoded = self.encode(data)
+        with self._lock:
+            self._sequences[channel] += 1
+            event = PushEvent(self._sequences[channel], name, encoded)
+        dropped = 0
+        for subscription in subscriptions:
+            dropped += subscription.push(event)
+        with self._lock:
+            self._published[channel] += 1
+            self._dropped[channel] += dropped
+
+    def close(self):
+        """Ends every subscription, so streams finish and clients reconnect to another process."""
+        with self._lock:
+            self._closed = True
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            subscription.close()
+
+    def getMetrics(self):
+        with self._lock:
+            return dict((channel, {"subscribers": len(subscriptions), "published": self._published[channel], "dropped": self._dropped[channel]})
+                        for channel, subscriptions in self._channels.items())
+
+class EventPublisher(object):
+    """Publishes the rows written by a verb, one event per successful write, with the values of fields."""
+    def __init__(self, broadcaster, channel, event_name, fields):
+        self._broadcaster = broadcaster
+        self.channel = channel
+        self._event_name = event_name
+        self._fields = [field.upper() for field in fields]
+
+    @staticmethod
+    def createInstanceFromConfig(broadcaster, event_element, path, method, plan):
+        return EventPublisher(broadcaster, event_element.get("channel", path).lower(),
+                              event_element.get("eventName", method.lower()),
+                              event_element.get("fields", plan.parameter_names))
+
+    def getFieldNames(self):
+        return self._fields
+
+    def observe(self, rows, names=None):
+        if not rows or not self._broadcaster.hasSubscribers(self.channel):
+            return
+        fields = self._fields
+        if names is not None:
+            rows = [dict(zip(names, row)) for row in rows]
+        # Only the named fields, never the headers merged into the parameters.
+        self._broadcaster.publish(self.channel, self._event_name, [dict([(field, row.get(field)) for field in fields]) for row in rows])
+
 class RestVerb(object):
 
     def __init__(self, usernames):
-        self.parameters = frozenset()
-        self.empty_parameters = {}
         self._usernames = usernames
         self.empty_response = None
-        self._pusherEvents = []
+        self.pusher_events = []
+        self.buffered = None
+        self.spooled = None
+        self.spool = None
+        # One BufferedWriter per shard, or a single one when the verb isn't sharded.
+        self.writers = []
+        self.stream = None
+        self.pagination = None
+        self.cache = None
+        self.single_flight = None
+        self.rate_limit = None
+        # Declared parameter types, and the ParameterSchema compiled from them once the server has read the columns.
+        self.parameter_specs = {}
+        self.schema = None
+        self.columnar = False
+        self.bulk = BulkInsert()
+        self.reads = False
+        self.read_from = "replica"
+        self.shard_name = None
+        self.shard = None
+        self.rollup = None
+        # Rollups and event publishers fed by this verb's writes, filled in once every endpoint has been created.
+        self.observers = []
+
+    def getUsernames(self):
+        return self._usernames or []
+
+    def isBuffered(self):
+        return len(self.writers) > 0
 
-    def isValidUser(self, username):
-        return username and self._usernames and username in self._usernames
+    def locate(self, parameters):
+        """The index of the shard that parameters belong to, or None when the verb isn't sharded."""
+        return self.shard.locate(parameters) if self.shard is not None else None
+
+    def observeWrite(self, rows, names=None):
+        for observer in self.observers:
+            observer.observe(rows, names)
 
     @staticmethod
     def createInstanceFromConfig(verb_element):
@@ -208,47 +2840,59 @@ class RestVerb(object):
         else:
             return_verb.empty_response = None
         if "pusherEvents" in verb_element:
-            events = verb_element["pusherEvents"]
-            for event in events:
-                pass
-                # return_verb._pusherEvents.add(PusherEvent(event["channel"], event["eventName", event["message"]]))
+            return_verb.pusher_events = verb_element["pusherEvents"]
+        if "buffered" in verb_element:
+            return_verb.buffered = verb_element["buffered"]
+        if "spool" in verb_element:
+            return_verb.spooled = verb_element["spool"]
+        if "bulk" in verb_element:
+            return_verb.bulk = BulkInsert.createInstanceFromConfig(verb_element["bulk"])
+        if "readFrom" in verb_element:
+            return_verb.read_from = verb_element["readFrom"]
+        if "shard" in verb_element:
+            return_verb.shard_name = verb_element["shard"]
+        if "rollup" in verb_element:
+            return_verb.rollup = Rollup.createInstanceFromConfig(verb_element["rollup"])
         if "query" in verb_element:
             return_verb.query = verb_element["query"]
-            formatter = string.Formatter()
-            params = []
-            for i in formatter.parse(return_verb.query):
-                if i[1] is None:
-                    break
-                else:
-                    params.append(i[1])
-                    return_verb.empty_parameters[i[1]] = "NULL"
-            return_verb.parameters = frozenset(params)
+            return_verb.plan = QueryPlan(return_verb.query)
+            if return_verb.rollup is not None:
+                return_verb.rollup.checkQuery(return_verb.query)
+            if "pagination" in verb_element:
+                return_verb.pagination = KeysetPagination.createInstanceFromConfig(return_verb.query, verb_element["pagination"])
+        if "stream" in verb_element and verb_element["stream"]:
+            stream = verb_element["stream"] if isinstance(verb_element["stream"], dict) else {}
+            return_verb.stream = {"format": stream.get("format", "json"), "fetchSize": stream.get("fetchSize", 1000)}
+        if "resultFormat" in verb_element:
+            return_verb.columnar = verb_element["resultFormat"] == "columnar"
+        if "cache" in verb_element:
+            return_verb.cache = ResponseCache.createInstanceFromConfig(verb_element["cache"])
+        if "parameters" in verb_element:
+            return_verb.parameter_specs = dict([(name.upper(), ParameterSchema.createSpec(name.upper(), spec))
+                                                for name, spec in verb_element["parameters"].items()])
+        if "rateLimit" in verb_element:
+            return_verb.rate_limit = TokenBucket.createInstanceFromConfig(verb_element["rateLimit"])
+        if verb_element.get("singleFlight"):
+            return_verb.single_flight = SingleFlight.createInstanceFromConfig(verb_element["singleFlight"])
         return return_verb
 
 class RestEndpoint(object):
-    def __init__(self, path):
+    def __init__(self, path, format_adapters=None):
         if (path):
             self._path = path.lower()
         else:
             raise Exception("Missing REST endpoint path.")
-        self._format_adapter = JsonAdapter()
-
-    def isValidUser(self, username, verb):
-        return verb and username and verb.isValidUser(username)
-    
-    def isValidUserGet(self, username):
-        return self.isValidUser(username, self.get_verb)
-    
-    def isValidUserPost(self, username):
-        return self.isValidUser(username, self.post_verb)
+        self._format_adapters = format_adapters or FormatAdapters(JsonAdapter())
+        self.get_verb = None
+        self.post_verb = None
+        self.put_verb = None
+        self.delete_verb = None
 
-    def isValidUserPut(self, username):
-        return self.isValidUser(username, self.put_verb)
-
-    def isValidUserDelete(self, username):
-        return self.isValidUser(username, self.delete_verb)
+    def negotiate(self, headers):
+        return self._format_adapters.negotiate(headers.get("Accept") if headers else None)
 
     def setGet(self, get_verb):
+        get_verb.reads = get_verb.read_from == "replica"
         self.get_verb = get_verb
 
     def setPut(self, put_verb):
@@ -260,7 +2904,12 @@ class RestEndpoint(object):
     def setPost(self, post_verb):
         self.post_verb = post_verb
 
-    def merge(self, url_params = None, request_body = None, headers=None):
+    def merge(self, url_params = None, request_body = None, headers=None, verb=None):
+        began = clock()
+        if verb is not None and verb.schema is not None:
+            merged = verb.schema.merge(url_params, request_body, headers)
+            currentTimer().add("merge", clock() - began)
+            return merged
         merged = {}
         if url_params:
             for key, value in url_params.items():
@@ -271,176 +2920,1447 @@ class RestEndpoint(object):
         if headers:
             for key, value in headers.items():
                 merged[key.upper()] = value
+        currentTimer().add("merge", clock() - began)
         return merged
 
-    def executeGet(self, connection, url_params=None, request_body=None, headers=None):
-        status, data = connection.execute(self.get_verb.query, self.merge(url_params, request_body, headers))
-        return self.respond(self.get_verb, status, data)
+    def getVerbs(self):
+        verbs = {}
+        for method in ["get", "post", "put", "delete"]:
+            verb = getattr(self, method + "_verb")
+            if verb:
+                verbs[method.upper()] = verb
+        return verbs
 
-    def executePut(self, connection, url_params = None, request_body = None, headers=None):
-        status, data = connection.execute(self.put_verb.query, self.merge(url_params, request_body, headers), self.put_verb.commit)
-        return self.respond(self.put_verb, status, data)
-            
-    def executePost(self, connection, url_params=None, request_body=None, headers=None):
+    def bindRows(self, verb, url_params, rows, headers):
+        """Merges and binds each row of a list body, naming the row that is not an object or lacks a parameter.
+        Returns the bound rows grouped by shard; the only group is None when the verb isn't sharded."""
+        verb.bulk.checkSize(rows)
+        plan = verb.plan
+        groups = collections.OrderedDict()
+        for index, row in enumerate(rows):
+            if not isinstance(row, dict):
+                raise InvalidUpload("row {} is not an object".format(index))
+            try:
+                merged = self.merge(url_params, row, headers, verb)
+                shard = verb.locate(merged)
+                groups.setdefault(shard, []).append(plan.bind(merged) if plan.preparable else merged)
+            except MissingParameter as err:
+                raise MissingParameter("{} in row {}".format(err, index))
+            except InvalidParameter as err:
+                raise InvalidParameter("{} in row {}".format(err, index))
+        return groups
+
+    def enqueue(self, verb, url_params=None, request_body=None, headers=None):
+        if isinstance(request_body, list):
+            verb.bulk.checkSize(request_body)
+            rows = [self.merge(url_params, row, headers, verb) for row in request_body]
+        else:
+            rows = [self.merge(url_params, request_body, headers, verb)]
+        if verb.shard is None:
+            status = verb.writers[0].submit(rows)
+        else:
+            groups = collections.OrderedDict()
+            for row in rows:
+                groups.setdefault(verb.locate(row), []).append(row)
+            status = all([verb.writers[shard].submit(shard_rows) for shard, shard_rows in groups.items()])
+        if status and not verb.writers[0].acksOnFlush():
+            return self.createResponse("accepted", 202, adapter=self.negotiate(headers))
+        return self.respond(verb, status, adapter=self.negotiate(headers))
+
+    def executeGet(self, get_connection, url_params=None, request_body=None, headers=None):
+        verb = self.get_verb
+        parameters = self.merge(url_params, request_body, headers, verb)
+        if verb.rollup is not None:
+            return self.executeRollup(get_connection, verb, parameters, self.negotiate(headers))
+        plan = verb.plan
+        if verb.pagination:
+            plan = verb.pagination.bind(parameters)
+        adapter = self.negotiate(headers)
+        if verb.stream and plan.preparable:
+            return self.streamResponse(get_connection(verb, verb.locate(parameters)), verb, plan, parameters, adapter)
+        if verb.cache:
+            key = adapter.mimetype + "\0" + verb.cache.createKey(plan, parameters)
+            entry = verb.cache.get(key)
+            if entry is None:
+                generation = verb.cache.getGeneration()
+                response = self.queryGetOnce(get_connection, verb, plan, parameters, adapter, key)
+                if response.status_code != 200:
+                    return response
+                entry = verb.cache.put(key, response.get_data(), response.mimetype, generation)
+            return entry.createResponse(headers.get("If-None-Match") if headers else None)
+        return self.queryGetOnce(get_connection, verb, plan, parameters, adapter)
+
+    def queryGetOnce(self, get_connection, verb, plan, parameters, adapter, key=None):
+        """Runs a GET query, or with singleFlight waits for an identical one already running and shares its response."""
+        if verb.single_flight is None:
+            return self.queryGet(get_connection(verb, verb.locate(parameters)), verb, plan, parameters, adapter)
+        key = key or adapter.mimetype + "\0" + plan.createKey(parameters)
+        flight, leader = verb.single_flight.join(key)
+        if not leader:
+            response = verb.single_flight.wait(flight)
+            if response is not None:
+                return response
+            return self.queryGet(get_connection(verb, verb.locate(parameters)), verb, plan, parameters, adapter)
+        response = None
+        try:
+            response = self.queryGet(get_connection(verb, verb.locate(parameters)), verb, plan, parameters, adapter)
+        finally:
+            verb.single_flight.land(key, flight, response)
+        return response
+
+    def executeRollup(self, get_connection, verb, parameters, adapter):
+        status, data = verb.rollup.query(get_connection(verb, verb.locate(parameters)), parameters, getattr(verb, "plan", None))
+        return self.respond(verb, status, data, adapter=adapter)
+
+    def queryGet(self, connection, verb, plan, parameters, adapter):
+        status, data = connection.executePlan(plan, parameters)
+        if verb.pagination and status:
+            next_key = verb.pagination.nextKey(parameters, data.column_names, data.rows[-1], len(data)) if data else None
+            return self.respond(verb, status, data, {"next": next_key}, adapter)
+        return self.respond(verb, status, data, adapter=adapter)
+
+    def streamResponse(self, connection, verb, plan, parameters, adapter):
+        status, column_names, chunks = connection.executeStream(plan, parameters, verb.stream["fetchSize"])
+        if not status:
+            return self.respond(verb, status, adapter=adapter)
+        # Fetch the first chunk before committing to a 200 so empty results still get the configured emptyResponse.
+        first_chunk = next(chunks, None)
+        if first_chunk is None:
+            if verb.empty_response:
+                return self.respond(verb, status, adapter=adapter)
+        encoder = StreamEncoder(verb, adapter, column_names, parameters, currentTimer())
+
+        def generate():
+            try:
+                opening = encoder.open()
+                if opening:
+                    yield opening
+                chunk = first_chunk
+                while chunk is not None:
+                    yield encoder.encodeChunk(chunk)
+                    chunk = next(chunks, None)
+                closing = encoder.close()
+                if closing:
+                    yield closing
+            finally:
+                # Close now, before the connection goes back to the pool, rather than whenever this is collected.
+                chunks.close()
+
+        response = Response(stream_with_context(generate()), mimetype=encoder.mimetype)
+        response.headers['Cache-Control'] = 'no-cache, no-store, no-transform, max-age=0'
+        return response
+
+    def executeBulk(self, get_connection, verb, url_params, rows, headers):
+        adapter = self.negotiate(headers)
+        query = verb.plan.sql if verb.plan.preparable else verb.plan.query
+        reports = []
+        row_count = 0
+        # Each shard is written in its own transaction; the reports show which shards committed before a failure.
+        for shard, bound in self.bindRows(verb, url_params, rows, headers).items():
+            status, shard_reports = get_connection(verb, shard).executeChunks(query, bound, verb.bulk.chunk_size)
+            if shard is not None:
+                for report in shard_reports:
+                    report["shard"] = shard
+            reports.extend(shard_reports)
+            if not status:
+                return self.createResponse("failure", 500, extra={"chunks": reports}, adapter=adapter)
+            verb.observeWrite(bound, verb.plan.parameter_names if verb.plan.preparable else None)
+            row_count += len(bound)
+        return self.createResponse("success", 200, extra={"rows": row_count}, adapter=adapter)
+
+    def executeLoad(self, get_connection, stream, mimetype, headers=None):
+        verb = self.post_verb
+        adapter = self.negotiate(headers)
+        load = verb.bulk.load
+        path, columns, row_count = load.spool(stream, mimetype)
+        try:
+            if row_count:
+                status, row_count = get_connection(verb).loadData(load.createStatement(columns), path)
+                if not status:
+                    return self.createFailureResponse(adapter)
+        finally:
+            os.remove(path)
+        return self.createResponse("success", 200, extra={"rows": row_count}, adapter=adapter)
+
+    def spoolWrite(self, verb, url_params=None, request_body=None, headers=None):
+        key = headers.get(verb.spool.idempotency_header) if headers else None
         if isinstance(request_body, list):
-            status, data = connection.executeMany(self.post_verb.query,  self.merge(url_params, request_body, headers), self.post_verb.commit)
+            verb.bulk.checkSize(request_body)
+            rows = [self.merge(url_params, row, headers, verb) for row in request_body]
+            for index, row in enumerate(rows):
+                row["IDEMPOTENCY_KEY"] = key + "/" + str(index) if key is not None else None
         else:
-            status, data = connection.execute(self.post_verb.query, self.merge(url_params, request_body, headers), self.post_verb.commit)
-        return self.respond(self.post_verb, status, data)
+            rows = [self.merge(url_params, request_body, headers, verb)]
+            rows[0]["IDEMPOTENCY_KEY"] = key
+        verb.spool.submit(rows, [verb.locate(row) for row in rows], key)
+        return self.createResponse("accepted", 202, adapter=self.negotiate(headers))
+
+    def executePut(self, get_connection, url_params = None, request_body = None, headers=None):
+        if self.put_verb.spool is not None:
+            return self.spoolWrite(self.put_verb, url_params, request_body, headers)
+        if self.put_verb.isBuffered():
+            return self.enqueue(self.put_verb, url_params, request_body, headers)
+        if isinstance(request_body, list):
+            return self.executeBulk(get_connection, self.put_verb, url_params, request_body, headers)
+        parameters = self.merge(url_params, request_body, headers, self.put_verb)
+        status, data = get_connection(self.put_verb, self.put_verb.locate(parameters)).executePlan(self.put_verb.plan, parameters, self.put_verb.commit)
+        if status:
+            self.put_verb.observeWrite([parameters])
+        return self.respond(self.put_verb, status, data, adapter=self.negotiate(headers))
+            
+    def executePost(self, get_connection, url_params=None, request_body=None, headers=None):
+        if self.post_verb.spool is not None:
+            return self.spoolWrite(self.post_verb, url_params, request_body, headers)
+        if self.post_verb.isBuffered():
+            return self.enqueue(self.post_verb, url_params, request_body, headers)
+        if isinstance(request_body, list):
+            return self.executeBulk(get_connection, self.post_verb, url_params, request_body, headers)
+        parameters = self.merge(url_params, request_body, headers, self.post_verb)
+        status, data = get_connection(self.post_verb, self.post_verb.locate(parameters)).executePlan(self.post_verb.plan, parameters, self.post_verb.commit)
+        if status:
+            self.post_verb.observeWrite([parameters])
+        return self.respond(self.post_verb, status, data, adapter=self.negotiate(headers))
 
-    def executeDelete(self, connection, url_params=None, request_body=None, headers=None):
-        status, data = connection.execute(self.delete_verb.query, self.merge(url_params, request_body, headers), self.delete_verb.commit)
-        return self.respond(self.delete_verb, status, data)
+    def executeDelete(self, get_connection, url_params=None, request_body=None, headers=None):
+        parameters = self.merge(url_params, request_body, headers, self.delete_verb)
+        status, data = get_connection(self.delete_verb, self.delete_verb.locate(parameters)).executePlan(self.delete_verb.plan, parameters, self.delete_verb.commit)
+        return self.respond(self.delete_verb, status, data, adapter=self.negotiate(headers))
 
     def __str__(self):
         return "{path: %(path)s}" % {"path": self._path}
 
-    def createVariableList(self, column_names, column_types):
+    def createVariableList(self, columns):
+        if columns is None:
+            return "Unknown<br/><br/>"
         return_str = '{<br/>'
-        for name, type in zip(column_names, column_types):
-            return_str += '&nbsp;"' + name + '": ' + FieldType.get_info(type[1]) + ",<br/>"
+        for column in columns:
+            return_str += '&nbsp;"' + escapeHtml(column["name"]) + '": ' + column["type"] + ",<br/>"
         return_str = return_str[:-6]
-        return return_str + '<br/>}'
+        return return_str + '<br/>}<br/><br/>'
 
     def createParameterList(self, parameters):
         if len(parameters) == 0:
             return "None<br/><br/>"
         return_str = '<ul>\n'
         for param in parameters:
-            return_str += '<li>' + param + '</li>\n'
+            return_str += '<li>' + escapeHtml(param) + '</li>\n'
         return return_str + '</ul>\n'
 
-    def createHtmlDiv(self, connection):
+    def createHtmlDiv(self, schema):
         return_div = ""
-        for get_verb in self.get_verbs.values():
-            column_names, column_types = connection.getQueryColumnInfo(get_verb.query, get_verb.empty_parameters)
-            return_div += "<h3>GET " + self._path  \
-                + "</h3><div>\n<p><b>Description</b><br/>%(description)s<br/><br/><b>URL Parameters</b><br/>%(parameters)s<b>Response Body</b><br/>%(columns)s</p></div>\n" \
-                % {"columns": self.createVariableList(column_names, column_types),
-                    "parameters": self.createParameterList(get_verb.parameters),
-                    "description": get_verb.description}
-        for post_verb in self.post_verbs:
-            return_div += "<h3>POST" + self._path + "</h3><div>\n<p>Gooble Gobble</p></div>\n"
-        for delete_verb in self.delete_verbs:
-            return_div += "<h3>DELETE" + self._path + "</h3><div>\n<p>Gooble Gobble</p></div>\n"
-        for put_verb in self.put_verbs:
-            return_div += "<h3>PUT" + self._path + "</h3><div>\n<p>Gooble Gobble</p></div>\n"
+        for method in ["GET", "POST", "PUT", "DELETE"]:
+            verb = self.getVerbs().get(method)
+            if verb is None:
+                continue
+            return_div += "<h3>" + method + " /" + escapeHtml(self._path) \
+                + "</h3><div>\n<p><b>Description</b><br/>%(description)s<br/><br/><b>Parameters</b><br/>%(parameters)s%(columns)s</p></div>\n" \
+                % {"columns": "<b>Response Body</b><br/>" + self.createVariableList(schema.getColumns(verb)) if method == "GET" else "",
+                    "parameters": self.createParameterList(schema.getParameters(verb)),
+                    "description": escapeHtml(verb.description)}
         return return_div
 
-    def respond(self, verb, query_status, data=None):
+    def respond(self, verb, query_status, data=None, extra=None, adapter=None):
         if verb.empty_response and not data:
-            return self.createResponse(verb.empty_response["status"], verb.empty_response["statusCode"])
+            return self.createResponse(verb.empty_response["status"], verb.empty_response["statusCode"], adapter=adapter)
         if query_status:
-            return self.createSuccessResponse(data)
+            return self.createSuccessResponse(data, extra, verb.columnar, adapter)
         else:
-            return self.createFailureResponse()
+            return self.createFailureResponse(adapter)
 
-    def createResponse(self, status, status_code, data=None):
-        response = jsonify({"status": status, "data": data})
-        response.status_code = status_code
+    def createResponse(self, status, status_code, data=None, extra=None, columnar=False, adapter=None):
+        adapter = adapter or self._format_adapters.default
+        began = clock()
+        body = adapter.serialize(status, data, extra, columnar)
+        currentTimer().add("serialize", clock() - began)
+        response = Response(body, status_code, mimetype=adapter.mimetype)
         response.headers['Cache-Control'] = 'no-cache, no-store, no-transform, max-age=0'
         return response
 
-    def createFailureResponse(self):
-        return self.createResponse("failure", 500)
+    def createFailureResponse(self, adapter=None):
+        return self.createResponse("failure", 500, adapter=adapter)
+
+    def createSuccessResponse(self, data, extra=None, columnar=False, adapter=None):
+        return self.createResponse("success", 200, data, extra, columnar, adapter)
+
+class StreamEncoder(object):
+    """Encodes a streamed result set as an opening, one piece per chunk of rows and a closing, in the verb's stream
+    format."""
+    def __init__(self, verb, adapter, column_names, parameters, timer=NULL_TIMER):
+        # Binary formats have no streamable array syntax, so they are always sent as a sequence of encoded rows.
+        self.ndjson = verb.stream["format"] == "ndjson" or not isinstance(adapter, JsonAdapter)
+        self.columnar = verb.columnar
+        self.pagination = verb.pagination
+        self.adapter = adapter
+        self.column_names = column_names
+        self.parameters = parameters
+        self.timer = timer
+        self.row_count = 0
+        self.last_row = None
+        # The keys are encoded once for the whole stream rather than for each chunk.
+        self.template = None if verb.columnar else adapter.createRowTemplate(column_names)
+        self.mimetype = "application/x-ndjson" if self.ndjson and isinstance(adapter, JsonAdapter) else adapter.mimetype
+
+    def open(self):
+        if self.ndjson and self.columnar:
+            return self.adapter.encode(self.column_names) + self.adapter.separator
+        elif self.columnar:
+            return b'{"status":"success","data":{"columns":' + self.adapter.encode(self.column_names) + b',"rows":['
+        elif not self.ndjson:
+            return b'{"status":"success","data":['
+        return b""
+
+    def encodeChunk(self, chunk):
+        began = clock()
+        if self.ndjson:
+            body = self.adapter.serializeLines(self.column_names, chunk, self.columnar, self.template)
+        else:
+            body = (b"," if self.row_count else b"") + self.adapter.serializeChunk(self.column_names, chunk, self.columnar, self.template)
+        self.timer.add("serialize", clock() - began)
+        self.row_count += len(chunk)
+        self.last_row = chunk[-1]
+        return body
+
+    def close(self):
+        if self.ndjson:
+            return b""
+        closing = b"]}" if self.columnar else b"]"
+        if self.pagination:
+            next_key = self.pagination.nextKey(self.parameters, self.column_names, self.last_row, self.row_count)
+            return closing + b',"next":' + self.adapter.encode(next_key) + b'}'
+        return closing + b'}'
+
+class DispatchRecord(object):
+    """The endpoint method and permitted users for one (path, method) pair.  Users are bits in an integer mask."""
+    __slots__ = ("path", "method", "execute", "permitted", "writes", "loads", "metrics", "rate_limit")
+
+    def __init__(self, endpoint, method, permitted, metrics=None):
+        self.path = endpoint._path
+        self.method = method
+        self.execute = getattr(endpoint, "execute" + method.capitalize())
+        self.permitted = permitted
+        self.writes = method != "GET"
+        self.loads = method == "POST" and endpoint.post_verb.bulk.load is not None
+        self.metrics = metrics
+        self.rate_limit = getattr(endpoint, method.lower() + "_verb").rate_limit
+
+    def permits(self, user):
+        return user is not None and self.permitted & user.bit != 0
+
+TEXT_TYPES = (bytes, type(u""))
+
+def coerceString(value):
+    if isinstance(value, bytes):
+        return value.decode("utf-8")
+    if isinstance(value, type(u"")):
+        return value
+    if isinstance(value, (int, float, decimal.Decimal)) and not isinstance(value, bool):
+        return type(u"")(value)
+    raise ValueError(value)
+
+def coerceInteger(value):
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, numbers.Integral):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, TEXT_TYPES):
+        return int(value.strip())
+    raise ValueError(value)
+
+def coerceNumber(value):
+    if isinstance(value, bool) or not isinstance(value, (numbers.Real, decimal.Decimal) + TEXT_TYPES):
+        raise ValueError(value)
+    number = float(value)
+    if math.isinf(number) or math.isnan(number):
+        raise ValueError(value)
+    return number
+
+def coerceDecimal(value):
+    if isinstance(value, bool) or not isinstance(value, (numbers.Real, decimal.Decimal) + TEXT_TYPES):
+        raise ValueError(value)
+    number = decimal.Decimal(value.strip() if isinstance(value, TEXT_TYPES) else repr(value) if isinstance(value, float) else value)
+    if not number.is_finite():
+        raise ValueError(value)
+    return number
+
+def coerceBoolean(value):
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, numbers.Integral) and value in (0, 1):
+        return bool(value)
+    if isinstance(value, TEXT_TYPES):
+        text = coerceString(value).strip().lower()
+        if text in ("true", "1", "yes", "on"):
+            return True
+        if text in ("false", "0", "no", "off"):
+            return False
+    raise ValueError(value)
+
+def coerceDatetime(value):
+    if isinstance(value, datetime.datetime):
+        return value
+    if isinstance(value, bool) or not isinstance(value, (int, float, decimal.Decimal) + TEXT_TYPES):
+        raise ValueError(value)
+    return datetime.datetime.utcfromtimestamp(parseTime(value))
+
+def coerceDate(value):
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    if isinstance(value, TEXT_TYPES):
+        return datetime.datetime.strptime(coerceString(value).strip(), "%Y-%m-%d").date()
+    raise ValueError(value)
+
+class ParameterSchema(object):
+    """Checks and converts the parameters of one verb.  Compiled once at startup from the verb's "parameters" and the
+    types of the columns its query compares or inserts parameters into, so a request only binds the names the verb
+    uses and is turned away with a 400 before it takes a connection from the pool."""
+    COERCERS = {"string": coerceString, "integer": coerceInteger, "number": coerceNumber, "decimal": coerceDecimal,
+                "boolean": coerceBoolean, "datetime": coerceDatetime, "date": coerceDate}
+    # Date and time columns are left to MySQL, which reads more formats than parseTime does.
+    COLUMN_TYPES = {"TINY": "integer", "SHORT": "integer", "LONG": "integer", "LONGLONG": "integer", "INT24": "integer",
+                    "YEAR": "integer", "DECIMAL": "decimal", "NEWDECIMAL": "decimal", "FLOAT": "number",
+                    "DOUBLE": "number", "VARCHAR": "string", "VAR_STRING": "string", "STRING": "string",
+                    "ENUM": "string", "SET": "string"}
+
+    def __init__(self, names, required=(), specs=None):
+        self.names = tuple(names)
+        self._names = frozenset(self.names)
+        self.specs = collections.OrderedDict()
+        self._defaults = []
+        self._checks = []
+        required = list(required)
+        for name, spec in (specs or {}).items():
+            spec = ParameterSchema.createSpec(name, spec)
+            self.specs[name] = spec
+            if name not in self._names:
+                self.names += (name,)
+                self._names = frozenset(self.names)
+            if "default" in spec:
+                self._defaults.append((name, spec["default"]))
+                required = [other for other in required if other != name]
+            elif spec.get("required") and name not in required:
+                required.append(name)
+            self._checks.append((name, ParameterSchema.compileCheck(name, spec)))
+        self.required = tuple(required)
+
+    @staticmethod
+    def createSpec(name, spec):
+        if not isinstance(spec, dict):
+            spec = {"type": spec}
+        if spec.get("type", "string") not in ParameterSchema.COERCERS:
+            raise Exception("Unknown type for parameter " + name + ": " + str(spec.get("type")))
+        if ("minimum" in spec or "maximum" in spec) and spec.get("type") not in ("integer", "number", "decimal"):
+            raise Exception("Only numeric parameters have a minimum or maximum: " + name)
+        return dict(spec, type=spec.get("type", "string"))
+
+    @staticmethod
+    def createInstanceForVerb(verb, names, column_types=None):
+        """names are the parameters the verb's query and pagination or rollup read.  Declared parameters override the
+        types of their columns."""
+        names = list(names) + list(verb.plan.parameter_names if hasattr(verb, "plan") else [])
+        names = [name for name in names if name != "IDEMPOTENCY_KEY" or verb.spool is None]
+        if verb.rollup is not None or not hasattr(verb, "plan"):
+            required = []
+        else:
+            required = [name for name in verb.plan.parameter_names if name in names]
+        if verb.shard is not None:
+            names.append(verb.shard.key)
+            required.append(verb.shard.key)
+        for observer in verb.observers:
+            names.extend(observer.getFieldNames())
+        specs = collections.OrderedDict([(name, column_types[name]) for name in sorted(column_types or {}) if name in names])
+        for name in sorted(verb.parameter_specs):
+            specs[name] = verb.parameter_specs[name]
+        return ParameterSchema(sorted(set(names), key=names.index), sorted(set(required), key=required.index), specs)
+
+    @staticmethod
+    def compileCheck(name, spec):
+        coerce = ParameterSchema.COERCERS[spec["type"]]
+        nullable = spec.get("nullable", True)
+        minimum = spec.get("minimum")
+        maximum = spec.get("maximum")
+        max_length = spec.get("maxLength")
+        choices = spec.get("enum")
+        pattern = re.compile(spec["pattern"]) if "pattern" in spec else None
+        description = ("an " if spec["type"][0] in "aeiou" else "a ") + spec["type"]
+
+        def check(value):
+            if value is None:
+                if nullable:
+                    return None
+                raise InvalidParameter("{} can't be null".format(name))
+            try:
+                value = coerce(value)
+            except (ArithmeticError, InvalidParameter, TypeError, ValueError):
+                raise InvalidParameter("{} must be {}".format(name, description))
+            if minimum is not None and value < minimum:
+                raise InvalidParameter("{} must be at least {}".format(name, minimum))
+            if maximum is not None and value > maximum:
+                raise InvalidParameter("{} must be at most {}".format(name, maximum))
+            if max_length is not None and len(type(u"")(value)) > max_length:
+                raise InvalidParameter("{} must be at most {} characters".format(name, max_length))
+            if choices is not None and value not in choices:
+                raise InvalidParameter("{} must be one of {}".format(name, ", ".join([str(choice) for choice in choices])))
+            if pattern is not None and pattern.match(type(u"")(value)) is None:
+                raise InvalidParameter("{} must match {}".format(name, pattern.pattern))
+            return value
+        return check
+
+    def merge(self, url_params=None, request_body=None, headers=None):
+        """The verb's parameters from the query string, then the body, then headers of the same names, converted to
+        their types.  Other keys and headers are never copied."""
+        names = self._names
+        merged = {}
+        if url_params:
+            for key, value in url_params.items():
+                key = key.upper()
+                if key in names:
+                    merged[key] = value
+        if request_body:
+            for key, value in request_body.items():
+                key = key.upper()
+                if key in names:
+                    merged[key] = value
+        if headers:
+            for name in self.names:
+                # X_DEVICE is sent as X-Device.  Werkzeug's WSGI headers would find it either way, plain Headers don't.
+                value = headers.get(name.replace("_", "-"))
+                if value is not None:
+                    merged[name] = value
+        for name, value in self._defaults:
+            if name not in merged:
+                merged[name] = value
+        for name, check in self._checks:
+            if name in merged:
+                merged[name] = check(merged[name])
+        for name in self.required:
+            if name not in merged:
+                raise MissingParameter(name)
+        return merged
 
-    def createSuccessResponse(self, data):
-        return self.createResponse("success", 200, data)
+    def describe(self, name):
+        """The JSON schema of a parameter for the OpenAPI document."""
+        spec = self.specs.get(name)
+        if spec is None:
+            return {}
+        kind = spec["type"]
+        described = {"type": "string", "format": "date-time" if kind == "datetime" else kind} if kind in ("datetime", "date", "decimal") \
+            else {"type": kind}
+        for key in ["minimum", "maximum", "maxLength", "enum", "pattern", "default"]:
+            if key in spec:
+                described[key] = spec[key]
+        if spec.get("nullable", True):
+            described["nullable"] = True
+        return described
 
-class HelpRestEndpoint(RestEndpoint):
-    def __init__(self, www_dir, path, endpoint_divs):
-        self._endpoint_divs = endpoint_divs
+class SchemaCache(object):
+    """The columns each GET query returns, read from MySQL once and kept in memory.  With a path the columns are
+    also saved to a JSON file keyed on a hash of the query, so later startups and reloads only ask MySQL about
+    queries that changed.  With infer the columns of the tables that queries compare or insert parameters into are
+    read and saved too, keyed on the table name, to type those parameters."""
+    def __init__(self, path=None, infer=True):
         self._path = path
-        self._www_dir = www_dir;
-
-    def createJavascriptTags(self, filename):
-        javascript_path = os.path.join(self._www_dir, filename)
-        logger.debug("Reading javascript file: " + javascript_path)
-        f = open(javascript_path)
-        contents = f.read()
-        f.close()
-        return '\n<script type="text/javascript">\n' + contents + '\n</script>\n'
-
-    def createCssTags(self, filename):
-        css_path = os.path.join(self._www_dir, filename)
-        logger.debug("Reading css file: " + css_path)
-        f = open(css_path)
-        contents = f.read()
-        f.close()
-        return '\n<style>\n' + contents + '\n</style>\n'
-
-    def executeGet(self, connection, url_params_str=None, request_body_str=None):
-        help_path = os.path.join(self._www_dir, "help.html")
-        logger.debug("Reading help file: " + help_path)
-        f = open(help_path)
-        html = f.read()
-        f.close()
-        return html % {"imports": self.createJavascriptTags('jquery/jquery-1.11.3.min.js')
-            + self.createJavascriptTags('jquery/jquery-ui.min.js')
-            + self.createCssTags('jquery/jquery-ui.min.css')
-            + self.createCssTags('jquery/jquery-ui.theme.min.css'),
-            "endpoints": self._endpoint_divs}
+        self._infer = infer
+        self._columns = {}
+        if path and os.path.exists(path):
+            try:
+                with open(path, "r") as f:
+                    self._columns = json.load(f)
+            except (IOError, OSError, ValueError) as err:
+                logger.warning("Ignoring unreadable schema cache {}: {}".format(path, err))
+
+    @staticmethod
+    def createInstanceFromConfig(config):
+        return SchemaCache(config.get("schema_cache"), config.get("parameter_inference", True))
+
+    @staticmethod
+    def createKey(plan):
+        return hashlib.sha1(toBytes(plan.sql)).hexdigest()
+
+    @staticmethod
+    def describes(verb):
+        plan = getattr(verb, "plan", None)
+        return verb.rollup is None and plan is not None and plan.preparable and plan.statement_type == "SELECT"
+
+    def introspect(self, server):
+        """Reads the columns of every GET query and referenced table that isn't in the cache yet, and drops the ones
+        no verb uses."""
+        columns = {}
+        read = 0
+        for path in sorted(server.endpoints):
+            for method, verb in sorted(server.endpoints[path].getVerbs().items()):
+                described = []
+                if method == "GET" and SchemaCache.describes(verb):
+                    described.append((SchemaCache.createKey(verb.plan), verb.plan))
+                references = self.getReferences(verb)
+                if references is not None:
+                    described.append(("table:" + references[0], QueryPlan("SELECT * FROM " + references[0])))
+                for key, plan in described:
+                    if key in columns:
+                        continue
+                    if key not in self._columns:
+                        connection = server.getConnection(verb, 0 if verb.shard is not None else None)
+                        try:
+                            self._columns[key] = connection.getColumnInfo(plan)
+                            read += 1
+                        except mysql.connector.Error as err:
+                            logger.warning("Unable to read the columns of " + method + " " + path + ": {}".format(err))
+                            continue
+                        finally:
+                            server.releaseConnection(connection)
+                    columns[key] = self._columns[key]
+        changed = read > 0 or len(columns) != len(self._columns)
+        self._columns = columns
+        if changed and self._path:
+            self.save()
+
+    def save(self):
+        # Written to a temporary file and renamed, so workers starting at the same time never read half a file.
+        directory = os.path.dirname(os.path.abspath(self._path))
+        try:
+            handle, temporary_path = tempfile.mkstemp(prefix=".schema-", dir=directory)
+            with os.fdopen(handle, "w") as f:
+                json.dump(self._columns, f, indent=2, sort_keys=True)
+            os.rename(temporary_path, self._path)
+        except (IOError, OSError) as err:
+            logger.warning("Unable to save schema cache {}: {}".format(self._path, err))
+
+    def getColumns(self, verb):
+        if verb.rollup is not None:
+            types = {"BUCKET": "DATETIME", "COUNT": "LONGLONG"}
+            return [{"name": name, "type": types.get(name, "DOUBLE"), "nullable": False} for name in Rollup.COLUMNS]
+        if not SchemaCache.describes(verb):
+            return None
+        return self._columns.get(SchemaCache.createKey(verb.plan))
+
+    def getReferences(self, verb):
+        plan = getattr(verb, "plan", None)
+        if not self._infer or verb.rollup is not None or plan is None:
+            return None
+        references = plan.getColumnReferences()
+        return references if references is not None and references[1] else None
+
+    def getParameterTypes(self, verb):
+        """The types of the parameters a verb compares with or inserts into a column of a known type."""
+        references = self.getReferences(verb)
+        if references is None:
+            return {}
+        table, parameters = references
+        columns = dict([(column["name"].upper(), column["type"]) for column in self._columns.get("table:" + table) or []])
+        types = {}
+        for name, column in parameters.items():
+            if ParameterSchema.COLUMN_TYPES.get(columns.get(column)) is not None:
+                types[name] = ParameterSchema.COLUMN_TYPES[columns[column]]
+        return types
+
+    def getParameters(self, verb):
+        if verb.rollup is not None:
+            parameters = ["BUCKET", "FROM", "TO", "RAW"]
+            return parameters + [verb.rollup.key] if verb.rollup.key else parameters
+        parameters = list(verb.plan.parameter_names) if hasattr(verb, "plan") else []
+        if verb.pagination is not None:
+            parameters = [name for name in parameters if name not in ("AFTER", "LIMIT")] + ["AFTER", "LIMIT"]
+        return sorted(set(parameters), key=parameters.index)
+
+class ApiDocuments(object):
+    """The help page and OpenAPI document, rendered once when the server is created and served from memory with
+    an ETag."""
+    JSON_TYPES = {"TINY": "integer", "SHORT": "integer", "LONG": "integer", "LONGLONG": "integer", "INT24": "integer",
+                  "YEAR": "integer", "BIT": "integer", "DECIMAL": "number", "NEWDECIMAL": "number", "FLOAT": "number",
+                  "DOUBLE": "number"}
+    STRING_FORMATS = {"DATE": "date", "DATETIME": "date-time", "TIMESTAMP": "date-time"}
+    HELP_PAGE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>%(title)s</title>
+<style>
+body { font-family: sans-serif; margin: 2em; }
+h3 { margin-bottom: 0.2em; }
+div { margin-left: 1em; }
+</style>
+</head>
+<body>
+<h1>%(title)s</h1>
+<p>Version %(version)s.  The <a href="openapi.json">OpenAPI document</a> describes the same endpoints.</p>
+%(endpoints)s
+</body>
+</html>
+"""
+
+    def __init__(self, server, schema):
+        self._documents = {"help": CachedResponse(toBytes(self.createHelpPage(server, schema)), "text/html", None),
+                           "openapi.json": CachedResponse(toBytes(json.dumps(self.createOpenApi(server, schema), sort_keys=True)), "application/json", None)}
+
+    def get(self, name):
+        return self._documents.get(name)
+
+    def createHelpPage(self, server, schema):
+        divs = "".join([server.endpoints[path].createHtmlDiv(schema) for path in sorted(server.endpoints)])
+        return ApiDocuments.HELP_PAGE % {"title": "IOT Rest Datastore", "version": escapeHtml(server.version), "endpoints": divs}
+
+    @staticmethod
+    def createColumnSchema(column):
+        if column["type"] in ApiDocuments.STRING_FORMATS:
+            column_schema = {"type": "string", "format": ApiDocuments.STRING_FORMATS[column["type"]]}
+        else:
+            column_schema = {"type": ApiDocuments.JSON_TYPES.get(column["type"], "string")}
+        if column["nullable"]:
+            column_schema["nullable"] = True
+        return column_schema
+
+    def createResponseSchema(self, verb, columns):
+        if verb.columnar:
+            data = {"type": "object", "properties": {"columns": {"type": "array", "items": {"type": "string"}},
+                                                     "rows": {"type": "array", "items": {"type": "array", "items": {}}}}}
+        else:
+            row = {"type": "object"}
+            if columns is not None:
+                row["properties"] = collections.OrderedDict([(column["name"], ApiDocuments.createColumnSchema(column)) for column in columns])
+            data = {"type": "array", "items": row}
+        properties = {"status": {"type": "string"}, "data": data}
+        if verb.pagination is not None:
+            properties["next"] = {"nullable": True}
+        return {"type": "object", "properties": properties}
+
+    def createOperation(self, method, verb, schema):
+        parameters = schema.getParameters(verb)
+        operation = {"summary": verb.description,
+                     "responses": {"401": {"description": "Invalid credentials or permissions"}}}
+        described = verb.schema.describe if verb.schema is not None else lambda name: {}
+        if method == "GET":
+            operation["parameters"] = [{"name": name.lower(), "in": "query", "schema": described(name) or {"type": "string"},
+                                        "required": name in verb.schema.required if verb.schema is not None else verb.rollup is None and name in verb.plan.parameter_names}
+                                       for name in parameters]
+            operation["responses"]["200"] = {"description": "Rows returned by the query",
+                                             "content": {"application/json": {"schema": self.createResponseSchema(verb, schema.getColumns(verb))}}}
+        else:
+            row = {"type": "object", "properties": collections.OrderedDict([(name, described(name)) for name in parameters]), "required": parameters}
+            body = {"oneOf": [row, {"type": "array", "items": row}]} if method in ("PUT", "POST") else row
+            operation["requestBody"] = {"content": {"application/json": {"schema": body}}}
+            operation["responses"]["200"] = {"description": "The statement succeeded"}
+            if verb.buffered is not None:
+                operation["responses"]["202"] = {"description": "The rows were queued"}
+        return operation
+
+    def createOpenApi(self, server, schema):
+        paths = collections.OrderedDict()
+        for path in sorted(server.endpoints):
+            verbs = server.endpoints[path].getVerbs()
+            paths["/" + path] = collections.OrderedDict([(method.lower(), self.createOperation(method, verbs[method], schema))
+                                                         for method in ["GET", "POST", "PUT", "DELETE"] if method in verbs])
+        return {"openapi": "3.0.3",
+                "info": {"title": "IOT Rest Datastore", "version": str(server.version)},
+                "components": {"securitySchemes": {"basic": {"type": "http", "scheme": "basic"}}},
+                "security": [{"basic": []}],
+                "paths": paths}
+
+class CronSchedule(object):
+    """A five field cron expression: minute, hour, day of month, month and day of week (0 or 7 is Sunday), in UTC.
+    Fields take *, numbers, ranges, lists and /steps.  Like cron, a restricted day of month and day of week match
+    when either does."""
+    FIELDS = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 7)]
+
+    def __init__(self, expression):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise Exception("Invalid cron expression: " + expression)
+        try:
+            self._minutes, self._hours, self._days, self._months, weekdays = \
+                [CronSchedule.parseField(field, low, high) for field, (low, high) in zip(fields, CronSchedule.FIELDS)]
+        except ValueError:
+            raise Exception("Invalid cron expression: " + expression)
+        self._weekdays = set([weekday % 7 for weekday in weekdays])
+        self._any_day = fields[2].startswith("*")
+        self._any_weekday = fields[4].startswith("*")
+        self._expression = expression
+
+    @staticmethod
+    def parseField(field, low, high):
+        values = set()
+        for part in field.split(","):
+            span, _, step = part.partition("/")
+            if span == "*":
+                start, end = low, high
+            elif "-" in span:
+                start, end = [int(value) for value in span.split("-", 1)]
+            else:
+                start = int(span)
+                end = high if step else start
+            step = int(step) if step else 1
+            if not low <= start <= end <= high or step < 1:
+                raise ValueError(part)
+            values.update(range(start, end + 1, step))
+        return values
+
+    def matchesDay(self, moment):
+        day = moment.day in self._days
+        weekday = (moment.weekday() + 1) % 7 in self._weekdays
+        if self._any_day:
+            return weekday
+        if self._any_weekday:
+            return day
+        return day or weekday
+
+    def nextTime(self, after):
+        moment = datetime.datetime.utcfromtimestamp(int(after // 60) * 60 + 60)
+        limit = moment + datetime.timedelta(days=5 * 366)
+        while moment < limit:
+            if moment.month not in self._months:
+                moment = (moment.replace(day=1, hour=0, minute=0) + datetime.timedelta(days=32)).replace(day=1)
+            elif not self.matchesDay(moment):
+                moment = moment.replace(hour=0, minute=0) + datetime.timedelta(days=1)
+            elif moment.hour not in self._hours:
+                moment = moment.replace(minute=0) + datetime.timedelta(hours=1)
+            elif moment.minute not in self._minutes:
+                moment += datetime.timedelta(minutes=1)
+            else:
+                return calendar.timegm(moment.timetuple())
+        raise Exception("Cron expression never matches: " + self._expression)
+
+class IntervalSchedule(object):
+    def __init__(self, seconds):
+        self._seconds = seconds
+
+    def nextTime(self, after):
+        return after + self._seconds
+
+class SqlTask(object):
+    """Runs a statement on the task connection pool.  A MySQL named lock keeps other processes and hosts from
+    running the same task at the same time.  With repeat, the statement is run again while it changes rows, so a
+    purge can delete in small batches such as DELETE ... LIMIT 5000 instead of holding locks on the whole table."""
+    def __init__(self, name, query, commit=True, repeat=False, max_repeats=1000):
+        self._lock_name = "ird-task:" + name
+        self._query = query
+        self._commit = commit
+        self._repeat = repeat
+        self._max_repeats = max_repeats
+
+    def run(self, scheduler):
+        connection = scheduler.pool.checkout()
+        try:
+            status, data = connection.execute("SELECT GET_LOCK(%(NAME)s, 0)", {"NAME": self._lock_name})
+            if not status:
+                return "failure"
+            if not data or data.rows[0][0] != 1:
+                return "locked"
+            try:
+                for _ in range(self._max_repeats if self._repeat else 1):
+                    status, row_count = connection.executeUpdate(self._query, self._commit)
+                    if not status:
+                        return "failure"
+                    if row_count <= 0:
+                        break
+            finally:
+                connection.execute("SELECT RELEASE_LOCK(%(NAME)s)", {"NAME": self._lock_name})
+            return "success"
+        finally:
+            scheduler.pool.release(connection)
+
+class CallableTask(object):
+    """Calls module:function with the RestHttpServer."""
+    def __init__(self, target):
+        module_name, _, function_name = target.partition(":")
+        if not function_name:
+            raise Exception("Task callable must be module:function: " + target)
+        self._module_name = module_name
+        self._function_name = function_name
+        self._function = None
+
+    def run(self, scheduler):
+        if self._function is None:
+            self._function = getattr(importlib.import_module(self._module_name), self._function_name)
+        self._function(scheduler.server)
+        return "success"
+
+class ScriptTask(object):
+    """Runs a Python file from the tasks directory, with the RestHttpServer as server."""
+    def __init__(self, path):
+        with open(path, "r") as f:
+            self._code = compile(f.read(), path, "exec")
+
+    def run(self, scheduler):
+        exec(self._code, {"__name__": "ird_task", "server": scheduler.server, "logger": logger})
+        return "success"
+
+class ScheduledTask(object):
+    OUTCOMES = ["success", "failure", "overlap", "locked"]
+
+    def __init__(self, name, action, schedule=None, jitter=0.0, run_at_start=False):
+        self.name = name
+        self.action = action
+        self.schedule = schedule
+        self.jitter = jitter
+        self.run_at_start = run_at_start
+        self.next_run = None
+        self._lock = threading.Lock()
+        self._running = False
+        self._outcomes = dict([(outcome, 0) for outcome in ScheduledTask.OUTCOMES])
+        self._seconds = 0.0
+        self._last_seconds = None
+        self._last_started = None
+
+    @staticmethod
+    def createInstanceFromConfig(task_element):
+        name = task_element.get("name", task_element.get("file"))
+        if not name:
+            raise Exception("Task is missing a name: " + json.dumps(task_element))
+        if "query" in task_element:
+            action = SqlTask(name, task_element["query"], task_element.get("commit", True), task_element.get("repeat", False),
+                             task_element.get("maxRepeats", 1000))
+        elif "callable" in task_element:
+            action = CallableTask(task_element["callable"])
+        elif "file" in task_element:
+            action = ScriptTask(os.path.join(default_tasks_dir, task_element["file"]))
+        else:
+            raise Exception("Task needs a query, callable or file: " + name)
+        if "cron" in task_element:
+            schedule = CronSchedule(task_element["cron"])
+        elif "every" in task_element:
+            schedule = IntervalSchedule(parseDuration(task_element["every"]))
+        else:
+            schedule = None
+        # A task without a schedule runs once at startup, which is what every task used to do.
+        return ScheduledTask(name, action, schedule, task_element.get("jitter", 0.0), task_element.get("runAtStart", schedule is None))
+
+    def scheduleNext(self, now):
+        if self.schedule is None:
+            self.next_run = None
+        else:
+            self.next_run = self.schedule.nextTime(now) + random.uniform(0, self.jitter)
+
+    def begin(self):
+        """Marks the task running.  Returns False, and counts an overlap, if the last run hasn't finished."""
+        with self._lock:
+            if self._running:
+                self._outcomes["overlap"] += 1
+                return False
+            self._running = True
+            return True
+
+    def run(self, scheduler):
+        started = time.time()
+        began = clock()
+        outcome = "failure"
+        try:
+            outcome = self.action.run(scheduler)
+        except Exception:
+            logger.exception("Task failed: " + self.name)
+        seconds = clock() - began
+        if outcome == "failure":
+            logger.error("Task {} failed after {:.3f} seconds".format(self.name, seconds))
+        else:
+            logger.info("Task {} finished with {} in {:.3f} seconds".format(self.name, outcome, seconds))
+        with self._lock:
+            self._running = False
+            self._outcomes[outcome] += 1
+            self._seconds += seconds
+            self._last_seconds = seconds
+            self._last_started = started
+
+    def getMetrics(self):
+        with self._lock:
+            metrics = dict(self._outcomes)
+            metrics.update({"running": self._running, "seconds": self._seconds, "last_seconds": self._last_seconds,
+                            "last_started": self._last_started, "next_run": self.next_run})
+            return metrics
+
+class TaskScheduler(object):
+    """Runs scheduled tasks on a fixed number of worker threads and a connection pool of their own, so slow tasks
+    never hold up request threads or their connections.  A task that is still running, or waiting for a worker,
+    when it comes due again is skipped rather than queued twice."""
+    def __init__(self, server, pool=None, workers=2):
+        self.server = server
+        self.pool = pool
+        self._tasks = []
+        self._queue = queue.Queue()
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self.run, name="task scheduler")
+        self._thread.daemon = True
+        self._workers = [threading.Thread(target=self.work, name="task worker " + str(index)) for index in range(max(1, workers))]
+        for worker in self._workers:
+            worker.daemon = True
+
+    @staticmethod
+    def createInstanceFromConfig(server, config):
+        tasks = [ScheduledTask.createInstanceFromConfig(task_element) for task_element in config.get("tasks", [])]
+        workers = config.get("task_workers", 2)
+        pool = None
+        if any([isinstance(task.action, SqlTask) for task in tasks]):
+            pool = MySqlConnectionPool.createInstanceFromConfig(dict(config, database_pool_size=workers), "tasks")
+        scheduler = TaskScheduler(server, pool, workers)
+        for task in tasks:
+            scheduler.add(task)
+        return scheduler
+
+    def add(self, task):
+        self._tasks.append(task)
+
+    def start(self):
+        if not self._tasks:
+            return
+        logger.info("Starting task scheduler with {} tasks".format(len(self._tasks)))
+        now = time.time()
+        for task in self._tasks:
+            if task.run_at_start:
+                task.next_run = now
+            else:
+                task.scheduleNext(now)
+        for worker in self._workers:
+            worker.start()
+        self._thread.start()
+
+    def run(self):
+        while not self._stopping.is_set():
+            now = time.time()
+            for task in self._tasks:
+                if task.next_run is not None and task.next_run <= now:
+                    if task.begin():
+                        self._queue.put(task)
+                    task.scheduleNext(now)
+            due = [task.next_run for task in self._tasks if task.next_run is not None]
+            self._stopping.wait(min(60.0, max(0.01, min(due) - time.time())) if due else 60.0)
+
+    def work(self):
+        while True:
+            task = self._queue.get()
+            if task is None:
+                return
+            task.run(self)
+
+    def stop(self, timeout=30.0):
+        if not self._thread.is_alive():
+            return
+        logger.info("Stopping task scheduler")
+        self._stopping.set()
+        self._thread.join(timeout)
+        for worker in self._workers:
+            self._queue.put(None)
+        deadline = time.time() + timeout
+        for worker in self._workers:
+            worker.join(max(0.0, deadline - time.time()))
+            if worker.is_alive():
+                logger.warning("Stopped waiting for a running task: " + worker.name)
+        if self.pool is not None:
+            self.pool.close()
+
+    def getMetrics(self):
+        return dict([(task.name, task.getMetrics()) for task in self._tasks])
 
 class RestHttpServer():
 
-    def __init__(self, database_connection):
+    def __init__(self, cluster):
         self.endpoints = {}
-        self._connection = database_connection
-        self._connection.checkConnection()
-        self._users = {}
+        self._cluster = cluster
+        # Fail fast at startup if the database is unreachable.  Replicas are skipped until they answer.
+        cluster.primary.release(cluster.primary.checkout())
+        self._shards = {}
+        self._shard_clusters = {}
+        self._authenticator = Authenticator()
+        self._routes = {}
+        self._writers = {}
+        self._spools = {}
+        self._rollups = {}
+        self._caches = {}
+        self._flights = {}
+        self._invalidations = collections.defaultdict(list)
+        self.format_adapters = FormatAdapters(JsonAdapter())
+        self.compressor = None
+        self.request_metrics = RequestMetrics()
+        self.debug_sampler = None
+        self.documents = None
+        self.scheduler = None
+        self.broadcaster = EventBroadcaster(JsonAdapter().encode)
+        self.admission = None
+        self.max_body_bytes = 16777216
+        self._user_limits = {}
+        self._shut_down = False
 
-    def addUser(self, username, password):
-        if username and password:
-            self._users[username] = User(username, password)
+    def setAuthenticator(self, authenticator):
+        self._authenticator = authenticator
 
-    def authenticate(self, username, password):
-        return username and password and username in self._users and self._users[username].authenticate(username, password)
+    def addUser(self, username, password, tokens=None, rate_limit=None):
+        if username and (password or tokens):
+            self._authenticator.addUser(User(username, password, tokens, rate_limit))
+            if rate_limit is not None:
+                self._user_limits[username] = rate_limit
+
+    def admit(self, user, record=None):
+        """Turns a request away with TooManyRequests when its user or verb is over its rate limit."""
+        if user.rate_limit is not None:
+            retry_after = user.rate_limit.take()
+            if retry_after:
+                raise TooManyRequests("user " + user.getUsername() + " is over its rate limit", retry_after)
+        if record is not None and record.rate_limit is not None:
+            retry_after = record.rate_limit.take()
+            if retry_after:
+                raise TooManyRequests(record.method + " " + record.path + " is over its rate limit", retry_after)
+
+    def authenticate(self, authorization):
+        return self._authenticator.authenticate(authorization)
+
+    def getAuthMetrics(self):
+        return self._authenticator.getMetrics()
+
+    def addShards(self, name, key, clusters):
+        for cluster in clusters:
+            cluster.primary.release(cluster.primary.checkout())
+        self._shards[name] = ShardMap(name, key, len(clusters))
+        self._shard_clusters[name] = clusters
+
+    def getCluster(self, verb=None, shard=None):
+        if shard is None:
+            return self._cluster
+        return self._shard_clusters[verb.shard.name][shard]
+
+    def getClusters(self):
+        clusters = [self._cluster]
+        for name in sorted(self._shard_clusters):
+            clusters.extend(self._shard_clusters[name])
+        return clusters
 
     def addEndpoint(self, endpoint):
         logger.info("Adding new endpoint: " + str(endpoint))
         self.endpoints[endpoint._path] = endpoint
+        for method, verb in endpoint.getVerbs().items():
+            if verb.shard_name is not None:
+                if verb.shard_name not in self._shards:
+                    raise Exception("Unknown shard for " + method + " " + endpoint._path + ": " + verb.shard_name)
+                if verb.bulk.load is not None:
+                    raise Exception("Uploads can't be loaded into a sharded endpoint: " + method + " " + endpoint._path)
+                verb.shard = self._shards[verb.shard_name]
+            if verb.cache is not None and method == "GET":
+                self._caches[endpoint._path] = verb.cache
+                for path in verb.cache.invalidated_by or [endpoint._path]:
+                    self._invalidations[path.lower()].append(verb.cache)
+            if verb.single_flight is not None and method == "GET":
+                if verb.stream or verb.rollup is not None:
+                    logger.warning("Streamed and rollup responses are not shared between requests: " + method + " " + endpoint._path)
+                self._flights[endpoint._path] = verb.single_flight
+                for path in verb.single_flight.invalidated_by or [endpoint._path]:
+                    self._invalidations[path.lower()].append(verb.single_flight)
+            if verb.spooled is not None and method in ("PUT", "POST"):
+                if not verb.plan.preparable:
+                    raise Exception("A spooled verb needs a single statement query: " + method + " " + endpoint._path)
+                spool = WriteSpool.createInstanceFromConfig(method + " " + endpoint._path, verb.plan, verb.commit, verb.spooled)
+                spool.get_pool = self.createPoolLookup(verb)
+                spool.on_flush = self.createInvalidator(endpoint._path)
+                spool.observers = verb.observers
+                self._spools[method + " " + endpoint._path] = spool
+                verb.spool = spool
+                spool.open()
+                if verb.buffered is not None:
+                    logger.warning("Spooled writes are not buffered as well: " + method + " " + endpoint._path)
+                continue
+            if verb.buffered is not None and method != "GET" and not verb.plan.preparable:
+                logger.warning("Buffered ingest needs a single statement query, writing directly instead: " + method + " " + endpoint._path)
+            elif verb.buffered is not None and method != "GET":
+                if verb.shard is None:
+                    clusters = [(method + " " + endpoint._path, self._cluster)]
+                else:
+                    clusters = [(method + " " + endpoint._path + " " + cluster.name, cluster) for cluster in self._shard_clusters[verb.shard.name]]
+                for name, cluster in clusters:
+                    writer = BufferedWriter.createInstanceFromConfig(name, verb.plan, cluster.primary, verb.commit, verb.buffered)
+                    writer.on_flush = self.createInvalidator(endpoint._path)
+                    writer.observers = verb.observers
+                    self._writers[name] = writer
+                    verb.writers.append(writer)
+                    writer.start()
+
+    def connectRollups(self):
+        """Feeds each GET rollup from the write verbs named in its sources, once every endpoint has been added."""
+        for path, endpoint in self.endpoints.items():
+            verb = endpoint.get_verb
+            if verb is None or verb.rollup is None:
+                continue
+            if verb.shard is not None:
+                raise Exception("Rollups can't be kept for a sharded endpoint: GET " + path)
+            for source in verb.rollup.sources:
+                method, _, source_path = source.partition(" ")
+                source_endpoint = self.endpoints.get(source_path.strip().lower())
+                source_verb = source_endpoint.getVerbs().get(method.upper()) if source_endpoint else None
+                if source_verb is None or method.upper() not in ("PUT", "POST"):
+                    raise Exception("Unknown rollup source for GET " + path + ": " + source)
+                source_verb.observers.append(verb.rollup)
+            self._rollups[path] = verb.rollup
+            verb.rollup.start(self._cluster.primary)
+
+    def connectPublishers(self):
+        """Publishes the writes of each verb with pusherEvents to the channels they name, once every endpoint has been
+        added.  A channel is the path of an endpoint with a GET verb, whose users may subscribe to it."""
+        for path, endpoint in self.endpoints.items():
+            for method, verb in endpoint.getVerbs().items():
+                if not verb.pusher_events:
+                    continue
+                if method not in ("PUT", "POST"):
+                    raise Exception("Only PUT and POST verbs publish events: " + method + " " + path)
+                for event_element in verb.pusher_events:
+                    publisher = EventPublisher.createInstanceFromConfig(self.broadcaster, event_element, path, method, verb.plan)
+                    channel_endpoint = self.endpoints.get(publisher.channel)
+                    if channel_endpoint is None or channel_endpoint.get_verb is None:
+                        raise Exception("Unknown event channel for " + method + " " + path + ", expected the path of a GET endpoint: " + publisher.channel)
+                    self.broadcaster.addChannel(publisher.channel)
+                    verb.observers.append(publisher)
+
+    def compileRoutes(self):
+        """Resolves every endpoint and method to a DispatchRecord up front so a request costs two dictionary
+        lookups and a bitwise and."""
+        bits = self._authenticator.getUserBits()
+        routes = {}
+        for path, endpoint in self.endpoints.items():
+            methods = {}
+            for method, verb in endpoint.getVerbs().items():
+                permitted = 0
+                for username in verb.getUsernames():
+                    if username in bits:
+                        permitted |= bits[username]
+                    else:
+                        logger.warning("Endpoint " + method + " " + path + " allows an unknown user: " + username)
+                metrics = self.request_metrics.getVerbMetrics(path, method) if self.request_metrics else None
+                methods[method] = DispatchRecord(endpoint, method, permitted, metrics)
+            routes[path] = methods
+        self._routes = routes
+
+    def getRoutes(self, path):
+        return self._routes.get(path)
+
+    def getVerbMetrics(self, path, method):
+        methods = self._routes.get(path)
+        record = methods.get(method) if methods else None
+        return record.metrics if record else None
+
+    def renderMetrics(self):
+        text = MetricsText()
+        self.request_metrics.addTo(text)
+        pools = [([("database", name)], pool.getMetrics()) for cluster in self.getClusters() for name, pool in cluster.getPools()]
+        text.addFamily("ird_pool_size", "gauge", "The maximum number of database connections.",
+                       [(labels, pool["size"]) for labels, pool in pools])
+        text.addFamily("ird_pool_connections", "gauge", "Open database connections by state.",
+                       [(labels + [("state", state)], pool[state]) for labels, pool in pools for state in ["idle", "in_use"]])
+        text.addFamily("ird_pool_checkouts_total", "counter", "Connections handed out to requests.", [(labels, pool["checkouts"]) for labels, pool in pools])
+        text.addFamily("ird_pool_waits_total", "counter", "Checkouts that had to wait for a free connection.", [(labels, pool["waits"]) for labels, pool in pools])
+        text.addFamily("ird_pool_timeouts_total", "counter", "Checkouts that gave up waiting.", [(labels, pool["timeouts"]) for labels, pool in pools])
+        text.addFamily("ird_pool_discarded_total", "counter", "Broken connections closed instead of returned.", [(labels, pool["discarded"]) for labels, pool in pools])
+        text.addFamily("ird_pool_wait_seconds_total", "counter", "Time spent waiting for a free connection.", [(labels, pool["wait_seconds"]) for labels, pool in pools])
+        text.addFamily("ird_replica_failovers_total", "counter", "Reads moved off a read replica that could not be reached.",
+                       [([("database", cluster.name)], cluster.getMetrics()["failovers"]) for cluster in self.getClusters() if cluster.replicas])
+        ingest = self.getIngestMetrics()
+        text.addFamily("ird_ingest_queued", "gauge", "Rows waiting to be written by a buffered writer.",
+                       [([("writer", name)], metrics["queued"]) for name, metrics in ingest.items()])
+        text.addFamily("ird_ingest_rows_total", "counter", "Rows seen by a buffered writer by outcome.",
+                       [([("writer", name), ("outcome", outcome)], metrics[outcome]) for name, metrics in ingest.items() for outcome in ["enqueued", "rejected", "flushed", "failed"]])
+        text.addFamily("ird_ingest_batches_total", "counter", "Batches written by a buffered writer.",
+                       [([("writer", name)], metrics["batches"]) for name, metrics in ingest.items()])
+        spools = self.getSpoolMetrics()
+        text.addFamily("ird_spool_pending", "gauge", "Spooled rows waiting to be replayed to the database.",
+                       [([("spool", name)], metrics["pending"]) for name, metrics in spools.items()])
+        text.addFamily("ird_spool_segments", "gauge", "Spool segment files that haven't been fully replayed.",
+                       [([("spool", name)], metrics["segments"]) for name, metrics in spools.items()])
+        text.addFamily("ird_spool_rows_total", "counter", "Rows seen by a spool by outcome.",
+                       [([("spool", name), ("outcome", outcome)], metrics[outcome]) for name, metrics in spools.items() for outcome in ["appended", "duplicates", "replayed", "rejected"]])
+        text.addFamily("ird_spool_retries_total", "counter", "Replay batches that couldn't reach the database and were retried.",
+                       [([("spool", name)], metrics["retries"]) for name, metrics in spools.items()])
+        rollups = self.getRollupMetrics()
+        text.addFamily("ird_rollup_pending_buckets", "gauge", "Rollup buckets waiting to be added to the rollup table.",
+                       [([("path", path)], metrics["pending"]) for path, metrics in rollups.items()])
+        text.addFamily("ird_rollup_rows_total", "counter", "Written rows added to a rollup.",
+                       [([("path", path)], metrics["observed"]) for path, metrics in rollups.items()])
+        text.addFamily("ird_rollup_flush_failures_total", "counter", "Rollup flushes that could not be written and were kept for the next flush.",
+                       [([("path", path)], metrics["failures"]) for path, metrics in rollups.items()])
+        push = self.getPushMetrics()
+        text.addFamily("ird_push_subscribers", "gauge", "Clients subscribed to the events of a channel.",
+                       [([("channel", channel)], metrics["subscribers"]) for channel, metrics in push.items()])
+        text.addFamily("ird_push_events_total", "counter", "Events published to the subscribers of a channel.",
+                       [([("channel", channel)], metrics["published"]) for channel, metrics in push.items()])
+        text.addFamily("ird_push_dropped_total", "counter", "Events discarded because a subscriber fell too far behind.",
+                       [([("channel", channel)], metrics["dropped"]) for channel, metrics in push.items()])
+        tasks = self.getTaskMetrics()
+        text.addFamily("ird_task_runs_total", "counter", "Scheduled task runs by outcome; overlap and locked runs were skipped because the task was still running.",
+                       [([("task", name), ("outcome", outcome)], metrics[outcome]) for name, metrics in tasks.items() for outcome in ScheduledTask.OUTCOMES])
+        text.addFamily("ird_task_seconds_total", "counter", "Time spent running a scheduled task.",
+                       [([("task", name)], metrics["seconds"]) for name, metrics in tasks.items()])
+        text.addFamily("ird_task_last_duration_seconds", "gauge", "How long the last run of a scheduled task took.",
+                       [([("task", name)], metrics["last_seconds"]) for name, metrics in tasks.items() if metrics["last_seconds"] is not None])
+        text.addFamily("ird_task_running", "gauge", "Whether a scheduled task is running or waiting for a task worker.",
+                       [([("task", name)], int(metrics["running"])) for name, metrics in tasks.items()])
+        caches = self.getCacheMetrics()
+        text.addFamily("ird_cache_entries", "gauge", "Responses held by a response cache.",
+                       [([("path", path)], metrics["entries"]) for path, metrics in caches.items()])
+        text.addFamily("ird_cache_lookups_total", "counter", "Response cache lookups by result.",
+                       [([("path", path), ("result", result)], metrics[key]) for path, metrics in caches.items() for result, key in [("hit", "hits"), ("miss", "misses")]])
+        text.addFamily("ird_cache_invalidations_total", "counter", "Times a response cache was cleared by a write.",
+                       [([("path", path)], metrics["invalidations"]) for path, metrics in caches.items()])
+        admission = self.getAdmissionMetrics()
+        # /metrics needs no login, so the users' limits are summed rather than labelled with usernames.
+        text.addFamily("ird_rate_limited_total", "counter", "Requests turned away because their user or verb was over its rate limit.",
+                       [([("limit", "user")], admission["users"])]
+                       + [([("limit", "verb"), ("verb", verb)], limited) for verb, limited in admission["verbs"].items()])
+        concurrency = admission["concurrency"]
+        if concurrency is not None:
+            text.addFamily("ird_admission_requests", "gauge", "Requests running and waiting for a turn to run.",
+                           [([("state", "active")], concurrency["active"]), ([("state", "waiting")], concurrency["waiting"])])
+            text.addFamily("ird_admission_requests_total", "counter", "Requests by admission outcome; queued requests are also counted as admitted or timeouts.",
+                           [([("outcome", outcome)], concurrency[outcome]) for outcome in ["admitted", "queued", "rejected", "timeouts"]])
+        flights = self.getSingleFlightMetrics()
+        text.addFamily("ird_single_flight_in_flight", "gauge", "GET queries running that identical requests can wait for.",
+                       [([("path", path)], metrics["in_flight"]) for path, metrics in flights.items()])
+        text.addFamily("ird_single_flight_requests_total", "counter", "GET requests that ran their query, or were coalesced into one already running.",
+                       [([("path", path), ("result", result)], metrics[key]) for path, metrics in flights.items() for result, key in [("query", "queries"), ("coalesced", "coalesced")]])
+        text.addFamily("ird_single_flight_timeouts_total", "counter", "Coalesced requests that gave up waiting and ran the query themselves.",
+                       [([("path", path)], metrics["timeouts"]) for path, metrics in flights.items()])
+        auth = self.getAuthMetrics()
+        text.addFamily("ird_auth_cache_entries", "gauge", "Verified credentials held by the authentication cache.", [([], auth["entries"])])
+        text.addFamily("ird_auth_cache_lookups_total", "counter", "Authentication cache lookups by result.",
+                       [([("result", "hit")], auth["hits"]), ([("result", "miss")], auth["misses"])])
+        return text.render()
 
     def getEndpoint(self, path):
         if path in self.endpoints:
             return self.endpoints[path]
         else:
-            logger.warn('Unable to respond to request: ' + path)
+            logger.warning('Unable to respond to request: ' + path)
             return None
 
     def shutdown(self):
-        self._connection.close()
-
-    def getConnection(self):
-        return self._connection
-
-    def createEndpointDivs(self):
-        rtrn_str = ""
-        for e in self.endpoints.values():
-            #logging.info("Creating div for: " + str(type(endpoint)))
-            rtrn_str += (e.createHtmlDiv(self._connection))
-        return rtrn_str
-
-    @staticmethod
-    def createFromConfig():
-        logger.info("Reading config file: " + default_config)
-        f = open(default_config, "r")
-        config_str = f.read()
-        f.close()
-        config = json.loads(config_str)
-        db_ip = config["database_ip_address"]
-        db = config["database"]
-        db_user = config["database_user"]
-        db_password = config["database_password"]
-        database_pool_size = config["database_pool_size"]
-        connection = MySqlConnection(db_ip, db, db_user, db_password, database_pool_size, "rest-datastore")
-        httpd = RestHttpServer(connection)
+        if self._shut_down:
+            return
+        self._shut_down = True
+        self.broadcaster.close()
+        if self.scheduler is not None:
+            self.scheduler.stop()
+        for spool in self._spools.values():
+            spool.stop()
+        for writer in self._writers.values():
+            writer.stop()
+        # After the writers, so rows from their last flush are in the rollups.
+        for rollup in self._rollups.values():
+            rollup.stop()
+        for cluster in self.getClusters():
+            cluster.close()
+
+    def getConnection(self, verb=None, shard=None):
+        """Checks out a connection for a verb: from a read replica if the verb reads from them, and from the verb's
+        shard when it has one."""
+        return self.getCluster(verb, shard).checkout(verb is not None and verb.reads)
+
+    def releaseConnection(self, connection):
+        connection.pool.release(connection)
+
+    def createPoolLookup(self, verb):
+        return lambda shard: self.getCluster(verb, shard).primary
+
+    def getPoolMetrics(self):
+        return self._cluster.primary.getMetrics()
+
+    def getDatabaseMetrics(self):
+        metrics = {"replicas": self._cluster.getMetrics()["replicas"], "shards": {}}
+        for name, clusters in self._shard_clusters.items():
+            metrics["shards"][name] = [cluster.getMetrics() for cluster in clusters]
+        return metrics
+
+    def invalidateCaches(self, path):
+        for cache in self._invalidations.get(path, []):
+            cache.invalidate()
+
+    def finishWrite(self, path, response):
+        """Clears the caches that writes to path invalidate, once the write has succeeded."""
+        if response.status_code < 400:
+            self.invalidateCaches(path)
+        return response
+
+    def createInvalidator(self, path):
+        return lambda: self.invalidateCaches(path)
+
+    def getCacheMetrics(self):
+        metrics = {}
+        for path, cache in self._caches.items():
+            metrics[path] = cache.getMetrics()
+        return metrics
+
+    def getAdmissionMetrics(self):
+        verbs = {}
+        for path, methods in self._routes.items():
+            for method, record in methods.items():
+                if record.rate_limit is not None:
+                    verbs[method + " " + path] = record.rate_limit.getLimited()
+        users = sum(bucket.getLimited() for bucket in self._user_limits.values())
+        return {"concurrency": self.admission.getMetrics() if self.admission is not None else None, "users": users, "verbs": verbs}
+
+    def getSingleFlightMetrics(self):
+        metrics = {}
+        for path, single_flight in self._flights.items():
+            metrics[path] = single_flight.getMetrics()
+        return metrics
+
+    def getIngestMetrics(self):
+        metrics = {}
+        for name, writer in self._writers.items():
+            metrics[name] = writer.getMetrics()
+        return metrics
+
+    def getSpoolMetrics(self):
+        metrics = {}
+        for name, spool in self._spools.items():
+            metrics[name] = spool.getMetrics()
+        return metrics
+
+    def getPushMetrics(self):
+        return self.broadcaster.getMetrics()
+
+    def getTaskMetrics(self):
+        return self.scheduler.getMetrics() if self.scheduler is not None else {}
+
+    def getRollupMetrics(self):
+        metrics = {}
+        for path, rollup in self._rollups.items():
+            metrics[path] = rollup.getMetrics()
+        return metrics
+
+    def describeEndpoints(self, schema):
+        schema.introspect(self)
+        self.compileParameters(schema)
+        self.documents = ApiDocuments(self, schema)
+
+    def compileParameters(self, schema):
+        for path, endpoint in self.endpoints.items():
+            for method, verb in endpoint.getVerbs().items():
+                verb.schema = ParameterSchema.createInstanceForVerb(verb, schema.getParameters(verb), schema.getParameterTypes(verb))
+
+    def getDocument(self, name):
+        return self.documents.get(name) if self.documents is not None else None
+
+    @staticmethod
+    def createFromConfig(config, run_tasks=True):
+        # LOAD DATA LOCAL lets the server ask for client files, so it is only allowed when a verb loads uploads.
+        allow_local_infile = any(["load" in endpoint.get("post", {}).get("bulk", {}) for endpoint in config["endpoints"]])
+        create_pool = lambda settings, name: MySqlConnectionPool.createInstanceFromConfig(settings, name, allow_local_infile)
+        httpd = RestHttpServer(DatabaseCluster.createInstanceFromConfig("primary", config, {}, config.get("database_replicas", []), create_pool))
+        for name, shard_element in config.get("shards", {}).items():
+            clusters = [DatabaseCluster.createInstanceFromConfig(name + "-" + str(index), config, database_element, database_element.get("replicas", []), create_pool)
+                        for index, database_element in enumerate(shard_element["databases"])]
+            httpd.addShards(name, shard_element["key"], clusters)
         httpd.version = config["version"]
+        json_adapter = JsonAdapter(config.get("json_encoder", "auto"))
+        logger.info("Serializing JSON with: " + json_adapter.encoder)
+        httpd.format_adapters = FormatAdapters.createInstanceFromConfig(json_adapter)
+        httpd.compressor = ResponseCompressor.createInstanceFromConfig(config.get("compression", {}))
+        httpd.broadcaster = EventBroadcaster.createInstanceFromConfig(config.get("push", {}), json_adapter.encode)
+        if config.get("metrics", True) is False:
+            logger.info("Request metrics are turned off.")
+            httpd.request_metrics = None
 
+        httpd.setAuthenticator(Authenticator.createInstanceFromConfig(config.get("auth_cache", {})))
         for user in config["users"]:
-            httpd.addUser(user["username"], user["password"])
+            rate_limit = TokenBucket.createInstanceFromConfig(user["rateLimit"]) if "rateLimit" in user else None
+            httpd.addUser(user["username"], user.get("password"), user.get("tokens"), rate_limit)
+        httpd.admission = AdmissionControl.createInstanceFromConfig(config.get("admission"))
+        httpd.max_body_bytes = config.get("max_body_bytes", 16777216)
         for endpoint in config["endpoints"]:
             path = endpoint["path"]
-            new_endpoint = RestEndpoint(path)
+            new_endpoint = RestEndpoint(path, httpd.format_adapters)
             if "get" in endpoint:
                 get = endpoint["get"]
                 new_endpoint.setGet(RestVerb.createInstanceFromConfig(get))
@@ -454,14 +4374,19 @@ class RestHttpServer():
                 delete = endpoint["delete"]
                 new_endpoint.setDelete(RestVerb.createInstanceFromConfig(delete))
             httpd.addEndpoint(new_endpoint)
-        for task in config["tasks"]:
-            execfile(os.path.join(default_tasks_dir, task["file"]))
-            pass
+        httpd.connectRollups()
+        httpd.connectPublishers()
+        httpd.compileRoutes()
+        httpd.describeEndpoints(SchemaCache.createInstanceFromConfig(config))
+        if run_tasks:
+            httpd.scheduler = TaskScheduler.createInstanceFromConfig(httpd, config)
+            httpd.scheduler.start()
         return httpd
 
-app = Flask(__name__)
+api = Blueprint("ird", __name__)
 
-server = RestHttpServer.createFromConfig()
+def currentServer():
+    return current_app.extensions["ird"]
 
 def respondInvalidCredentials():
     return Response(
@@ -475,88 +4400,512 @@ def respondInvalidPermissions():
                     'You have to login with proper credentials', 401,
                     {'WWW-Authenticate': 'Basic realm="Login Required"'})
 
-def check_auth(username, password):
-    return server.authenticate(username, password)
+def respondServiceUnavailable():
+    return Response(
+                    'The database is busy or unavailable.\n'
+                    'Please retry your request', 503,
+                    {'Retry-After': '1'})
+
+def respondTooManyRequests(error):
+    return Response(
+                    'Too many requests: {}\n'.format(error) +
+                    'Please retry your request', 429,
+                    {'Retry-After': str(max(1, int(math.ceil(error.retry_after))))})
+
+@api.app_errorhandler(ConnectionPoolTimeout)
+def connectionPoolTimeout(error):
+    return respondServiceUnavailable()
+
+@api.app_errorhandler(MissingParameter)
+def missingParameter(error):
+    logger.warning("Request is missing parameter: {}".format(error))
+    return Response('Missing parameter: {}\n'.format(error), 400)
+
+@api.app_errorhandler(InvalidParameter)
+def invalidParameter(error):
+    logger.warning("Request has an invalid parameter: {}".format(error))
+    return Response('Invalid parameter: {}\n'.format(error), 400)
+
+@api.app_errorhandler(IngestQueueFull)
+def ingestQueueFull(error):
+    logger.warning("Ingest queue is full: {}".format(error))
+    return Response(
+                    'Too many pending writes.\n'
+                    'Please retry your request', 503,
+                    {'Retry-After': '1'})
+
+@api.app_errorhandler(TooManySubscribers)
+def tooManySubscribers(error):
+    logger.warning("Too many event subscribers: {}".format(error))
+    return Response(
+                    'Too many event subscribers.\n'
+                    'Please retry your request', 503,
+                    {'Retry-After': '5'})
+
+@api.app_errorhandler(TooManyRequests)
+def tooManyRequests(error):
+    logger.warning("Too many requests: {}".format(error))
+    return respondTooManyRequests(error)
+
+@api.app_errorhandler(InvalidUpload)
+def invalidUpload(error):
+    logger.warning("Invalid upload: {}".format(error))
+    return Response('Invalid upload: {}\n'.format(error), 400)
+
+@api.app_errorhandler(UploadTooLarge)
+def uploadTooLarge(error):
+    logger.warning("Upload too large: {}".format(error))
+    return Response('Upload too large: {}\n'.format(error), 413)
+
+@api.app_errorhandler(mysql.connector.Error)
+def databaseUnavailable(error):
+    logger.error("Unable to connect to database: {}".format(error))
+    return respondServiceUnavailable()
+
+def getConnection(verb=None, shard=None):
+    # One pooled connection per database per request, returned to its pool by releaseConnection when the request
+    # tears down.
+    if "connections" not in g:
+        g.connections = {}
+    key = (shard, verb is not None and verb.reads)
+    if key not in g.connections:
+        g.connections[key] = currentServer().getConnection(verb, shard)
+    return g.connections[key]
+
+@api.teardown_app_request
+def releaseConnection(exception=None):
+    connections = g.pop("connections", {})
+    for connection in connections.values():
+        currentServer().releaseConnection(connection)
+
+def releaseAfterStreaming(response):
+    # A streamed body is still reading from the connection after the request tears down, so hand the connections
+    # back only once the response has been sent or the client has gone away.
+    if response.is_streamed and "connections" in g:
+        connections = g.pop("connections")
+        server = currentServer()
+        response.call_on_close(lambda: [server.releaseConnection(connection) for connection in connections.values()])
+    return response
+
+def parseRequestBody():
+    # Like request.get_json(), a body in a format the server doesn't speak is ignored rather than rejected.
+    server = currentServer()
+    adapter = server.format_adapters.forContentType(request.mimetype)
+    if adapter is None:
+        return None
+    if request.content_length is not None and request.content_length > server.max_body_bytes:
+        logger.warning("Request body of {} bytes is too large".format(request.content_length))
+        abort(413)
+    if isinstance(adapter, JsonAdapter):
+        return request.get_json()
+    try:
+        return adapter.parse(request.get_data())
+    except Exception as err:
+        logger.warning("Unable to parse " + request.mimetype + " request body: {}".format(err))
+        abort(400)
+
+@api.after_app_request
+def compressResponse(response):
+    server = currentServer()
+    if server.compressor is None:
+        return response
+    return server.compressor.compress(response, request.headers.get("Accept-Encoding"))
+
+@api.before_app_request
+def sampleDebugLogging():
+    server = currentServer()
+    if server.debug_sampler is not None:
+        server.debug_sampler.sample()
+
+@api.before_app_request
+def startTimer():
+    if currentServer().request_metrics is not None:
+        g.timer = PhaseTimer()
+        setCurrentTimer(g.timer)
+
+@api.after_app_request
+def observeRequest(response):
+    # Observed once the body has been sent, so streamed responses are timed to their last chunk.
+    timer = g.get("timer")
+    if timer is None or request.endpoint != "ird.dispatch":
+        return response
+    metrics = currentServer().getVerbMetrics(request.view_args["endpoint"], "GET" if request.method == "HEAD" else request.method)
+    if metrics is not None:
+        status_code = response.status_code
+        response.call_on_close(lambda: metrics.observe(status_code, timer))
+    return response
+
+def check_auth(authorization):
+    return currentServer().authenticate(authorization)
 
 def requires_auth(f):
     @wraps(f)
     def decorated(*args, ** kwargs):
-        auth = request.authorization
-        if not auth or not check_auth(auth.username, auth.password):
+        began = clock()
+        user = check_auth(request.headers.get("Authorization"))
+        currentTimer().add("auth", clock() - began)
+        if not user:
             return respondInvalidCredentials()
+        g.user = user
+        g.username = user.getUsername()
+        admit(user, kwargs.get("endpoint"))
         return f(*args, ** kwargs)
     return decorated
 
-@app.route('/<endpoint>', methods=['POST'])
+def admit(user, endpoint):
+    # Before any database work, so a request that is turned away costs no more than checking its credentials.
+    server = currentServer()
+    if request.endpoint != "ird.dispatch":
+        server.admit(user)
+        return
+    methods = server.getRoutes(endpoint)
+    server.admit(user, methods.get("GET" if request.method == "HEAD" else request.method) if methods else None)
+    if server.admission is not None:
+        server.admission.enter()
+        g.admitted = True
+
+@api.teardown_app_request
+def leaveAdmission(exception=None):
+    # Streamed responses tear down once their last chunk is sent, so they hold their turn until then.
+    if g.pop("admitted", False):
+        currentServer().admission.leave()
+
+def respondMethodNotAllowed(methods):
+    return Response(
+                    'The method is not allowed for the requested URL.\n', 405,
+                    {'Allow': ', '.join(sorted(methods.keys()))})
+
+@api.route('/<endpoint>', methods=['GET', 'POST', 'PUT', 'DELETE'])
 @requires_auth
-def post(endpoint):
-    logger.debug("Received a POST request.")
-    endpoint = server.getEndpoint(endpoint)
-    auth = request.authorization
-    if endpoint and not endpoint.isValidUserPost(auth.username):
-        return respondInvalidPermissions()
-    connection = server.getConnection()
-    if (endpoint):
-        return endpoint.executePost(connection, request.args, request.get_json(), request.headers)
-    else:
+def dispatch(endpoint):
+    method = request.method if request.method != "HEAD" else "GET"
+    logger.debug("Received a %s request for: %s", method, endpoint)
+    server = currentServer()
+    methods = server.getRoutes(endpoint)
+    if methods is None:
         abort(404)
+    record = methods.get(method)
+    if record is None:
+        return respondMethodNotAllowed(methods)
+    if not record.permits(g.user):
+        return respondInvalidPermissions()
+    if not record.writes:
+        return releaseAfterStreaming(record.execute(getConnection, request.args, parseRequestBody(), request.headers))
+    if record.loads and request.mimetype in BulkLoad.FORMATS:
+        return server.finishWrite(record.path, server.getEndpoint(record.path).executeLoad(getConnection, request.stream, request.mimetype, request.headers))
+    return server.finishWrite(record.path, record.execute(getConnection, request.args, parseRequestBody(), request.headers))
 
-@app.route('/<endpoint>', methods=['GET'])
+@api.route('/<endpoint>/events')
 @requires_auth
-def get(endpoint):
-    logger.debug("Received a GET request with args: " + str(request.args))
-    endpoint = server.getEndpoint(endpoint)
-    auth = request.authorization
-    if endpoint and not endpoint.isValidUserGet(auth.username):
-        return respondInvalidPermissions()
-    connection = server.getConnection()
-    if (endpoint):
-        return endpoint.executeGet(connection, request.args.to_dict(flat=True), request.get_json(), request.headers)
-    else:
+def subscribe(endpoint):
+    server = currentServer()
+    methods = server.getRoutes(endpoint)
+    if methods is None or "GET" not in methods or not server.broadcaster.publishes(endpoint):
         abort(404)
+    if not methods["GET"].permits(g.user):
+        return respondInvalidPermissions()
+    broadcaster = server.broadcaster
+    subscription = broadcaster.subscribe(endpoint)
 
-format_adapter = JsonAdapter()
+    def generate():
+        try:
+            yield b"retry: 1000\n\n"
+            while not subscription.closed:
+                events = subscription.wait(broadcaster.keep_alive, broadcaster.encode)
+                if events:
+                    yield b"".join([event.sse for event in events])
+                elif not subscription.closed:
+                    # A comment line keeps proxies from timing out an idle stream and finds clients that have gone.
+                    yield b": keep-alive\n\n"
+        finally:
+            broadcaster.unsubscribe(subscription)
 
+    # Each subscriber holds a worker thread; the ASGI server sends events without one.
+    return Response(generate(), mimetype=EVENT_STREAM, headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
-@app.route('/<endpoint>', methods=['PUT'])
-@requires_auth
-def put(endpoint):
-    logger.debug("Received a PUT request.")
-    endpoint = server.getEndpoint(endpoint)
-    auth = request.authorization
-    if endpoint and not endpoint.isValidUserPut(auth.username):
-        return respondInvalidPermissions()
-    connection = server.getConnection()
-    if (endpoint):
-        return endpoint.executePut(connection, request.args,  request.get_json(), request.headers)
-    else:
-        abort(404)
+@api.route('/templates/<string:page_name>')
+def static_page(page_name):
+    return render_template(page_name)
 
-@app.route('/<endpoint>', methods=['DELETE'])
+@api.route('/help')
+@api.route('/openapi.json')
 @requires_auth
-def delete(endpoint):
-    logger.debug("Received a DELETE request.")
-    endpoint = server.getEndpoint(endpoint)
-    auth = request.authorization
-    if endpoint and not endpoint.isValidUserDelete(auth.username):
-        return respondInvalidPermissions()
-    connection = server.getConnection()
-    if (endpoint):
-        return endpoint.executeDelete(connection, request.args, request.get_json(), request.headers)
-    else:
+def apiDocument():
+    server = currentServer()
+    document = server.getDocument(request.path.strip("/"))
+    if document is None:
         abort(404)
+    return document.createResponse(request.headers.get("If-None-Match"))
 
-@app.route('/templates/<string:page_name>')
-def static_page(page_name):
-    return render_template(page_name)
+@api.route('/metrics')
+def metrics():
+    server = currentServer()
+    if server.request_metrics is None:
+        abort(404)
+    return Response(server.renderMetrics(), content_type=MetricsText.CONTENT_TYPE)
 
-@app.route('/heartbeat')
+@api.route('/heartbeat')
 def heartbeat():
-    return jsonify({"version": server.version})
+    server = currentServer()
+    return jsonify({"version": server.version, "pool": server.getPoolMetrics(), "databases": server.getDatabaseMetrics(), "ingest": server.getIngestMetrics(), "spools": server.getSpoolMetrics(), "rollups": server.getRollupMetrics(), "push": server.getPushMetrics(), "tasks": server.getTaskMetrics(), "cache": server.getCacheMetrics(), "flights": server.getSingleFlightMetrics(), "admission": server.getAdmissionMetrics(), "auth": server.getAuthMetrics()})
 
 #logging.basicConfig(format='%(levelname)s:%(message)s', level=logging.DEBUG)
-#server.addEndpoint(HelpRestEndpoint(args.www[0], "/", httpd.createEndpointDivs()))
-atexit.register(server.shutdown)
+
+def readConfig(path):
+    logger.info("Reading config file: " + path)
+    f = open(path, "r")
+    config_str = f.read()
+    f.close()
+    return json.loads(config_str)
+
+def create_app(config="config.json", loglevel=None, run_tasks=True):
+    """Builds the Flask app for a config file path or an already parsed config.  Database connections are opened
+    here, so a preforking server should call this in each worker after the fork, with run_tasks set in only one of
+    them.  Whatever serves the app calls app.extensions["ird"].shutdown() once it has stopped, to flush queued
+    writes and close the connections."""
+    if not isinstance(config, dict):
+        config = readConfig(config)
+    debug_sampler = configureLogging(config.get("logging", {}), loglevel)
+    server = RestHttpServer.createFromConfig(config, run_tasks)
+    server.debug_sampler = debug_sampler
+    app = Flask(__name__)
+    app.extensions["ird"] = server
+    app.register_blueprint(api)
+    return app
+
+class RequestTracker(object):
+    """WSGI middleware that counts requests in flight, including streamed responses until their body is closed, so a
+    worker can finish them before it exits."""
+    def __init__(self, app):
+        self._app = app
+        self._active = 0
+        self._condition = threading.Condition()
+
+    def __call__(self, environ, start_response):
+        with self._condition:
+            self._active += 1
+        try:
+            return ClosingIterator(self._app(environ, start_response), [self.finish])
+        except Exception:
+            self.finish()
+            raise
+
+    def finish(self):
+        with self._condition:
+            self._active -= 1
+            self._condition.notify_all()
+
+    def wait(self, timeout):
+        deadline = time.time() + timeout
+        with self._condition:
+            while self._active > 0 and time.time() < deadline:
+                self._condition.wait(deadline - time.time())
+            return self._active
+
+class PreforkServer(object):
+    """Serves the app from a number of forked worker processes that share one listening socket.  The config is read
+    and the database connected in each worker, never in the master.
+
+    SIGHUP starts a new generation of workers with a freshly read config, and stops the old generation once the new
+    one is accepting connections.  SIGTERM and SIGINT stop every worker and then the master.  A stopping worker stops
+    accepting connections, finishes the requests it has in flight, flushes its buffered writers and exits.
+
+    Scheduled tasks run in one worker of each generation, and in its replacement if it dies."""
+    READY_TIMEOUT = 60.0
+
+    def __init__(self, config_path, loglevel, host, port, workers, drain_timeout=30.0):
+        self._config_path = config_path
+        self._loglevel = loglevel
+        self._host = host
+        self._port = port
+        self._worker_count = workers
+        self._drain_timeout = drain_timeout
+        self._workers = {}
+        self._task_worker = None
+        self._generation = 0
+        self._reload = False
+        self._stopping = False
+        self._socket = None
+
+    @staticmethod
+    def countWorkers(workers):
+        if workers == "auto":
+            return multiprocessing.cpu_count()
+        return max(1, int(workers))
+
+    def run(self):
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind((self._host, self._port))
+        self._socket.listen(1024)
+        logger.info("Listening on http://{}:{}/ with {} workers".format(self._host, self._port, self._worker_count))
+        signal.signal(signal.SIGHUP, self.requestReload)
+        signal.signal(signal.SIGTERM, self.requestStop)
+        signal.signal(signal.SIGINT, self.requestStop)
+        if not self.spawnGeneration():
+            logger.error("Workers failed to start.")
+            self.stopWorkers(list(self._workers.keys()))
+            return 1
+        while not self._stopping:
+            if self._reload:
+                self._reload = False
+                self.reload()
+            self.reapWorkers()
+            time.sleep(0.5)
+        logger.info("Stopping workers...")
+        self.stopWorkers(list(self._workers.keys()))
+        self._socket.close()
+        return 0
+
+    def requestReload(self, signum, frame):
+        self._reload = True
+
+    def requestStop(self, signum, frame):
+        self._stopping = True
+
+    def reload(self):
+        try:
+            readConfig(self._config_path)
+        except (IOError, ValueError) as err:
+            logger.error("Not reloading, the config file is unreadable: {}".format(err))
+            return
+        old_workers = [pid for pid, generation in self._workers.items() if generation == self._generation]
+        old_task_worker = self._task_worker
+        if self.spawnGeneration():
+            logger.info("Reloaded config, stopping {} old workers".format(len(old_workers)))
+            self.stopWorkers(old_workers)
+        else:
+            logger.error("New workers failed to start, keeping the old ones.")
+            self.stopWorkers([pid for pid, generation in self._workers.items() if generation == self._generation])
+            self._generation -= 1
+            self._task_worker = old_task_worker
+
+    def spawnGeneration(self):
+        """Forks a full set of workers and waits until each has built its app.  Returns False if any did not."""
+        self._generation += 1
+        read_fd, write_fd = os.pipe()
+        for index in range(self._worker_count):
+            self.spawnWorker(write_fd, index == 0)
+        os.close(write_fd)
+        return self.waitForReady(read_fd, self._worker_count)
+
+    def waitForReady(self, read_fd, count):
+        """Waits for count workers to report on read_fd that they are serving, and closes it.  Returns False if a worker
+        exited or READY_TIMEOUT passed first."""
+        ready = 0
+        deadline = time.time() + self.READY_TIMEOUT
+        try:
+            while ready < count and time.time() < deadline:
+                readable, _, _ = select.select([read_fd], [], [], max(0.0, deadline - time.time()))
+                if not readable:
+                    break
+                data = os.read(read_fd, 64)
+                if not data:
+                    break
+                ready += len(data)
+        except select.error:
+            pass
+        finally:
+            os.close(read_fd)
+        return ready >= count
+
+    def spawnWorker(self, ready_fd, run_tasks=False):
+        pid = os.fork()
+        if pid:
+            self._workers[pid] = self._generation
+            if run_tasks:
+                self._task_worker = pid
+            return pid
+        status = 1
+        try:
+            status = self.runWorker(ready_fd, run_tasks)
+        except Exception:
+            logger.exception("Worker failed")
+        finally:
+            logging.shutdown()
+            os._exit(status)
+
+    def runWorker(self, ready_fd, run_tasks=False):
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        app = create_app(self._config_path, self._loglevel, run_tasks)
+        tracker = RequestTracker(app)
+        httpd = make_server(self._host, self._port, tracker, threaded=True, fd=self._socket.fileno())
+        signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=httpd.shutdown).start())
+        os.write(ready_fd, b".")
+        os.close(ready_fd)
+        httpd.serve_forever()
+        # Event streams only end when their subscription does, so end them before waiting on the other requests.
+        app.extensions["ird"].broadcaster.close()
+        unfinished = tracker.wait(self._drain_timeout)
+        if unfinished:
+            logger.warning("Worker {} stopped with {} requests in flight".format(os.getpid(), unfinished))
+        app.extensions["ird"].shutdown()
+        return 0
+
+    def reapWorkers(self):
+        while self._workers:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError:
+                return
+            if pid == 0:
+                return
+            generation = self._workers.pop(pid, None)
+            if generation == self._generation and not self._stopping:
+                logger.warning("Worker {} exited with status {}, starting a new one".format(pid, status))
+                run_tasks = pid == self._task_worker
+                read_fd, write_fd = os.pipe()
+                replacement = self.spawnWorker(write_fd, run_tasks)
+                os.close(write_fd)
+                if not self.waitForReady(read_fd, 1):
+                    # Not retried, so a worker that can't start doesn't fork in a loop; a reload tries again.
+                    logger.error("Worker {} failed to start, running with one worker less until the next reload".format(replacement))
+                    self.stopWorkers([replacement])
+                    if run_tasks:
+                        self._task_worker = None
+
+    def stopWorkers(self, pids):
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+        deadline = time.time() + self._drain_timeout + 5.0
+        remaining = set(pids)
+        while remaining and time.time() < deadline:
+            for pid in list(remaining):
+                try:
+                    done, _ = os.waitpid(pid, os.WNOHANG)
+                except OSError:
+                    done = pid
+                if done:
+                    remaining.discard(pid)
+                    self._workers.pop(pid, None)
+            time.sleep(0.1)
+        for pid in remaining:
+            logger.warning("Killing worker {} that did not stop in time".format(pid))
+            try:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+            except OSError:
+                pass
+            self._workers.pop(pid, None)
+
+def main(argv=None):
+    args = parseArguments(argv)
+    if args.workers is None:
+        app = create_app(args.config, args.loglevel)
+        try:
+            app.run(host=args.host, port=args.port, threaded=True)
+        finally:
+            app.extensions["ird"].shutdown()
+        return 0
+    # Threads don't survive a fork, so the master logs synchronously and each worker starts its own log writer.
+    configureLogging({"async": False}, args.loglevel)
+    return PreforkServer(args.config, args.loglevel, args.host, args.port,
+                         PreforkServer.countWorkers(args.workers), args.drain_timeout).run()
 
 if __name__ == "__main__":
-    app.run()
+    sys.exit(main())
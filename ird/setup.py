@@ -21,4 +21,11 @@ setup(name='iot-rest-datastore',
       description="IOT Rest Datastore",
       author="Michael Boldischar",
       license="MIT",
-      packages=["flask", "mysql", "schedule", "mysql-connector", "requests"])
\ No newline at end of file
+      packages=["flask", "mysql", "schedule", "mysql-connector", "requests"],
+      extras_require={
+          "asgi": ["aiomysql", "pymysql", "uvicorn"],
+          "msgpack": ["msgpack"],
+          "cbor": ["cbor2"],
+          "orjson": ["orjson"],
+          "numpy": ["numpy"]
+      })
\ No newline at end of file
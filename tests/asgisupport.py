@@ -0,0 +1,253 @@
+########################################################################################################################
+#
+#  Lemma Logic LLC
+#  __________________
+#
+# Copyright 2018 Lemma Logic LLC
+# All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+########################################################################################################################
+"""Runs the ASGI app of asgi.py in the test process.  aiomysql.create_pool is pointed at the SQLite stand-in that
+support.py installs for mysql.connector, and requests are sent by calling the app with ASGI scopes on an event loop
+owned by the test.  Requires Python 3."""
+import aiomysql, asyncio, json, mysql.connector, pymysql
+from urllib.parse import urlsplit
+from werkzeug.datastructures import Headers
+from support import ADMIN, StandInTestCase
+import asgi, standin
+
+class StandInAsyncCursor(object):
+    """A stand-in cursor answering the aiomysql calls that asgi.py makes, with the errors pymysql would raise."""
+    def __init__(self, connection):
+        self._cursor = connection._connection.cursor()
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    def _call(self, method, *args):
+        try:
+            return method(*args)
+        except mysql.connector.Error as err:
+            raise pymysql.err.OperationalError(2013, str(err))
+
+    async def execute(self, query, parameters=None):
+        self._call(self._cursor.execute, query, parameters)
+
+    async def executemany(self, query, seq_parameters):
+        self._call(self._cursor.executemany, query, seq_parameters)
+
+    async def fetchall(self):
+        return self._call(self._cursor.fetchall)
+
+    async def fetchmany(self, size=1):
+        return self._call(self._cursor.fetchmany, size)
+
+    async def nextset(self):
+        return None
+
+    async def close(self):
+        self._cursor.close()
+
+    def __await__(self):
+        # connection.cursor() is awaited for unbuffered cursors and entered with async with otherwise.
+        if False:
+            yield
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+class StandInAsyncConnection(object):
+    def __init__(self, path):
+        self._connection = standin.StandInConnection(path, autocommit=True)
+        self.closed = False
+
+    def cursor(self, cursor_class=None):
+        return StandInAsyncCursor(self)
+
+    async def begin(self):
+        self._connection.start_transaction()
+
+    async def commit(self):
+        self._connection.commit()
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self._connection.rollback()
+            self._connection.close()
+
+class StandInAsyncPool(object):
+    """Opens connections up to maxsize and keeps released ones for reuse unless they were closed or are still in a
+    transaction, like aiomysql's pool."""
+    def __init__(self, path, maxsize):
+        self._path = path
+        self._available = asyncio.Semaphore(maxsize)
+        self._free = []
+        self.size = 0
+        self.opened = 0
+
+    @property
+    def freesize(self):
+        return len(self._free)
+
+    async def acquire(self):
+        await self._available.acquire()
+        if self._free:
+            return self._free.pop()
+        self.size += 1
+        self.opened += 1
+        return StandInAsyncConnection(self._path)
+
+    def release(self, connection):
+        if connection._connection.in_transaction:
+            connection.close()
+        if connection.closed:
+            self.size -= 1
+        else:
+            self._free.append(connection)
+        self._available.release()
+        released = asyncio.get_event_loop().create_future()
+        released.set_result(None)
+        return released
+
+    def close(self):
+        for connection in self._free:
+            connection.close()
+        self.size -= len(self._free)
+        self._free = []
+
+    async def wait_closed(self):
+        pass
+
+def installAsync(path):
+    """Routes every aiomysql.create_pool call to the SQLite database file at path."""
+    async def create_pool(maxsize=10, **kwargs):
+        return StandInAsyncPool(path, maxsize)
+    aiomysql.create_pool = create_pool
+
+class AsgiResponse(object):
+    def __init__(self, status_code, headers, data):
+        self.status_code = status_code
+        self.headers = headers
+        self.data = data
+
+    def get_data(self, as_text=False):
+        return self.data.decode("utf-8") if as_text else self.data
+
+class AsgiTestCase(StandInTestCase):
+    """StandInTestCase for the ASGI app: the app goes through the lifespan startup when it is built and the lifespan
+    shutdown when it is stopped, and requests are sent straight to the app."""
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self._create_pool = aiomysql.create_pool
+        StandInTestCase.setUp(self)
+
+    def tearDown(self):
+        StandInTestCase.tearDown(self)
+        aiomysql.create_pool = self._create_pool
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def startApp(self, config=None):
+        installAsync(self.database)
+        self.app = asgi.create_asgi_app(config or self.createConfig(), "ERROR")
+        self.server = self.app._server
+        self.lifespan_messages = asyncio.Queue()
+        self.lifespan_replies = asyncio.Queue()
+        self.lifespan = self.loop.create_task(self.app({"type": "lifespan"}, self.lifespan_messages.get, self.lifespan_replies.put))
+        self.assertEqual(self.sendLifespan("lifespan.startup"), "lifespan.startup.complete")
+
+    def stopApp(self):
+        if self.app is not None:
+            self.assertEqual(self.sendLifespan("lifespan.shutdown"), "lifespan.shutdown.complete")
+            self.loop.run_until_complete(self.lifespan)
+            self.app = None
+
+    def sendLifespan(self, message_type):
+        self.lifespan_messages.put_nowait({"type": message_type})
+        return self.loop.run_until_complete(self.lifespan_replies.get())["type"]
+
+    def createScope(self, scope_type, method, path, headers):
+        url = urlsplit(path)
+        return {"type": scope_type, "method": method, "path": url.path, "query_string": url.query.encode("latin-1"),
+                "headers": [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers.items()]}
+
+    async def call(self, method, path, authorization=ADMIN, body=None, headers=None, data=None, chunks=None):
+        """Sends one request to the app and returns its response once the app has sent the whole body.  A list of
+        chunks is sent as a body in several messages, and is left holding the chunks the app didn't read."""
+        headers = Headers(headers or {})
+        if authorization is not None:
+            headers["Authorization"] = authorization
+        if body is not None:
+            data = json.dumps(body)
+            headers.setdefault("Content-Type", "application/json")
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        scope = self.createScope("http", method, path, headers)
+        if chunks is None:
+            chunks = [data or b""]
+        disconnected = asyncio.Event()
+
+        async def receive():
+            if chunks:
+                return {"type": "http.request", "body": chunks.pop(0), "more_body": bool(chunks)}
+            await disconnected.wait()
+            return {"type": "http.disconnect"}
+
+        started = {}
+        sent = []
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                started.update(message)
+            else:
+                sent.append(message.get("body", b""))
+
+        await self.app(scope, receive, send)
+        disconnected.set()
+        response_headers = Headers([(name.decode("latin-1"), value.decode("latin-1")) for name, value in started["headers"]])
+        return AsgiResponse(started["status"], response_headers, b"".join(sent))
+
+    def request(self, method, path, authorization=ADMIN, body=None, headers=None, data=None, chunks=None):
+        return self.loop.run_until_complete(self.call(method, path, authorization, body, headers, data, chunks))
+
+    def gather(self, *calls):
+        """Sends requests at the same time, each given as the coroutine of a call, and returns their responses."""
+        return self.loop.run_until_complete(asyncio.gather(*calls))
+
+    def connect(self, path, authorization=ADMIN, websocket=False):
+        """Opens a long lived request, such as an event stream, as a task on the loop.  Returns the task, a queue of
+        the messages the app sends, and an Event that disconnects the client when set."""
+        headers = Headers({"Authorization": authorization} if authorization else {})
+        scope = self.createScope("websocket" if websocket else "http", "GET", path, headers)
+        messages = [{"type": "websocket.connect"} if websocket else {"type": "http.request", "body": b"", "more_body": False}]
+        disconnected = asyncio.Event()
+
+        async def receive():
+            if messages:
+                return messages.pop(0)
+            await disconnected.wait()
+            return {"type": "websocket.disconnect" if websocket else "http.disconnect"}
+
+        sent = asyncio.Queue()
+        return self.loop.create_task(self.app(scope, receive, sent.put)), sent, disconnected
+
+    def receive(self, sent, timeout=5.0):
+        """The next message an app sent on a connection opened with connect."""
+        return self.loop.run_until_complete(asyncio.wait_for(sent.get(), timeout))
@@ -0,0 +1,145 @@
+########################################################################################################################
+#
+#  Lemma Logic LLC
+#  __________________
+#
+# Copyright 2018 Lemma Logic LLC
+# All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+########################################################################################################################
+"""Runs the server in the test process against the SQLite stand-in of benchmark/standin.py, so the unit tests don't
+need a MySQL server.  Each test gets a new database and a new app built from its config."""
+import base64, copy, json, mysql.connector, os, shutil, sqlite3, sys, tempfile, time, unittest
+
+this_directory = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(this_directory), "ird"))
+sys.path.insert(0, os.path.join(os.path.dirname(this_directory), "benchmark"))
+
+import ird, standin
+
+def basicAuth(username, password):
+    credentials = base64.b64encode(("%s:%s" % (username, password)).encode("utf-8")).decode("ascii")
+    return "Basic " + credentials
+
+ADMIN = basicAuth("admin", "admin password")
+SENSOR = basicAuth("sensor-account", "sensor password")
+
+BASE_CONFIG = {
+    "database_ip_address": "127.0.0.1",
+    "database": "EXAMPLE",
+    "database_user": "example-user",
+    "database_password": "password",
+    "database_pool_size": 4,
+    "version": "1.1",
+    "logging": {"async": False},
+    "tasks": [],
+    "users": [
+        {"username": "admin", "password": "b025d883b5d875a10649fcdb6d89fd22aaf1589ae478988042722479"},
+        {"username": "sensor-account", "password": "5d3e1fb726bfbbf59fc276aeb73dc36d2dc916031525213fd64effad"}
+    ],
+    "endpoints": [
+        {
+            "path": "sensor-event",
+            "get": {"commit": True, "query": "SELECT * FROM SENSOR_EVENT ORDER BY ID;", "users": ["admin"]},
+            "put": {"commit": True, "query": "INSERT INTO SENSOR_EVENT (RAW_VALUE) VALUES (%(RAW_VALUE)s);", "users": ["sensor-account"]}
+        }
+    ]
+}
+
+def createConfig(endpoints=None, **settings):
+    """The base config with its endpoints replaced by endpoints, if given, and settings added at the top level."""
+    config = copy.deepcopy(BASE_CONFIG)
+    if endpoints is not None:
+        config["endpoints"] = endpoints
+    config.update(settings)
+    return config
+
+class StandInTestCase(unittest.TestCase):
+    """Builds the app for createConfig() over an empty SENSOR_EVENT table before each test, and shuts it down after.
+    Tests that need more tables or settings override createSchema and createConfig."""
+    ADMIN = ADMIN
+    SENSOR = SENSOR
+
+    def createConfig(self):
+        return createConfig()
+
+    def createSchema(self):
+        pass
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.database = os.path.join(self.directory, "standin.db")
+        self._connect = mysql.connector.connect
+        standin.install(self.database)
+        self.createSchema()
+        self.app = None
+        self.startApp()
+
+    def tearDown(self):
+        self.stopApp()
+        mysql.connector.connect = self._connect
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def startApp(self, config=None):
+        self.app = ird.create_app(config or self.createConfig(), "ERROR")
+        self.server = self.app.extensions["ird"]
+        self.client = self.app.test_client()
+
+    def stopApp(self):
+        if self.app is not None:
+            self.server.shutdown()
+            self.app = None
+
+    def execute(self, sql, parameters=()):
+        """Runs sql on the stand-in database outside of the server, and returns the rows it selects."""
+        connection = sqlite3.connect(self.database, timeout=30)
+        try:
+            rows = connection.execute(sql, parameters).fetchall()
+            connection.commit()
+            return rows
+        finally:
+            connection.close()
+
+    def countRows(self, table="SENSOR_EVENT"):
+        return self.execute("SELECT COUNT(*) FROM " + table)[0][0]
+
+    def waitFor(self, condition, timeout=5.0):
+        """Polls condition until it returns a true value, for writes made by background threads."""
+        deadline = time.time() + timeout
+        while not condition():
+            if time.time() > deadline:
+                self.fail("Timed out waiting for a background write")
+            time.sleep(0.01)
+
+    def request(self, method, path, authorization=ADMIN, body=None, headers=None, data=None):
+        headers = dict(headers or {})
+        if authorization is not None:
+            headers["Authorization"] = authorization
+        if body is not None:
+            data = json.dumps(body)
+            headers.setdefault("Content-Type", "application/json")
+        response = self.client.open(path, method=method, data=data, headers=headers)
+        response.get_data()
+        response.close()
+        return response
+
+    def get(self, path, authorization=ADMIN, headers=None):
+        return self.request("GET", path, authorization, headers=headers)
+
+    def put(self, path, body, authorization=SENSOR, headers=None):
+        return self.request("PUT", path, authorization, body, headers)
+
+    def post(self, path, body, authorization=SENSOR, headers=None):
+        return self.request("POST", path, authorization, body, headers)
+
+    def getJson(self, response):
+        return json.loads(response.get_data().decode("utf-8"))
+
+    def heartbeat(self):
+        return self.getJson(self.get("/heartbeat", None))
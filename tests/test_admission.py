@@ -0,0 +1,134 @@
+########################################################################################################################
+#
+#  Lemma Logic LLC
+#  __________________
+#
+# Copyright 2018 Lemma Logic LLC
+# All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+########################################################################################################################
+import threading, unittest
+from support import ird, StandInTestCase, createConfig
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+class TestTokenBucket(unittest.TestCase):
+
+    def setUp(self):
+        self._clock = ird.clock
+        ird.clock = self.clock = FakeClock()
+
+    def tearDown(self):
+        ird.clock = self._clock
+
+    def testBurstThenRate(self):
+        bucket = ird.TokenBucket(2, 3)
+        self.assertEqual([bucket.take() for _ in range(3)], [0.0, 0.0, 0.0])
+        self.assertAlmostEqual(bucket.take(), 0.5)
+        self.clock.now += 0.25
+        self.assertAlmostEqual(bucket.take(), 0.25)
+        self.clock.now += 0.25
+        self.assertEqual(bucket.take(), 0.0)
+        self.assertEqual(bucket.getLimited(), 2)
+
+    def testTokensAreCappedAtTheBurst(self):
+        bucket = ird.TokenBucket(1)
+        self.clock.now += 60
+        self.assertEqual(bucket.take(), 0.0)
+        self.assertAlmostEqual(bucket.take(), 1.0)
+
+class TestAdmissionControl(unittest.TestCase):
+
+    def testQueuedRequestGetsTheNextTurn(self):
+        admission = ird.AdmissionControl(max_concurrent=1, max_queued=1, queue_timeout=5)
+        admission.enter()
+        waiter = threading.Thread(target=admission.enter)
+        waiter.start()
+        while admission.getMetrics()["waiting"] == 0:
+            threading.Event().wait(0.01)
+        with self.assertRaises(ird.TooManyRequests):
+            admission.enter()
+        admission.leave()
+        waiter.join(5)
+        metrics = admission.getMetrics()
+        self.assertEqual((metrics["active"], metrics["waiting"], metrics["admitted"], metrics["queued"], metrics["rejected"]), (1, 0, 2, 1, 1))
+
+    def testQueuedRequestTimesOut(self):
+        admission = ird.AdmissionControl(max_concurrent=1, max_queued=1, queue_timeout=0.01)
+        admission.enter()
+        with self.assertRaises(ird.TooManyRequests):
+            admission.enter()
+        self.assertEqual(admission.getMetrics()["timeouts"], 1)
+
+class TestRateLimits(StandInTestCase):
+
+    def createConfig(self):
+        config = createConfig(admission={"maxConcurrent": 1, "maxQueued": 0})
+        config["users"][1]["rateLimit"] = {"rate": 0.01, "burst": 2}
+        config["endpoints"][0]["get"]["rateLimit"] = {"rate": 0.5, "burst": 1}
+        config["endpoints"].append({"path": "all-event", "get": {"query": "SELECT * FROM SENSOR_EVENT;", "users": ["admin"]}})
+        return config
+
+    def testUserOverItsLimitResponds429(self):
+        for value in [0.5, 1.5]:
+            self.assertEqual(self.put("/sensor-event", {"RAW_VALUE": value}).status_code, 200)
+        response = self.put("/sensor-event", {"RAW_VALUE": 2.5})
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers["Retry-After"], "100")
+        self.assertEqual(self.countRows(), 2)
+        self.assertEqual(self.get("/all-event").status_code, 200)
+        self.assertEqual(self.heartbeat()["admission"]["users"], 1)
+        metrics = self.get("/metrics", None).get_data().decode("utf-8")
+        self.assertIn('ird_rate_limited_total{limit="user"} 1', metrics)
+        self.assertNotIn("sensor-account", metrics)
+
+    def testVerbOverItsLimitResponds429(self):
+        self.assertEqual(self.get("/sensor-event").status_code, 200)
+        response = self.get("/sensor-event")
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers["Retry-After"], "2")
+        self.assertEqual(self.get("/all-event").status_code, 200)
+        self.assertEqual(self.heartbeat()["admission"]["verbs"], {"GET sensor-event": 1})
+
+    def testBusyServerResponds429(self):
+        release = threading.Event()
+        started = threading.Event()
+        executePlan = ird.MySqlConnection.executePlan
+
+        def slowExecutePlan(connection, *args, **kwargs):
+            started.set()
+            release.wait(5)
+            return executePlan(connection, *args, **kwargs)
+
+        ird.MySqlConnection.executePlan = slowExecutePlan
+        try:
+            client = self.app.test_client()
+            running = threading.Thread(target=lambda: client.get("/all-event", headers={"Authorization": self.ADMIN}))
+            running.start()
+            started.wait(5)
+            response = self.get("/all-event")
+            self.assertEqual(response.status_code, 429)
+            self.assertIn("Retry-After", response.headers)
+            # The heartbeat is never limited.
+            self.assertEqual(self.heartbeat()["admission"]["concurrency"]["active"], 1)
+        finally:
+            release.set()
+            ird.MySqlConnection.executePlan = executePlan
+        running.join(5)
+        self.assertEqual(self.get("/all-event").status_code, 200)
+        concurrency = self.heartbeat()["admission"]["concurrency"]
+        self.assertEqual((concurrency["active"], concurrency["admitted"], concurrency["rejected"]), (0, 2, 1))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,256 @@
+########################################################################################################################
+#
+#  Lemma Logic LLC
+#  __________________
+#
+# Copyright 2018 Lemma Logic LLC
+# All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+########################################################################################################################
+import json, mysql.connector, sys, unittest
+
+if sys.version_info < (3, 5):
+    raise unittest.SkipTest("the ASGI app requires Python 3.5 or later")
+try:
+    import aiomysql
+except ImportError:
+    raise unittest.SkipTest("the ASGI app requires aiomysql")
+
+import asyncio
+from asgisupport import asgi, AsgiTestCase
+from support import ird, createConfig
+
+STREAMED_ENDPOINT = {
+    "path": "sensor-event-stream",
+    "get": {"commit": True, "query": "SELECT ID, RAW_VALUE FROM SENSOR_EVENT ORDER BY ID;", "users": ["admin"],
+            "stream": {"format": "ndjson", "fetchSize": 2}}
+}
+
+BUFFERED_ENDPOINT = {
+    "path": "buffered-event",
+    "put": {"commit": True, "query": "INSERT INTO SENSOR_EVENT (RAW_VALUE) VALUES (%(RAW_VALUE)s);", "users": ["sensor-account"],
+            "buffered": {"queueSize": 100, "batchSize": 10, "flushInterval": 60, "ack": "enqueue"}}
+}
+
+class TestAsgiServer(AsgiTestCase):
+
+    def createConfig(self):
+        config = createConfig(database_async_pool_size=2, database_pool_timeout=0.2)
+        config["endpoints"].extend([STREAMED_ENDPOINT, BUFFERED_ENDPOINT])
+        return config
+
+    def getPool(self):
+        return self.app.getClusters()[0].primary
+
+    def testPutThenGet(self):
+        self.assertEqual(self.put("/sensor-event", {"RAW_VALUE": 0.5}).status_code, 200)
+        self.assertEqual(self.put("/sensor-event?RAW_VALUE=0.75", None).status_code, 200)
+        response = self.get("/sensor-event")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row["RAW_VALUE"] for row in self.getJson(response)["data"]], [0.5, 0.75])
+        self.assertEqual(self.heartbeat()["pool"]["in_use"], 0)
+
+    def testParametersAreReadFromHeaders(self):
+        self.assertEqual(self.put("/sensor-event", None, headers={"Raw-Value": "0.25"}).status_code, 200)
+        self.assertEqual(self.execute("SELECT RAW_VALUE FROM SENSOR_EVENT"), [(0.25,)])
+
+    def testRejectedRequests(self):
+        self.assertEqual(self.get("/sensor-event", None).status_code, 401)
+        self.assertEqual(self.get("/sensor-event", self.SENSOR).status_code, 401)
+        self.assertEqual(self.get("/no-such-endpoint").status_code, 404)
+        self.assertEqual(self.request("DELETE", "/sensor-event").status_code, 405)
+        self.assertEqual(self.put("/sensor-event", {}).status_code, 400)
+
+    def testRequestsWaitForAFreeConnection(self):
+        responses = self.gather(*[self.call("PUT", "/sensor-event", self.SENSOR, {"RAW_VALUE": value}) for value in range(10)])
+        self.assertEqual([response.status_code for response in responses], [200] * 10)
+        self.assertEqual(self.countRows(), 10)
+        pool = self.getPool()._pool
+        self.assertLessEqual(pool.opened, 2)
+        self.assertEqual(self.heartbeat()["pool"]["checkouts"], 10)
+
+    def testExhaustedPoolResponds503(self):
+        pool = self.getPool()
+        connections = self.gather(pool.checkout(), pool.checkout())
+        try:
+            self.assertEqual(self.get("/sensor-event").status_code, 503)
+        finally:
+            for connection in connections:
+                pool.release(connection)
+        self.assertEqual(self.get("/sensor-event").status_code, 200)
+        self.assertEqual(self.heartbeat()["pool"]["timeouts"], 1)
+
+    def testFailedQueryClosesItsConnection(self):
+        self.execute("DROP TABLE SENSOR_EVENT")
+        self.assertEqual(self.get("/sensor-event").status_code, 500)
+        pool = self.getPool()._pool
+        self.assertEqual(pool.size, 0)
+
+    def testStreamedGet(self):
+        for value in range(5):
+            self.execute("INSERT INTO SENSOR_EVENT (RAW_VALUE) VALUES (?)", (value / 10.0,))
+        response = self.get("/sensor-event-stream")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["Content-Type"], "application/x-ndjson")
+        lines = response.get_data(as_text=True).splitlines()
+        self.assertEqual([json.loads(line) for line in lines], [{"ID": index + 1, "RAW_VALUE": index / 10.0} for index in range(5)])
+        self.assertEqual(self.heartbeat()["pool"]["in_use"], 0)
+
+    def testLifespanShutdownWritesBufferedRows(self):
+        for value in range(3):
+            self.assertEqual(self.put("/buffered-event", {"RAW_VALUE": value}).status_code, 202)
+        self.assertEqual(self.countRows(), 0)
+        self.stopApp()
+        self.assertEqual(self.countRows(), 3)
+
+class TestAsgiErrors(AsgiTestCase):
+
+    def createConfig(self):
+        return createConfig(admission={"maxConcurrent": 1, "maxQueued": 0})
+
+    def failGet(self, error):
+        async def executeGet(endpoint, request, body, timer):
+            raise error
+        self.app.executeGet = executeGet
+
+    def testUnexpectedErrorResponds500AndLeaves(self):
+        self.failGet(RuntimeError("not handled"))
+        for attempt in range(2):
+            self.assertEqual(self.get("/sensor-event").status_code, 500)
+        self.assertEqual(self.server.admission.getMetrics()["active"], 0)
+        del self.app.executeGet
+        self.assertEqual(self.get("/sensor-event").status_code, 200)
+
+    def testMySqlConnectorErrorResponds503(self):
+        self.failGet(mysql.connector.InterfaceError(msg="Lost connection"))
+        self.assertEqual(self.get("/sensor-event").status_code, 503)
+        self.assertEqual(self.server.admission.getMetrics()["active"], 0)
+
+class TestAsgiBodies(AsgiTestCase):
+
+    def createConfig(self):
+        return createConfig([
+            {"path": "reading", "post": {"commit": True, "query": "INSERT INTO READING (RAW_VALUE) VALUES (%(RAW_VALUE)s);", "users": ["sensor-account"],
+                                         "bulk": {"load": {"table": "READING", "columns": ["RAW_VALUE"], "maxBytes": 64}}}}
+        ], max_body_bytes=32)
+
+    def createSchema(self):
+        self.execute("CREATE TABLE READING (ID INTEGER PRIMARY KEY AUTOINCREMENT, RAW_VALUE REAL NOT NULL)")
+
+    def upload(self, chunks):
+        return self.request("POST", "/reading", self.SENSOR, headers={"Content-Type": "application/x-ndjson"}, chunks=chunks)
+
+    def testBodyLargerThanTheLimitResponds413(self):
+        chunks = [b'{"RAW_VALUE": ', b'1.5}' + b' ' * 20, b'x' * 100, b'}']
+        response = self.request("POST", "/reading", self.SENSOR, headers={"Content-Type": "application/json"}, chunks=chunks)
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(len(chunks), 2)
+        self.assertEqual(self.request("POST", "/reading", self.SENSOR, body={"RAW_VALUE": 1.5}).status_code, 200)
+        self.assertEqual(self.countRows("READING"), 1)
+
+    def testUploadIsSpooledAsItArrives(self):
+        # SQLite has no LOAD DATA, so the spooled file is checked and a SELECT stands in for the statement.
+        load = self.server.getEndpoint("reading").post_verb.bulk.load
+        spooled = []
+
+        def spool(stream, mimetype):
+            path, columns, row_count = ird.BulkLoad.spool(load, stream, mimetype)
+            with open(path) as f:
+                spooled.append(f.read())
+            return path, columns, row_count
+
+        load.spool = spool
+        load.createStatement = lambda columns: "SELECT %s"
+        self.assertEqual(self.upload([b'{"RAW_VALUE"', b': 1.5}\n{"RAW_', b'VALUE": 2.5}\n']).status_code, 200)
+        self.assertEqual(spooled, ["1.5\n2.5\n"])
+
+    def testUploadLargerThanMaxBytesStopsReading(self):
+        chunks = [b'{"RAW_VALUE": 1.5}\n' * 2, b'{"RAW_VALUE": 1.5}\n' * 2, b'{"RAW_VALUE": 1.5}\n']
+        self.assertEqual(self.upload(chunks).status_code, 413)
+        self.assertEqual(len(chunks), 1)
+
+class TestAsyncAdmission(unittest.TestCase):
+
+    def testQueuedRequestGetsTheNextTurn(self):
+        admission = ird.AdmissionControl(max_concurrent=1, max_queued=1, queue_timeout=5)
+        turns = asgi.AsyncAdmission(admission)
+
+        async def run():
+            await turns.enter()
+            waiter = asyncio.ensure_future(turns.enter())
+            await asyncio.sleep(0)
+            with self.assertRaises(ird.TooManyRequests):
+                await turns.enter()
+            turns.leave()
+            await asyncio.wait_for(waiter, 5)
+            turns.leave()
+
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(run())
+        finally:
+            loop.close()
+        metrics = admission.getMetrics()
+        self.assertEqual((metrics["active"], metrics["waiting"], metrics["admitted"], metrics["queued"], metrics["rejected"]), (0, 0, 2, 1, 1))
+
+    def testQueuedRequestTimesOut(self):
+        admission = ird.AdmissionControl(max_concurrent=1, max_queued=1, queue_timeout=0.01)
+        turns = asgi.AsyncAdmission(admission)
+
+        async def run():
+            await turns.enter()
+            with self.assertRaises(ird.TooManyRequests):
+                await turns.enter()
+
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(run())
+        finally:
+            loop.close()
+        self.assertEqual(admission.getMetrics()["timeouts"], 1)
+
+class TestAsgiEvents(AsgiTestCase):
+
+    def createConfig(self):
+        config = createConfig(push={"keepAlive": 60, "maxSubscribers": 1})
+        config["endpoints"][0]["put"]["pusherEvents"] = [{"eventName": "insert"}]
+        return config
+
+    def disconnect(self, task, disconnected):
+        disconnected.set()
+        self.loop.run_until_complete(asyncio.wait_for(task, 5))
+        self.assertEqual(self.heartbeat()["push"]["sensor-event"]["subscribers"], 0)
+
+    def testEventStream(self):
+        task, sent, disconnected = self.connect("/sensor-event/events")
+        start = self.receive(sent)
+        self.assertEqual(start["status"], 200)
+        self.assertIn((b"content-type", b"text/event-stream"), start["headers"])
+        self.assertEqual(self.receive(sent)["body"], b"retry: 1000\n\n")
+        self.assertEqual(self.put("/sensor-event", {"RAW_VALUE": 0.5}).status_code, 200)
+        self.assertEqual(self.receive(sent)["body"], b'id: 1\nevent: insert\ndata: [{"RAW_VALUE":0.5}]\n\n')
+        self.assertEqual(self.get("/sensor-event/events").status_code, 503)
+        self.disconnect(task, disconnected)
+
+    def testWebSocket(self):
+        task, sent, disconnected = self.connect("/sensor-event/events", websocket=True)
+        self.assertEqual(self.receive(sent), {"type": "websocket.accept"})
+        self.assertEqual(self.put("/sensor-event", {"RAW_VALUE": 0.5}).status_code, 200)
+        message = self.receive(sent)
+        self.assertEqual(json.loads(message["text"]), {"id": 1, "event": "insert", "data": [{"RAW_VALUE": 0.5}]})
+        self.disconnect(task, disconnected)
+
+    def testRefusedWebSocketIsClosed(self):
+        for path, authorization in [("/sensor-event/events", self.SENSOR), ("/sensor-event", self.ADMIN)]:
+            task, sent, disconnected = self.connect(path, authorization, websocket=True)
+            self.assertEqual(self.receive(sent), {"type": "websocket.close", "code": 1008})
+            self.loop.run_until_complete(asyncio.wait_for(task, 5))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+########################################################################################################################
+#
+#  Lemma Logic LLC
+#  __________________
+#
+# Copyright 2018 Lemma Logic LLC
+# All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+########################################################################################################################
+import binascii, hashlib, unittest
+from support import ird, basicAuth, StandInTestCase, createConfig
+
+ADMIN_HASH = "b025d883b5d875a10649fcdb6d89fd22aaf1589ae478988042722479"
+TOKEN = "d2f1c0a5b8e34f6a9c7d"
+
+def createPbkdf2Hash(password, salt="73616c74", iterations=1000):
+    digest = binascii.hexlify(hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt.encode("utf-8"), iterations)).decode("ascii")
+    return "pbkdf2_sha256$%d$%s$%s" % (iterations, salt, digest)
+
+class TestAuthenticator(unittest.TestCase):
+
+    def createAuthenticator(self, ttl=300.0, max_entries=10000):
+        authenticator = ird.Authenticator(ttl, max_entries)
+        authenticator.addUser(ird.User("admin", ADMIN_HASH))
+        authenticator.addUser(ird.User("device", createPbkdf2Hash("device password"), [hashlib.sha256(TOKEN.encode("ascii")).hexdigest()]))
+        return authenticator
+
+    def testPasswordHashesAndTokensAreVerified(self):
+        authenticator = self.createAuthenticator()
+        self.assertEqual(authenticator.authenticate(basicAuth("admin", "admin password")).getUsername(), "admin")
+        self.assertEqual(authenticator.authenticate(basicAuth("device", "device password")).getUsername(), "device")
+        self.assertEqual(authenticator.authenticate("Bearer " + TOKEN).getUsername(), "device")
+        self.assertIsNone(authenticator.authenticate(basicAuth("admin", "wrong password")))
+        self.assertIsNone(authenticator.authenticate(basicAuth("nobody", "admin password")))
+        self.assertIsNone(authenticator.authenticate("Bearer wrong"))
+        self.assertIsNone(authenticator.authenticate("Digest admin"))
+
+    def testVerifiedHeaderIsCached(self):
+        authenticator = self.createAuthenticator()
+        header = basicAuth("device", "device password")
+        for attempt in range(3):
+            self.assertEqual(authenticator.authenticate(header).getUsername(), "device")
+        self.assertEqual(authenticator.getMetrics(), {"entries": 1, "hits": 2, "misses": 1})
+        self.assertEqual(authenticator.lookup(header).getUsername(), "device")
+
+    def testFailedHeaderIsNotCached(self):
+        authenticator = self.createAuthenticator()
+        for attempt in range(2):
+            self.assertIsNone(authenticator.authenticate(basicAuth("admin", "wrong password")))
+        self.assertEqual(authenticator.getMetrics(), {"entries": 0, "hits": 0, "misses": 2})
+
+    def testZeroTtlTurnsTheCacheOff(self):
+        authenticator = self.createAuthenticator(ttl=0)
+        for attempt in range(2):
+            self.assertIsNotNone(authenticator.authenticate(basicAuth("admin", "admin password")))
+        self.assertEqual(authenticator.getMetrics()["entries"], 0)
+
+    def testOldestEntryIsDropped(self):
+        authenticator = self.createAuthenticator(max_entries=1)
+        first, second = basicAuth("admin", "admin password"), "Bearer " + TOKEN
+        authenticator.authenticate(first)
+        authenticator.authenticate(second)
+        self.assertIsNone(authenticator.lookup(first))
+        self.assertIsNotNone(authenticator.lookup(second))
+
+class TestAuthentication(StandInTestCase):
+
+    def createConfig(self):
+        config = createConfig(auth_cache={"ttl": 60, "maxEntries": 100})
+        config["users"][1]["tokens"] = [hashlib.sha256(TOKEN.encode("ascii")).hexdigest()]
+        return config
+
+    def testBearerTokenAuthenticates(self):
+        self.assertEqual(self.put("/sensor-event", {"RAW_VALUE": 0.77}, "Bearer " + TOKEN).status_code, 200)
+        self.assertEqual(self.countRows(), 1)
+
+    def testWrongPasswordResponds401(self):
+        self.assertEqual(self.get("/sensor-event", basicAuth("admin", "wrong password")).status_code, 401)
+        self.assertEqual(self.get("/sensor-event", None).status_code, 401)
+
+    def testRepeatedRequestsHitTheCache(self):
+        for attempt in range(3):
+            self.assertEqual(self.get("/sensor-event").status_code, 200)
+        auth = self.heartbeat()["auth"]
+        self.assertEqual((auth["hits"], auth["misses"]), (2, 1))
+
+if __name__ == '__main__':
+    unittest.main()
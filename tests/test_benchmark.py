@@ -0,0 +1,73 @@
+########################################################################################################################
+#
+#  Lemma Logic LLC
+#  __________________
+#
+# Copyright 2018 Lemma Logic LLC
+# All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+########################################################################################################################
+import json, os, subprocess, sys, unittest
+from support import StandInTestCase
+import benchmark
+
+class TestStatistics(unittest.TestCase):
+
+    def testPercentileIsNearestRank(self):
+        values = list(range(1, 101))
+        self.assertEqual([benchmark.percentile(values, fraction) for fraction in [0.50, 0.95, 0.99]], [50, 95, 99])
+        self.assertEqual(benchmark.percentile([7], 0.99), 7)
+        self.assertIsNone(benchmark.percentile([], 0.5))
+
+    def testSummaryCountsErrorsApart(self):
+        scenario = benchmark.Scenario("get-small", "GET", "/sensor-event", benchmark.ADMIN)
+        result = benchmark.summarize(scenario, 2, [0.002, 0.001, 0.003], [503, 503, 401], 0.5, 120)
+        self.assertEqual((result["requests"], result["errors"], result["error_statuses"]), (6, 3, [401, 503]))
+        self.assertEqual(result["throughput"], 6.0)
+        self.assertEqual(result["latency_ms"]["p50"], 2.0)
+        self.assertEqual(result["latency_ms"]["max"], 3.0)
+
+    def testChangeIsRelativeToThePreviousRun(self):
+        self.assertEqual(benchmark.change(110.0, 100.0).strip(), "+10.0%")
+        self.assertEqual(benchmark.change(None, 100.0).strip(), "n/a")
+
+class TestScenarios(StandInTestCase):
+
+    def testScenariosRunAgainstTheApp(self):
+        scenarios = dict((scenario.name, scenario) for scenario in benchmark.createScenarios(10))
+        create_client = lambda: benchmark.WsgiClient(self.app)
+        put = benchmark.runScenario(create_client, scenarios["put-single"], 2, 5, 1)
+        self.assertEqual((put["requests"], put["errors"]), (10, 0))
+        self.assertEqual(self.countRows(), 12)
+        get = benchmark.runScenario(create_client, scenarios["get-small"], 1, 3, 0)
+        self.assertEqual((get["requests"], get["errors"]), (3, 0))
+        self.assertGreater(get["response_bytes"], 0)
+
+class TestCommandLine(unittest.TestCase):
+
+    def testRunWritesAndComparesResults(self):
+        script = os.path.join(os.path.dirname(benchmark.__file__), "benchmark.py")
+        output = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark-test-output.json")
+        try:
+            arguments = [sys.executable, script, "--requests", "3", "--warmup", "1", "--concurrency", "1,2",
+                         "--seed-rows", "10", "--scenarios", "get-small,post-bulk", "--output", output]
+            subprocess.check_output(arguments, stderr=subprocess.STDOUT)
+            with open(output, "r") as f:
+                report = json.load(f)
+            self.assertEqual([(result["scenario"], result["concurrency"], result["errors"]) for result in report["results"]],
+                             [("get-small", 1, 0), ("get-small", 2, 0), ("post-bulk", 1, 0), ("post-bulk", 2, 0)])
+            self.assertEqual(report["database"], "standin")
+            printed = subprocess.check_output(arguments + ["--compare", output], stderr=subprocess.STDOUT).decode("utf-8")
+            self.assertIn("Compared with " + output, printed)
+        finally:
+            if os.path.exists(output):
+                os.remove(output)
+
+if __name__ == '__main__':
+    unittest.main()
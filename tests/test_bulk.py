@@ -0,0 +1,120 @@
+########################################################################################################################
+#
+#  Lemma Logic LLC
+#  __________________
+#
+# Copyright 2018 Lemma Logic LLC
+# All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+########################################################################################################################
+import io, unittest
+from support import ird, StandInTestCase, createConfig
+
+INSERT = "INSERT INTO READING (RAW_VALUE) VALUES (%(RAW_VALUE)s);"
+
+class TestBulkInsert(StandInTestCase):
+
+    def createConfig(self):
+        return createConfig([
+            {"path": "reading", "get": {"query": "SELECT RAW_VALUE FROM READING ORDER BY ID;", "users": ["admin"]},
+             "post": {"commit": True, "query": INSERT, "users": ["sensor-account"],
+                      "bulk": {"chunkSize": 2, "maxRows": 5, "load": {"table": "READING", "columns": ["RAW_VALUE"]}}}}
+        ])
+
+    def createSchema(self):
+        self.execute("CREATE TABLE READING (ID INTEGER PRIMARY KEY AUTOINCREMENT, RAW_VALUE REAL NOT NULL)")
+
+    def post(self, path, body, authorization=StandInTestCase.SENSOR, headers=None, data=None):
+        return self.request("POST", path, authorization, body, headers, data)
+
+    def testListBodyWritesEveryRow(self):
+        response = self.post("/reading", [{"RAW_VALUE": value} for value in [1, 2, 3]])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.getJson(response)["rows"], 3)
+        self.assertEqual(self.execute("SELECT RAW_VALUE FROM READING ORDER BY ID"), [(1,), (2,), (3,)])
+
+    def testTooManyRowsResponds413(self):
+        response = self.post("/reading", [{"RAW_VALUE": value} for value in range(6)])
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(self.countRows("READING"), 0)
+
+    def testInvalidRowResponds400NamingTheRow(self):
+        response = self.post("/reading", [{"RAW_VALUE": 1}, {"VALUE": 2}])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("row 1", response.get_data(as_text=True))
+        response = self.post("/reading", [{"RAW_VALUE": 1}, 2])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("row 1 is not an object", response.get_data(as_text=True))
+        self.assertEqual(self.countRows("READING"), 0)
+
+    def testFailedChunkRollsBackEveryChunk(self):
+        response = self.post("/reading", [{"RAW_VALUE": 1}, {"RAW_VALUE": 2}, {"RAW_VALUE": 3}, {"RAW_VALUE": None}])
+        self.assertEqual(response.status_code, 500)
+        chunks = self.getJson(response)["chunks"]
+        self.assertEqual([(chunk["first_row"], chunk["rows"], chunk["status"]) for chunk in chunks],
+                         [(0, 2, "rolled_back"), (2, 2, "failure")])
+        self.assertIn("error", chunks[1])
+        self.assertEqual(self.countRows("READING"), 0)
+        self.assertEqual(self.post("/reading", [{"RAW_VALUE": 4}]).status_code, 200)
+        self.assertEqual(self.countRows("READING"), 1)
+
+    def testUploadIsSpooledForLoadData(self):
+        # SQLite has no LOAD DATA, so the statement and the spooled file are checked instead of running them.
+        loads = []
+
+        def loadData(connection, statement, path):
+            with open(path) as f:
+                loads.append((statement, f.read()))
+            return True, 2
+
+        original = ird.MySqlConnection.loadData
+        ird.MySqlConnection.loadData = loadData
+        try:
+            response = self.post("/reading", None, headers={"Content-Type": "application/x-ndjson"},
+                                 data='{"raw_value": 1.5}\n\n{"RAW_VALUE": null}\n')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(self.getJson(response)["rows"], 2)
+            response = self.post("/reading", None, headers={"Content-Type": "text/csv"}, data='RAW_VALUE\n2.5\n\n')
+            self.assertEqual(response.status_code, 200)
+        finally:
+            ird.MySqlConnection.loadData = original
+        self.assertEqual(len(loads), 2)
+        statement, contents = loads[0]
+        self.assertIn("LOAD DATA LOCAL INFILE %s INTO TABLE `READING`", statement)
+        self.assertTrue(statement.endswith("(`RAW_VALUE`)"))
+        self.assertEqual(contents, "1.5\nNULL\n")
+        self.assertEqual(loads[1][1], '"2.5"\n')
+
+    def testInvalidUploadResponds400(self):
+        response = self.post("/reading", None, headers={"Content-Type": "application/x-ndjson"}, data='{"RAW_VALUE": 1}\n{"DEVICE": 2}\n')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("line 2 has unknown column DEVICE", response.get_data(as_text=True))
+        response = self.post("/reading", None, headers={"Content-Type": "text/csv"}, data='RAW_VALUE\n1,2\n')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("line 2 has 2 fields", response.get_data(as_text=True))
+
+class TestBulkLoad(unittest.TestCase):
+
+    def testUploadLargerThanMaxBytesIsRejected(self):
+        load = ird.BulkLoad("READING", ["RAW_VALUE"], max_bytes=10)
+        with self.assertRaises(ird.UploadTooLarge):
+            load.spool(io.BytesIO(b'{"RAW_VALUE": 1}\n'), "application/x-ndjson")
+
+    def testInvalidNamesAreRejected(self):
+        with self.assertRaises(Exception):
+            ird.BulkLoad("READING; DROP TABLE READING", ["RAW_VALUE"])
+
+    def testFieldsAreQuotedForLoadData(self):
+        self.assertEqual(ird.BulkLoad.formatField(None), "NULL")
+        self.assertEqual(ird.BulkLoad.formatField(True), "1")
+        self.assertEqual(ird.BulkLoad.formatField('say "hi"'), '"say ""hi"""')
+        self.assertEqual(ird.BulkLoad.formatField({"a": 1}), '"{""a"": 1}"')
+
+if __name__ == '__main__':
+    unittest.main()
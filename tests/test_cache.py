@@ -0,0 +1,69 @@
+########################################################################################################################
+#
+#  Lemma Logic LLC
+#  __________________
+#
+# Copyright 2018 Lemma Logic LLC
+# All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+########################################################################################################################
+import time, unittest
+from support import StandInTestCase, createConfig
+
+class TestResponseCache(StandInTestCase):
+
+    def createConfig(self):
+        return createConfig([
+            {"path": "sensor-event",
+             "get": {"query": "SELECT * FROM SENSOR_EVENT ORDER BY ID;", "users": ["admin"], "cache": {"ttl": 60, "maxEntries": 10}},
+             "put": {"commit": True, "query": "INSERT INTO SENSOR_EVENT (RAW_VALUE) VALUES (%(RAW_VALUE)s);", "users": ["sensor-account"]}},
+            {"path": "short", "get": {"query": "SELECT * FROM SENSOR_EVENT ORDER BY ID;", "users": ["admin"], "cache": {"ttl": 0.05}}}
+        ])
+
+    def countEvents(self, path="/sensor-event"):
+        response = self.get(path)
+        self.assertEqual(response.status_code, 200)
+        return len(self.getJson(response)["data"] or [])
+
+    def testRepeatedRequestIsServedFromTheCache(self):
+        self.assertEqual(self.countEvents(), 0)
+        self.execute("INSERT INTO SENSOR_EVENT (RAW_VALUE) VALUES (0.77)")
+        self.assertEqual(self.countEvents(), 0)
+        metrics = self.heartbeat()["cache"]["sensor-event"]
+        self.assertEqual((metrics["hits"], metrics["misses"]), (1, 1))
+
+    def testMatchingIfNoneMatchResponds304(self):
+        response = self.get("/sensor-event")
+        etag = response.headers["ETag"]
+        response = self.get("/sensor-event", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.get_data(), b"")
+        self.assertEqual(self.get("/sensor-event", headers={"If-None-Match": '"other"'}).status_code, 200)
+
+    def testSuccessfulWriteInvalidatesTheCache(self):
+        etag = self.get("/sensor-event").headers["ETag"]
+        self.assertEqual(self.put("/sensor-event", {"RAW_VALUE": 0.77}).status_code, 200)
+        response = self.get("/sensor-event", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.getJson(response)["data"]), 1)
+
+    def testFailedWriteKeepsTheCache(self):
+        self.assertEqual(self.countEvents(), 0)
+        self.execute("INSERT INTO SENSOR_EVENT (RAW_VALUE) VALUES (0.77)")
+        self.assertEqual(self.put("/sensor-event", {}).status_code, 400)
+        self.assertEqual(self.countEvents(), 0)
+
+    def testEntryExpiresAfterTtl(self):
+        self.assertEqual(self.countEvents("/short"), 0)
+        self.execute("INSERT INTO SENSOR_EVENT (RAW_VALUE) VALUES (0.77)")
+        time.sleep(0.1)
+        self.assertEqual(self.countEvents("/short"), 1)
+
+if __name__ == '__main__':
+    unittest.main()
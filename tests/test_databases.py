@@ -0,0 +1,138 @@
+########################################################################################################################
+#
+#  Lemma Logic LLC
+#  __________________
+#
+# Copyright 2018 Lemma Logic LLC
+# All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+########################################################################################################################
+import mysql.connector, os, sqlite3, unittest, zlib
+from support import ird, standin, StandInTestCase, createConfig
+
+class MultiDatabaseTestCase(StandInTestCase):
+    """Gives each database host its own stand-in file.  Connecting to a host in self.down fails."""
+    HOSTS = []
+
+    def createSchema(self):
+        self.databases = {"127.0.0.1": self.database}
+        for host in self.HOSTS:
+            self.databases[host] = os.path.join(self.directory, host + ".db")
+            standin.createSchema(self.databases[host])
+        self.down = set()
+        mysql.connector.connect = self.connect
+
+    def connect(self, host=None, autocommit=False, **kwargs):
+        if host in self.down:
+            raise mysql.connector.InterfaceError(msg="Can't connect to MySQL server on " + host)
+        return standin.StandInConnection(self.databases[host], autocommit)
+
+    def executeOn(self, host, sql, parameters=()):
+        connection = sqlite3.connect(self.databases[host], timeout=30)
+        try:
+            rows = connection.execute(sql, parameters).fetchall()
+            connection.commit()
+            return rows
+        finally:
+            connection.close()
+
+class TestReadReplicas(MultiDatabaseTestCase):
+    HOSTS = ["10.0.0.12"]
+
+    def createConfig(self):
+        config = createConfig(database_replicas=[{"database_ip_address": "10.0.0.12"}], database_replica_retry_interval=60)
+        config["endpoints"].append({"path": "primary-event", "get": {"query": "SELECT * FROM SENSOR_EVENT ORDER BY ID;", "users": ["admin"], "readFrom": "primary"}})
+        return config
+
+    def getValues(self, path):
+        response = self.get(path)
+        self.assertEqual(response.status_code, 200)
+        return [row["RAW_VALUE"] for row in self.getJson(response)["data"] or []]
+
+    def testReadsGoToTheReplicaAndWritesToThePrimary(self):
+        self.assertEqual(self.put("/sensor-event", {"RAW_VALUE": 0.5}).status_code, 200)
+        self.executeOn("10.0.0.12", "INSERT INTO SENSOR_EVENT (RAW_VALUE) VALUES (0.25)")
+        self.assertEqual(self.countRows(), 1)
+        self.assertEqual(self.getValues("/sensor-event"), [0.25])
+        self.assertEqual(self.getValues("/primary-event"), [0.5])
+
+    def testUnavailableReplicaFailsOverToThePrimary(self):
+        self.executeOn("10.0.0.12", "INSERT INTO SENSOR_EVENT (RAW_VALUE) VALUES (0.25)")
+        self.execute("INSERT INTO SENSOR_EVENT (RAW_VALUE) VALUES (0.5)")
+        self.down.add("10.0.0.12")
+        self.assertEqual(self.getValues("/sensor-event"), [0.5])
+        databases = self.heartbeat()["databases"]
+        self.assertFalse(databases["replicas"][0]["available"])
+        # The replica is skipped until the retry interval has passed, even once it is back.
+        self.down.clear()
+        self.assertEqual(self.getValues("/sensor-event"), [0.5])
+        self.assertEqual(self.server.getClusters()[0].getMetrics()["failovers"], 1)
+
+class TestSharding(MultiDatabaseTestCase):
+    HOSTS = ["10.0.1.10", "10.0.2.10"]
+
+    def createConfig(self):
+        return createConfig([
+            {"path": "device-event",
+             "get": {"query": "SELECT RAW_VALUE FROM DEVICE_EVENT WHERE DEVICE_ID = %(DEVICE_ID)s ORDER BY ID;", "users": ["admin"], "shard": "devices"},
+             "put": {"commit": True, "query": "INSERT INTO DEVICE_EVENT (DEVICE_ID, RAW_VALUE) VALUES (%(DEVICE_ID)s, %(RAW_VALUE)s);", "users": ["sensor-account"], "shard": "devices"}}
+        ], shards={"devices": {"key": "DEVICE_ID", "databases": [{"database_ip_address": host} for host in self.HOSTS]}})
+
+    def createSchema(self):
+        MultiDatabaseTestCase.createSchema(self)
+        for host in self.HOSTS:
+            self.executeOn(host, "CREATE TABLE DEVICE_EVENT (ID INTEGER PRIMARY KEY AUTOINCREMENT, DEVICE_ID TEXT, RAW_VALUE REAL)")
+
+    def getShardHost(self, device_id):
+        return self.HOSTS[zlib.crc32(device_id.encode("utf-8")) % len(self.HOSTS)]
+
+    def countDeviceRows(self, host, device_id):
+        return self.executeOn(host, "SELECT COUNT(*) FROM DEVICE_EVENT WHERE DEVICE_ID = ?", (device_id,))[0][0]
+
+    def testRowsAreWrittenToTheShardOfTheirKey(self):
+        devices = ["device-" + str(index) for index in range(8)]
+        self.assertEqual(len(set([self.getShardHost(device) for device in devices])), 2)
+        for device in devices:
+            self.assertEqual(self.put("/device-event", {"DEVICE_ID": device, "RAW_VALUE": 1.5}).status_code, 200)
+        for device in devices:
+            host = self.getShardHost(device)
+            other = [other for other in self.HOSTS if other != host][0]
+            self.assertEqual((self.countDeviceRows(host, device), self.countDeviceRows(other, device)), (1, 0))
+            response = self.get("/device-event?DEVICE_ID=" + device)
+            self.assertEqual([row["RAW_VALUE"] for row in self.getJson(response)["data"]], [1.5])
+
+    def testListBodyIsGroupedByShard(self):
+        rows = [{"DEVICE_ID": "device-" + str(index), "RAW_VALUE": index} for index in range(6)]
+        response = self.put("/device-event", rows)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.getJson(response)["rows"], 6)
+        for row in rows:
+            self.assertEqual(self.countDeviceRows(self.getShardHost(row["DEVICE_ID"]), row["DEVICE_ID"]), 1)
+
+    def testRequestWithoutTheKeyResponds400(self):
+        self.assertEqual(self.put("/device-event", {"RAW_VALUE": 1.5}).status_code, 400)
+        self.assertEqual(self.get("/device-event").status_code, 400)
+
+    def testHeartbeatListsTheShards(self):
+        shards = self.heartbeat()["databases"]["shards"]["devices"]
+        self.assertEqual(len(shards), 2)
+
+class TestShardMap(unittest.TestCase):
+
+    def testKeysAreHashedAsText(self):
+        shards = ird.ShardMap("devices", "device_id", 3)
+        self.assertEqual(shards.locate({"DEVICE_ID": 42}), zlib.crc32(b"42") % 3)
+        self.assertEqual(shards.locate({"DEVICE_ID": "42"}), shards.locate({"DEVICE_ID": 42}))
+
+    def testMissingKeyIsReported(self):
+        with self.assertRaises(ird.MissingParameter):
+            ird.ShardMap("devices", "DEVICE_ID", 2).locate({"RAW_VALUE": 1})
+
+if __name__ == '__main__':
+    unittest.main()
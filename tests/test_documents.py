@@ -0,0 +1,90 @@
+########################################################################################################################
+#
+#  Lemma Logic LLC
+#  __________________
+#
+# Copyright 2018 Lemma Logic LLC
+# All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+########################################################################################################################
+import json, os, unittest
+from support import ird, StandInTestCase, createConfig
+
+class TestApiDocuments(StandInTestCase):
+
+    def createConfig(self):
+        return createConfig(schema_cache=os.path.join(self.directory, "schema.json"))
+
+    def setUp(self):
+        self.introspected = []
+        self._getColumnInfo = ird.MySqlConnection.getColumnInfo
+        test = self
+
+        def getColumnInfo(connection, plan):
+            test.introspected.append(plan.sql)
+            return test._getColumnInfo(connection, plan)
+
+        ird.MySqlConnection.getColumnInfo = getColumnInfo
+        StandInTestCase.setUp(self)
+
+    def tearDown(self):
+        StandInTestCase.tearDown(self)
+        ird.MySqlConnection.getColumnInfo = self._getColumnInfo
+
+    def readCache(self):
+        with open(self.createConfig()["schema_cache"]) as f:
+            return json.load(f)
+
+    def testDocumentsAreServedWithETags(self):
+        for path, mimetype in [("/help", "text/html"), ("/openapi.json", "application/json")]:
+            self.assertEqual(self.get(path, None).status_code, 401)
+            response = self.get(path)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.mimetype, mimetype)
+            etag = response.headers["ETag"]
+            self.assertEqual(self.get(path, headers={"If-None-Match": etag}).status_code, 304)
+
+    def testDocumentsDescribeTheEndpoints(self):
+        document = self.getJson(self.get("/openapi.json"))
+        self.assertEqual(sorted(document["paths"]["/sensor-event"]), ["get", "put"])
+        columns = document["paths"]["/sensor-event"]["get"]["responses"]["200"]["content"]["application/json"]["schema"]["properties"]["data"]["items"]["properties"]
+        self.assertEqual(sorted(columns), ["EVENT_TIMESTAMP", "ID", "RAW_VALUE"])
+        self.assertIn("<h3>PUT /sensor-event</h3>", self.get("/help").get_data(as_text=True))
+
+    def testColumnsAreReadOnceAndSaved(self):
+        self.assertEqual(len(self.introspected), 2)
+        self.assertEqual(len(self.readCache()), 2)
+        for path in ["/help", "/openapi.json", "/help"]:
+            self.get(path)
+        self.assertEqual(len(self.introspected), 2)
+
+    def testLaterStartsReadTheSavedColumns(self):
+        cache = self.readCache()
+        key = [key for key in cache if not key.startswith("table:")][0]
+        cache[key] = [{"name": "ID", "type": "LONGLONG", "nullable": False}]
+        with open(self.createConfig()["schema_cache"], "w") as f:
+            json.dump(cache, f)
+        self.stopApp()
+        self.startApp()
+        self.assertEqual(len(self.introspected), 2)
+        document = self.getJson(self.get("/openapi.json"))
+        columns = document["paths"]["/sensor-event"]["get"]["responses"]["200"]["content"]["application/json"]["schema"]["properties"]["data"]["items"]["properties"]
+        self.assertEqual(columns, {"ID": {"type": "integer"}})
+
+    def testOnlyChangedQueriesAreRead(self):
+        self.stopApp()
+        config = self.createConfig()
+        config["endpoints"][0]["get"]["query"] = "SELECT ID, RAW_VALUE FROM SENSOR_EVENT ORDER BY ID;"
+        self.startApp(config)
+        self.assertEqual(self.introspected[2:], ["SELECT ID, RAW_VALUE FROM SENSOR_EVENT ORDER BY ID"])
+        # The columns of the old query are no longer used, so they are dropped from the file.
+        self.assertEqual(len(self.readCache()), 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+########################################################################################################################
+#
+#  Lemma Logic LLC
+#  __________________
+#
+# Copyright 2018 Lemma Logic LLC
+# All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+########################################################################################################################
+import unittest
+from support import StandInTestCase, createConfig
+
+INSERT = "INSERT INTO SENSOR_EVENT (RAW_VALUE) VALUES (%(RAW_VALUE)s);"
+
+class TestBufferedIngest(StandInTestCase):
+
+    def createConfig(self):
+        return createConfig([
+            {"path": "queued", "put": {"commit": True, "query": INSERT, "users": ["sensor-account"],
+                                       "buffered": {"queueSize": 2, "batchSize": 1, "flushInterval": 0.01, "ack": "enqueue"}}},
+            {"path": "flushed", "post": {"commit": True, "query": INSERT, "users": ["sensor-account"],
+                                         "buffered": {"batchSize": 100, "flushInterval": 0.05, "ack": "flush"}}},
+            {"path": "slow", "put": {"commit": True, "query": INSERT, "users": ["sensor-account"],
+                                     "buffered": {"batchSize": 100, "flushInterval": 30, "ack": "enqueue"}}}
+        ], database_pool_size=1, database_pool_timeout=0.1)
+
+    def testEnqueueRespondsAccepted(self):
+        response = self.put("/queued", {"RAW_VALUE": 0.77})
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(self.getJson(response)["status"], "accepted")
+        self.waitFor(lambda: self.countRows() == 1)
+
+    def testFlushAckRespondsOnceTheRowsAreWritten(self):
+        response = self.post("/flushed", [{"RAW_VALUE": 1}, {"RAW_VALUE": 2}, {"RAW_VALUE": 3}])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.countRows(), 3)
+        metrics = self.heartbeat()["ingest"]["POST flushed"]
+        self.assertEqual(metrics["flushed"], 3)
+        self.assertEqual(metrics["batches"], 1)
+
+    def testFullQueueResponds503(self):
+        pool = self.server.getClusters()[0].primary
+        connection = pool.checkout()
+        try:
+            response = self.put("/queued", [{"RAW_VALUE": value} for value in range(5)])
+        finally:
+            pool.release(connection)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers["Retry-After"], "1")
+        metrics = self.heartbeat()["ingest"]["PUT queued"]
+        self.assertEqual(metrics["rejected"], 1)
+        self.assertEqual(metrics["enqueued"], 0)
+
+    def testRejectedRequestQueuesNoneOfItsRows(self):
+        self.assertEqual(self.put("/queued", [{"RAW_VALUE": value} for value in range(3)]).status_code, 503)
+        self.assertEqual(self.put("/queued", {"RAW_VALUE": 0.77}).status_code, 202)
+        self.waitFor(lambda: self.countRows() == 1)
+        self.assertEqual(self.execute("SELECT RAW_VALUE FROM SENSOR_EVENT"), [(0.77,)])
+        self.assertEqual(self.heartbeat()["ingest"]["PUT queued"]["enqueued"], 1)
+
+    def testShutdownWritesQueuedRows(self):
+        self.assertEqual(self.put("/slow", {"RAW_VALUE": 0.77}).status_code, 202)
+        self.assertEqual(self.countRows(), 0)
+        self.stopApp()
+        self.assertEqual(self.countRows(), 1)
+
+if __name__ == '__main__':
+    unittest.main()
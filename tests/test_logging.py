@@ -0,0 +1,110 @@
+########################################################################################################################
+#
+#  Lemma Logic LLC
+#  __________________
+#
+# Copyright 2018 Lemma Logic LLC
+# All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+########################################################################################################################
+import json, logging, threading, unittest
+from support import ird
+
+class RecordingHandler(logging.Handler):
+    def __init__(self, gate=None):
+        logging.Handler.__init__(self)
+        self.gate = gate
+        self.records = []
+        self.threads = set()
+
+    def emit(self, record):
+        if self.gate is not None:
+            self.gate.wait(5)
+        self.records.append(record)
+        self.threads.add(threading.current_thread().name)
+
+def createRecord(message, level=logging.INFO, args=None):
+    return logging.LogRecord("rest-datastore", level, __file__, 1, message, args, None)
+
+class TestAsyncLogHandler(unittest.TestCase):
+
+    def testRecordsAreWrittenByTheBackgroundThread(self):
+        target = RecordingHandler()
+        handler = ird.AsyncLogHandler([target])
+        handler.emit(createRecord("Rows: %s", args=(3,)))
+        handler.close()
+        self.assertEqual([record.getMessage() for record in target.records], ["Rows: 3"])
+        self.assertEqual(target.threads, set(["log-writer"]))
+
+    def testRecordsAreDroppedWhenTheQueueIsFull(self):
+        gate = threading.Event()
+        target = RecordingHandler(gate)
+        handler = ird.AsyncLogHandler([target], queue_size=1)
+        for index in range(5):
+            handler.emit(createRecord("record %d" % index))
+        self.assertGreaterEqual(handler.dropped, 3)
+        gate.set()
+        handler.close()
+        self.assertEqual(len(target.records) + handler.dropped, 5)
+
+    def testHandlerLevelIsRespected(self):
+        target = RecordingHandler()
+        target.setLevel(logging.WARNING)
+        handler = ird.AsyncLogHandler([target])
+        handler.emit(createRecord("quiet"))
+        handler.emit(createRecord("loud", logging.ERROR))
+        handler.close()
+        self.assertEqual([record.getMessage() for record in target.records], ["loud"])
+
+class TestFormatting(unittest.TestCase):
+
+    def testJsonFormatterWritesOneObject(self):
+        entry = json.loads(ird.JsonLogFormatter().format(createRecord("Adding %s", logging.WARNING, ("endpoint",))))
+        self.assertEqual(entry["level"], "WARNING")
+        self.assertEqual(entry["logger"], "rest-datastore")
+        self.assertEqual(entry["message"], "Adding endpoint")
+        self.assertTrue(entry["time"].endswith("Z"))
+
+    def testQueryResultsAreLoggedWithoutTheirRows(self):
+        result = ird.QueryResult(["ID", "SECRET"], [(1, "password"), (2, "password")])
+        self.assertEqual(str(result), "{columns: ['ID', 'SECRET'], rows: 2}")
+
+class TestDebugSampler(unittest.TestCase):
+
+    def tearDown(self):
+        ird.request_state.__dict__.pop("log_sampled", None)
+
+    def testUnsampledRequestsDropDebugRecords(self):
+        sampler = ird.DebugSampler(0.0)
+        sampler.sample()
+        self.assertFalse(sampler.filter(createRecord("debug", logging.DEBUG)))
+        self.assertTrue(sampler.filter(createRecord("info", logging.INFO)))
+
+    def testRecordsOutsideRequestsPass(self):
+        self.assertTrue(ird.DebugSampler(0.0).filter(createRecord("debug", logging.DEBUG)))
+
+    def testSampledRequestsKeepDebugRecords(self):
+        sampler = ird.DebugSampler(1.0)
+        sampler.sample()
+        self.assertTrue(sampler.filter(createRecord("debug", logging.DEBUG)))
+
+    def testReconfiguringReplacesTheSampler(self):
+        level = ird.logger.level
+        try:
+            first = ird.configureLogging({"async": False, "debugSampleRate": 0.5}, "ERROR")
+            second = ird.configureLogging({"async": False, "debugSampleRate": 0.5}, "ERROR")
+            self.assertEqual(ird.logger.filters, [second])
+            self.assertIsNot(first, second)
+            self.assertIsNone(ird.configureLogging({"async": False}, "ERROR"))
+            self.assertEqual(ird.logger.filters, [])
+        finally:
+            ird.logger.setLevel(level)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+########################################################################################################################
+#
+#  Lemma Logic LLC
+#  __________________
+#
+# Copyright 2018 Lemma Logic LLC
+# All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+########################################################################################################################
+import unittest
+from support import ird, StandInTestCase, createConfig
+
+class TestMetricsText(unittest.TestCase):
+
+    def testHistogramBucketsAreCumulative(self):
+        histogram = ird.LatencyHistogram()
+        for seconds in [0.0001, 0.003, 0.003, 20.0]:
+            histogram.observe(seconds)
+        cumulative = histogram.getCumulativeCounts()
+        self.assertEqual(cumulative[0], 1)
+        self.assertEqual(cumulative[ird.LatencyHistogram.BUCKETS.index(0.005)], 3)
+        self.assertEqual(cumulative[-2:], [3, 4])
+        text = ird.MetricsText()
+        text.addHistogram("latency", "Latency.", [([("path", "a")], (cumulative, histogram.total))])
+        lines = text.render().splitlines()
+        self.assertIn('latency_bucket{path="a",le="0.005"} 3', lines)
+        self.assertIn('latency_bucket{path="a",le="+Inf"} 4', lines)
+        self.assertIn('latency_count{path="a"} 4', lines)
+
+    def testLabelValuesAreEscaped(self):
+        self.assertEqual(ird.formatLabels([("path", 'a"b\\c\nd')]), '{path="a\\"b\\\\c\\nd"}')
+        self.assertEqual(ird.formatLabels([]), "")
+
+class TestMetricsEndpoint(StandInTestCase):
+
+    def scrape(self):
+        response = self.get("/metrics", None)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["Content-Type"], ird.MetricsText.CONTENT_TYPE)
+        return response.get_data().decode("utf-8").splitlines()
+
+    def testRequestsAreCountedByStatus(self):
+        self.put("/sensor-event", {"RAW_VALUE": 0.77})
+        self.put("/sensor-event", {"RAW_VALUE": 0.78})
+        self.get("/sensor-event")
+        self.put("/sensor-event", {})
+        self.get("/unknown")
+        lines = self.scrape()
+        self.assertIn('ird_requests_total{path="sensor-event",method="PUT",status="200"} 2', lines)
+        self.assertIn('ird_requests_total{path="sensor-event",method="PUT",status="400"} 1', lines)
+        self.assertIn('ird_requests_total{path="sensor-event",method="GET",status="200"} 1', lines)
+        self.assertIn('ird_request_errors_total{path="sensor-event",method="PUT"} 0', lines)
+        self.assertIn('ird_request_duration_seconds_count{path="sensor-event",method="PUT"} 3', lines)
+        self.assertFalse([line for line in lines if "unknown" in line])
+
+    def testPhasesAreTimed(self):
+        self.get("/sensor-event")
+        phases = [line for line in self.scrape() if line.startswith("ird_request_phase_seconds_count")]
+        for phase in ["auth", "execute", "serialize"]:
+            self.assertIn('ird_request_phase_seconds_count{path="sensor-event",method="GET",phase="%s"} 1' % phase, phases)
+
+    def testServerMetricsAreIncluded(self):
+        lines = self.scrape()
+        self.assertIn('ird_pool_size{database="primary"} 4', lines)
+        self.assertIn('ird_pool_connections{database="primary",state="idle"} 1', lines)
+        self.assertIn("# TYPE ird_ingest_rows_total counter", lines)
+
+class TestMetricsTurnedOff(StandInTestCase):
+
+    def createConfig(self):
+        return createConfig(metrics=False)
+
+    def testMetricsEndpointIsGone(self):
+        self.assertEqual(self.get("/sensor-event").status_code, 200)
+        self.assertEqual(self.get("/metrics", None).status_code, 404)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+########################################################################################################################
+#
+#  Lemma Logic LLC
+#  __________________
+#
+# Copyright 2018 Lemma Logic LLC
+# All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+########################################################################################################################
+import datetime, decimal, json, os, unittest
+from werkzeug.datastructures import Headers
+from support import ird, StandInTestCase, createConfig
+
+class TestParameterSchema(unittest.TestCase):
+
+    def assertInvalid(self, schema, parameters, message, error=ird.InvalidParameter):
+        with self.assertRaises(error) as context:
+            schema.merge(parameters)
+        self.assertEqual(str(context.exception), message)
+
+    def testValuesAreConvertedToTheirTypes(self):
+        schema = ird.ParameterSchema(["ID", "ON", "AT", "DAY", "PRICE", "NAME"], ["ID"],
+                                     {"ID": "integer", "ON": "boolean", "AT": "datetime", "DAY": "date", "PRICE": "decimal", "NAME": "string"})
+        self.assertEqual(schema.merge({"id": "10", "on": "yes", "at": "2026-10-18T03:00:00Z", "day": "2026-10-18", "price": "1.10", "name": 7}),
+                         {"ID": 10, "ON": True, "AT": datetime.datetime(2026, 10, 18, 3, 0), "DAY": datetime.date(2026, 10, 18),
+                          "PRICE": decimal.Decimal("1.10"), "NAME": "7"})
+        self.assertEqual(schema.merge(None, {"ID": 10, "ON": "off"}), {"ID": 10, "ON": False})
+
+    def testOnlyTheVerbsParametersAreBound(self):
+        schema = ird.ParameterSchema(["RAW_VALUE", "DEVICE_ID"], ["RAW_VALUE"])
+        merged = schema.merge({"raw_value": "1", "other": "2"}, {"DEVICE_ID": "a", "EXTRA": 3}, Headers([("Authorization", "Basic x"), ("Device-Id", "b")]))
+        self.assertEqual(merged, {"RAW_VALUE": "1", "DEVICE_ID": "b"})
+
+    def testHeaderNamesUseDashes(self):
+        # The ASGI app builds plain Headers, which don't treat _ and - alike the way the WSGI environ does.
+        schema = ird.ParameterSchema(["X_DEVICE"])
+        self.assertEqual(schema.merge(None, None, Headers([("X-Device", "a")])), {"X_DEVICE": "a"})
+        self.assertEqual(schema.merge(None, None, Headers([("X_Device", "a")])), {})
+
+    def testChecksNameTheParameter(self):
+        schema = ird.ParameterSchema(["ID", "NAME", "KIND", "LEVEL"], ["ID"], {
+            "ID": {"type": "integer", "minimum": 1, "maximum": 10, "nullable": False},
+            "NAME": {"type": "string", "maxLength": 4, "pattern": "^[a-z]+$"},
+            "KIND": {"enum": ["a", "b"]},
+            "LEVEL": {"type": "number", "default": 0.5}})
+        self.assertInvalid(schema, {}, "ID", ird.MissingParameter)
+        self.assertInvalid(schema, {"ID": None}, "ID can't be null")
+        self.assertInvalid(schema, {"ID": "ten"}, "ID must be an integer")
+        self.assertInvalid(schema, {"ID": "1.5"}, "ID must be an integer")
+        self.assertInvalid(schema, {"ID": 0}, "ID must be at least 1")
+        self.assertInvalid(schema, {"ID": 11}, "ID must be at most 10")
+        self.assertInvalid(schema, {"ID": 1, "NAME": "abcde"}, "NAME must be at most 4 characters")
+        self.assertInvalid(schema, {"ID": 1, "NAME": "AB"}, "NAME must match ^[a-z]+$")
+        self.assertInvalid(schema, {"ID": 1, "KIND": "c"}, "KIND must be one of a, b")
+        self.assertInvalid(schema, {"ID": 1, "LEVEL": "high"}, "LEVEL must be a number")
+        self.assertEqual(schema.merge({"ID": 1, "NAME": None}), {"ID": 1, "NAME": None, "LEVEL": 0.5})
+
+    def testInvalidSpecsAreRejected(self):
+        with self.assertRaises(Exception):
+            ird.ParameterSchema(["ID"], specs={"ID": "uuid"})
+        with self.assertRaises(Exception):
+            ird.ParameterSchema(["NAME"], specs={"NAME": {"type": "string", "minimum": 1}})
+
+class TestDeclaredParameters(StandInTestCase):
+
+    def createConfig(self):
+        config = createConfig()
+        config["endpoints"][0]["put"]["parameters"] = {"RAW_VALUE": {"type": "number", "minimum": 0}}
+        return config
+
+    def testInvalidParameterResponds400BeforeTheQuery(self):
+        checkouts = self.heartbeat()["pool"]["checkouts"]
+        response = self.put("/sensor-event", {"RAW_VALUE": "high"})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_data(as_text=True), "Invalid parameter: RAW_VALUE must be a number\n")
+        self.assertEqual(self.put("/sensor-event", {"RAW_VALUE": -1}).status_code, 400)
+        self.assertEqual(self.put("/sensor-event", {}).get_data(as_text=True), "Missing parameter: RAW_VALUE\n")
+        self.assertEqual(self.heartbeat()["pool"]["checkouts"], checkouts)
+        self.assertEqual(self.countRows(), 0)
+
+    def testInvalidRowOfAListBodyIsNamed(self):
+        response = self.put("/sensor-event", [{"RAW_VALUE": 0.5}, {"RAW_VALUE": "high"}])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_data(as_text=True), "Invalid parameter: RAW_VALUE must be a number in row 1\n")
+        self.assertEqual(self.countRows(), 0)
+
+    def testQueryStringValuesAreConverted(self):
+        self.assertEqual(self.put("/sensor-event?RAW_VALUE=0.5", None).status_code, 200)
+        self.assertEqual(self.execute("SELECT RAW_VALUE, typeof(RAW_VALUE) FROM SENSOR_EVENT"), [(0.5, "real")])
+
+class TestInferredParameters(StandInTestCase):
+    INFERENCE = True
+
+    def createConfig(self):
+        return createConfig([
+            {"path": "sensor-event", "get": {"query": "SELECT * FROM SENSOR_EVENT WHERE ID = %(ID)s;", "users": ["admin"]}}
+        ], schema_cache=os.path.join(self.directory, "schema.json"), parameter_inference=self.INFERENCE)
+
+    def createSchema(self):
+        # SQLite doesn't report column types, so the table's columns are given to the server through its cache.
+        with open(os.path.join(self.directory, "schema.json"), "w") as f:
+            json.dump({"table:SENSOR_EVENT": [{"name": "ID", "type": "LONGLONG", "nullable": False},
+                                              {"name": "RAW_VALUE", "type": "DOUBLE", "nullable": True}]}, f)
+
+    def testParameterIsTypedFromItsColumn(self):
+        response = self.get("/sensor-event?ID=one")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_data(as_text=True), "Invalid parameter: ID must be an integer\n")
+        self.assertEqual(self.get("/sensor-event?ID=1").status_code, 200)
+        document = self.getJson(self.get("/openapi.json"))
+        self.assertEqual(document["paths"]["/sensor-event"]["get"]["parameters"][0]["schema"]["type"], "integer")
+
+class TestInferenceTurnedOff(TestInferredParameters):
+    INFERENCE = False
+
+    def testParameterIsTypedFromItsColumn(self):
+        self.assertEqual(self.get("/sensor-event?ID=one").status_code, 200)
+
+if __name__ == '__main__':
+    unittest.main()
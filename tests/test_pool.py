@@ -0,0 +1,72 @@
+########################################################################################################################
+#
+#  Lemma Logic LLC
+#  __________________
+#
+# Copyright 2018 Lemma Logic LLC
+# All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+########################################################################################################################
+import mysql.connector, unittest
+from support import StandInTestCase, createConfig
+
+def failPing(reconnect=False, **kwargs):
+    raise mysql.connector.InterfaceError(msg="Lost connection")
+
+class TestConnectionPool(StandInTestCase):
+
+    def createConfig(self):
+        return createConfig(database_pool_size=2, database_pool_timeout=0.1, database_pool_ping_interval=0)
+
+    def getPool(self):
+        return self.server.getClusters()[0].primary
+
+    def testConnectionIsReused(self):
+        for value in [0.5, 0.6, 0.7]:
+            self.assertEqual(self.put("/sensor-event", {"RAW_VALUE": value}).status_code, 200)
+        response = self.get("/sensor-event")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row["RAW_VALUE"] for row in self.getJson(response)["data"]], [0.5, 0.6, 0.7])
+        pool = self.heartbeat()["pool"]
+        self.assertEqual(pool["open"], 1)
+        self.assertEqual(pool["in_use"], 0)
+        self.assertGreaterEqual(pool["checkouts"], 4)
+
+    def testExhaustedPoolResponds503(self):
+        pool = self.getPool()
+        connections = [pool.checkout(), pool.checkout()]
+        try:
+            self.assertEqual(self.get("/sensor-event").status_code, 503)
+        finally:
+            for connection in connections:
+                pool.release(connection)
+        self.assertEqual(self.get("/sensor-event").status_code, 200)
+        self.assertEqual(self.heartbeat()["pool"]["timeouts"], 1)
+
+    def testConnectionFailingHealthCheckIsReplaced(self):
+        pool = self.getPool()
+        connection = pool.checkout()
+        connection._connection.ping = failPing
+        pool.release(connection)
+        self.assertEqual(self.get("/sensor-event").status_code, 200)
+        metrics = self.heartbeat()["pool"]
+        self.assertEqual(metrics["discarded"], 1)
+        self.assertEqual(metrics["open"], 1)
+
+    def testBrokenConnectionIsNotReturnedToThePool(self):
+        pool = self.getPool()
+        connection = pool.checkout()
+        connection._broken = True
+        pool.release(connection)
+        self.assertEqual(pool.getMetrics()["open"], 0)
+        self.assertEqual(self.get("/sensor-event").status_code, 200)
+        self.assertEqual(pool.getMetrics()["open"], 1)
+
+if __name__ == '__main__':
+    unittest.main()
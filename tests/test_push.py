@@ -0,0 +1,112 @@
+########################################################################################################################
+#
+#  Lemma Logic LLC
+#  __________________
+#
+# Copyright 2018 Lemma Logic LLC
+# All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+########################################################################################################################
+import json, unittest
+from support import ird, StandInTestCase, createConfig
+
+def encode(data):
+    return json.dumps(data, separators=(",", ":")).encode("utf-8")
+
+class TestSubscription(unittest.TestCase):
+
+    def push(self, subscription, count):
+        return sum([subscription.push(ird.PushEvent(index, "put", encode([index]))) for index in range(1, count + 1)])
+
+    def testDropDiscardsTheOldestEvents(self):
+        subscription = ird.Subscription("sensor-event", buffer_size=2, overflow="drop")
+        self.assertEqual(self.push(subscription, 5), 3)
+        events = subscription.take(encode)
+        self.assertEqual([(event.name, event.data) for event in events], [("dropped", b'{"count":3}'), ("put", b"[4]"), ("put", b"[5]")])
+        self.assertEqual(subscription.take(encode), [])
+
+    def testCoalesceAsksTheClientToResync(self):
+        subscription = ird.Subscription("sensor-event", buffer_size=2, overflow="coalesce")
+        self.push(subscription, 5)
+        events = subscription.take(encode)
+        self.assertEqual([event.name for event in events], ["resync", "put"])
+        self.assertEqual(events[0].sse, b'event: resync\ndata: {"dropped":4}\n\n')
+        self.assertEqual(events[1].sse, b"id: 5\nevent: put\ndata: [5]\n\n")
+
+    def testClosedSubscriptionStopsWaiting(self):
+        subscription = ird.Subscription("sensor-event")
+        subscription.close()
+        self.assertEqual(subscription.wait(5, encode), [])
+        self.assertEqual(subscription.push(ird.PushEvent(1, "put", b"[]")), 0)
+
+class TestEventBroadcaster(unittest.TestCase):
+
+    def testEventsAreOnlyEncodedForSubscribers(self):
+        encoded = []
+        broadcaster = ird.EventBroadcaster(lambda data: encoded.append(data) or encode(data), max_subscribers=1)
+        broadcaster.addChannel("sensor-event")
+        broadcaster.publish("sensor-event", "put", [1])
+        self.assertEqual(encoded, [])
+        subscription = broadcaster.subscribe("sensor-event")
+        with self.assertRaises(ird.TooManySubscribers):
+            broadcaster.subscribe("sensor-event")
+        broadcaster.publish("sensor-event", "put", [2])
+        self.assertEqual([event.id for event in subscription.take(encode)], [1])
+        broadcaster.unsubscribe(subscription)
+        self.assertEqual(broadcaster.getMetrics(), {"sensor-event": {"subscribers": 0, "published": 1, "dropped": 0}})
+
+class TestEventStream(StandInTestCase):
+
+    def createConfig(self):
+        config = createConfig(push={"keepAlive": 0.05, "maxSubscribers": 1})
+        config["endpoints"][0]["put"]["pusherEvents"] = [{"eventName": "insert"}]
+        config["endpoints"].append({"path": "quiet-event", "get": {"query": "SELECT * FROM SENSOR_EVENT;", "users": ["admin"]}})
+        return config
+
+    def subscribe(self, path="/sensor-event/events"):
+        response = self.client.get(path, headers={"Authorization": self.ADMIN}, buffered=False)
+        self.addCleanup(response.close)
+        return response
+
+    def testWritesAreSentToSubscribers(self):
+        response = self.subscribe()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, "text/event-stream")
+        chunks = iter(response.response)
+        self.assertEqual(next(chunks), b"retry: 1000\n\n")
+        self.assertEqual(self.put("/sensor-event", {"RAW_VALUE": 0.5}).status_code, 200)
+        self.assertEqual(next(chunks), b'id: 1\nevent: insert\ndata: [{"RAW_VALUE":0.5}]\n\n')
+        self.assertEqual(next(chunks), b": keep-alive\n\n")
+        self.assertEqual(self.heartbeat()["push"]["sensor-event"]["subscribers"], 1)
+        response.close()
+        self.assertEqual(self.heartbeat()["push"]["sensor-event"]["subscribers"], 0)
+
+    def testFailedWritesAreNotSent(self):
+        chunks = iter(self.subscribe().response)
+        next(chunks)
+        self.assertEqual(self.put("/sensor-event", {}).status_code, 400)
+        self.assertEqual(self.put("/sensor-event", {"RAW_VALUE": 1.5}).status_code, 200)
+        self.assertIn(b"id: 1\n", next(chunks))
+
+    def testSubscriptionsAreLimited(self):
+        self.assertEqual(self.get("/sensor-event/events", self.SENSOR).status_code, 401)
+        self.assertEqual(self.get("/quiet-event/events").status_code, 404)
+        self.subscribe()
+        response = self.get("/sensor-event/events")
+        self.assertEqual(response.status_code, 503)
+        self.assertIn("Retry-After", response.headers)
+
+    def testShutdownEndsTheStreams(self):
+        chunks = iter(self.subscribe().response)
+        next(chunks)
+        self.server.broadcaster.close()
+        self.assertEqual(list(chunks), [])
+
+if __name__ == '__main__':
+    unittest.main()
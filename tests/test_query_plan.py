@@ -0,0 +1,89 @@
+########################################################################################################################
+#
+#  Lemma Logic LLC
+#  __________________
+#
+# Copyright 2018 Lemma Logic LLC
+# All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+########################################################################################################################
+import unittest
+from support import ird, StandInTestCase
+
+class RecordingCursor(object):
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+class RecordingConnection(object):
+    def __init__(self):
+        self.cursors = []
+
+    def cursor(self, prepared=False):
+        self.cursors.append(RecordingCursor())
+        return self.cursors[-1]
+
+class TestQueryPlan(unittest.TestCase):
+
+    def testNamedParametersAreBoundByPosition(self):
+        plan = ird.QueryPlan("SELECT * FROM SENSOR_EVENT WHERE ID > %(ID)s AND RAW_VALUE < %(RAW_VALUE)s AND ID < %(ID)s;")
+        self.assertEqual(plan.sql, "SELECT * FROM SENSOR_EVENT WHERE ID > %s AND RAW_VALUE < %s AND ID < %s")
+        self.assertEqual(plan.parameter_names, ("ID", "RAW_VALUE", "ID"))
+        self.assertEqual(plan.bind({"ID": 3, "RAW_VALUE": 0.5, "OTHER": 1}), (3, 0.5, 3))
+        self.assertTrue(plan.preparable)
+        self.assertTrue(plan.returns_rows)
+
+    def testMissingParameterIsNamed(self):
+        plan = ird.QueryPlan("INSERT INTO SENSOR_EVENT (RAW_VALUE) VALUES (%(RAW_VALUE)s);")
+        with self.assertRaises(ird.MissingParameter) as context:
+            plan.bind({})
+        self.assertEqual(context.exception.args, ("RAW_VALUE",))
+        self.assertFalse(plan.returns_rows)
+
+    def testSeveralStatementsAreNotPrepared(self):
+        self.assertFalse(ird.QueryPlan("DELETE FROM SENSOR_EVENT; DELETE FROM SENSOR_EVENT_ROLLUP;").preparable)
+
+    def testLiteralPercentSignIsNotPrepared(self):
+        self.assertFalse(ird.QueryPlan("SELECT * FROM DEVICE WHERE NAME LIKE 'a%' AND ID = %(ID)s").preparable)
+
+class TestStatementCache(unittest.TestCase):
+
+    def testLeastRecentlyUsedStatementIsClosed(self):
+        raw = RecordingConnection()
+        connection = ird.MySqlConnection(raw, statement_cache_size=2)
+        first = connection.getPreparedCursor("SELECT 1")
+        second = connection.getPreparedCursor("SELECT 2")
+        self.assertIs(connection.getPreparedCursor("SELECT 1"), first)
+        connection.getPreparedCursor("SELECT 3")
+        self.assertTrue(second.closed)
+        self.assertFalse(first.closed)
+        self.assertEqual(len(raw.cursors), 3)
+
+class TestPreparedStatements(StandInTestCase):
+
+    def testRequestsReuseThePreparedStatement(self):
+        for value in [0.1, 0.2, 0.3]:
+            self.assertEqual(self.put("/sensor-event", {"RAW_VALUE": value}).status_code, 200)
+        pool = self.server.getClusters()[0].primary
+        connection = pool.checkout()
+        try:
+            self.assertEqual(list(connection._statements), ["INSERT INTO SENSOR_EVENT (RAW_VALUE) VALUES (%s)"])
+        finally:
+            pool.release(connection)
+
+    def testMissingParameterResponds400(self):
+        response = self.put("/sensor-event", {"VALUE": 0.77})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(b"RAW_VALUE", response.get_data())
+        self.assertEqual(self.countRows(), 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,162 @@
+########################################################################################################################
+#
+#  Lemma Logic LLC
+#  __________________
+#
+# Copyright 2018 Lemma Logic LLC
+# All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+########################################################################################################################
+import threading, unittest
+from support import ird, StandInTestCase, createConfig
+
+class TestRollupEndpoint(StandInTestCase):
+
+    def createConfig(self):
+        return createConfig([
+            {"path": "reading",
+             "get": {"query": "SELECT EVENT_TIME, RAW_VALUE FROM READING WHERE EVENT_TIME >= %(FROM)s AND EVENT_TIME < %(TO)s;", "users": ["admin"],
+                     "rollup": {"sources": ["PUT reading"], "table": "READING_ROLLUP", "value": "RAW_VALUE", "time": "EVENT_TIME",
+                                "key": "DEVICE_ID", "resolutions": ["1m", "1h"], "flushInterval": 60, "maxBuckets": 100}},
+             "put": {"commit": True, "query": "INSERT INTO READING (EVENT_TIME, DEVICE_ID, RAW_VALUE) VALUES (%(EVENT_TIME)s, %(DEVICE_ID)s, %(RAW_VALUE)s);",
+                     "users": ["sensor-account"]}}
+        ])
+
+    def createSchema(self):
+        self.execute("CREATE TABLE READING (ID INTEGER PRIMARY KEY AUTOINCREMENT, EVENT_TIME REAL, DEVICE_ID TEXT, RAW_VALUE REAL)")
+        self.execute("CREATE TABLE READING_ROLLUP (RESOLUTION INT NOT NULL, GROUP_KEY VARCHAR(64) NOT NULL, BUCKET BIGINT NOT NULL, N BIGINT NOT NULL, "
+                     "TOTAL DOUBLE NOT NULL, MIN_VALUE DOUBLE NOT NULL, MAX_VALUE DOUBLE NOT NULL, PRIMARY KEY (RESOLUTION, GROUP_KEY, BUCKET))")
+
+    def setUp(self):
+        StandInTestCase.setUp(self)
+        for event_time, device_id, value in [(1000, "a", 1.0), (1010, "b", 3.0), (1090, "a", 5.0)]:
+            self.assertEqual(self.put("/reading", {"EVENT_TIME": event_time, "DEVICE_ID": device_id, "RAW_VALUE": value}).status_code, 200)
+
+    def getBuckets(self, query):
+        response = self.get("/reading?" + query)
+        self.assertEqual(response.status_code, 200)
+        return [(row["COUNT"], row["SUM"], row["AVG"], row["MIN"], row["MAX"]) for row in self.getJson(response)["data"]]
+
+    def testWritesAreCountedInTheirBuckets(self):
+        self.assertEqual(self.getBuckets("bucket=1m&from=960&to=1140"), [(2, 4.0, 2.0, 1.0, 3.0), (1, 5.0, 5.0, 5.0, 5.0)])
+        self.assertEqual(self.getBuckets("bucket=1h&from=0&to=3600"), [(3, 9.0, 3.0, 1.0, 5.0)])
+
+    def testBucketsAreKeptForEachKey(self):
+        self.assertEqual(self.getBuckets("bucket=1m&from=960&to=1140&DEVICE_ID=a"), [(1, 1.0, 1.0, 1.0, 1.0), (1, 5.0, 5.0, 5.0, 5.0)])
+        self.assertEqual(self.getBuckets("bucket=1m&from=960&to=1140&DEVICE_ID=c"), [])
+
+    def testMultipleOfAStoredResolutionIsSummedFromIt(self):
+        self.assertEqual(self.getBuckets("bucket=2m&from=960&to=1200"), [(2, 4.0, 2.0, 1.0, 3.0), (1, 5.0, 5.0, 5.0, 5.0)])
+
+    def testStoredBucketsAreAddedToPendingOnes(self):
+        self.execute("INSERT INTO READING_ROLLUP VALUES (60, '', 960, 2, 10.0, 0.5, 6.0)")
+        self.assertEqual(self.getBuckets("bucket=1m&from=960&to=1020"), [(4, 14.0, 3.5, 0.5, 6.0)])
+
+    def testOtherBucketsAreAggregatedFromRawRows(self):
+        self.assertEqual(self.getBuckets("bucket=90s&from=990&to=1170"), [(2, 4.0, 2.0, 1.0, 3.0), (1, 5.0, 5.0, 5.0, 5.0)])
+        self.assertEqual(self.getBuckets("bucket=1m&from=960&to=1140&raw=true"), [(2, 4.0, 2.0, 1.0, 3.0), (1, 5.0, 5.0, 5.0, 5.0)])
+
+    def testInvalidRangesRespond400(self):
+        self.assertEqual(self.get("/reading?bucket=1m&from=1200&to=960").status_code, 400)
+        self.assertEqual(self.get("/reading?bucket=1m&from=0&to=86400").status_code, 400)
+        self.assertEqual(self.get("/reading?bucket=soon").status_code, 400)
+
+class FlushingConnection(object):
+    """Holds the upsert of a flush until released, then succeeds or fails."""
+    def __init__(self, fail):
+        self.fail = fail
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def executeMany(self, query, rows, commit=False):
+        self.started.set()
+        self.release.wait(5)
+        if self.fail:
+            raise ird.mysql.connector.Error(msg="Lost connection")
+        return True, None
+
+    def executePlan(self, plan, parameters):
+        return True, None
+
+class SingleConnectionPool(object):
+    def __init__(self, connection):
+        self.connection = connection
+
+    def checkout(self):
+        return self.connection
+
+    def release(self, connection):
+        pass
+
+class TestRollupFlush(unittest.TestCase):
+
+    def flush(self, fail):
+        rollup = ird.Rollup("READING_ROLLUP", "RAW_VALUE", resolutions=["1m"])
+        connection = FlushingConnection(fail)
+        rollup._pool = SingleConnectionPool(connection)
+        rollup.observe([{"RAW_VALUE": 3}])
+        flush = threading.Thread(target=rollup.flush)
+        flush.start()
+        connection.started.wait(5)
+        try:
+            self.assertEqual([row[1:] for row in rollup.readStored(connection, 60, "", 0, 10 ** 10)], [(1, 3.0, 3.0, 3.0)])
+        finally:
+            connection.release.set()
+            flush.join()
+        return rollup
+
+    def testBucketsBeingWrittenStayVisible(self):
+        rollup = self.flush(False)
+        metrics = rollup.getMetrics()
+        self.assertEqual((metrics["pending"], metrics["flushes"], metrics["failures"]), (0, 1, 0))
+
+    def testFailedFlushKeepsItsBuckets(self):
+        rollup = self.flush(True)
+        metrics = rollup.getMetrics()
+        self.assertEqual((metrics["pending"], metrics["failures"]), (1, 1))
+        self.assertEqual([row[1:] for row in rollup.readStored(FlushingConnection(False), 60, "", 0, 10 ** 10)], [(1, 3.0, 3.0, 3.0)])
+
+class TestRollupAggregate(unittest.TestCase):
+
+    def testPartialAggregatesAreCombined(self):
+        rollup = ird.Rollup("READING_ROLLUP", "RAW_VALUE")
+        rows = rollup.aggregate([0, 60, 3600], [1, 2, 3], [1.0, 4.0, 9.0], [1.0, 1.5, 2.0], [1.0, 2.5, 4.0], 3600)
+        self.assertEqual(rows, [(0, 3, 5.0, 1.0, 2.5), (3600, 3, 9.0, 2.0, 4.0)])
+        rollup._numpy = None
+        self.assertEqual(rollup.aggregate([0, 60, 3600], [1, 2, 3], [1.0, 4.0, 9.0], [1.0, 1.5, 2.0], [1.0, 2.5, 4.0], 3600), rows)
+
+class ResultConnection(object):
+    def __init__(self, result):
+        self.result = result
+
+    def executePlan(self, plan, parameters):
+        return True, self.result
+
+class TestRollupRawColumns(unittest.TestCase):
+
+    def testRawColumnsAreFoundByName(self):
+        rollup = ird.Rollup("READING_ROLLUP", "VALUE", raw_time="EVENT_TIME", raw_value="RAW_VALUE")
+        result = ird.QueryResult(["DEVICE_ID", "raw_value", "event_time"], [("a", 2.0, 1000), ("b", 4.0, 1010)])
+        times, counts, totals, minimums, maximums = rollup.readRaw(ResultConnection(result), None, {})
+        self.assertEqual((times, totals), ([1000.0, 1010.0], [2.0, 4.0]))
+
+    def testMissingRawColumnFailsTheRead(self):
+        rollup = ird.Rollup("READING_ROLLUP", "RAW_VALUE", "EVENT_TIME")
+        self.assertIsNone(rollup.readRaw(ResultConnection(ird.QueryResult(["TIME", "RAW_VALUE"], [(1000, 2.0)])), None, {}))
+
+    def testQueryMustNameTheRawColumns(self):
+        rollup = ird.Rollup("READING_ROLLUP", "RAW_VALUE", "EVENT_TIME")
+        rollup.checkQuery("SELECT event_time, raw_value FROM READING")
+        with self.assertRaises(Exception):
+            rollup.checkQuery("SELECT CREATED, RAW_VALUE FROM READING")
+        with self.assertRaises(Exception):
+            ird.Rollup("READING_ROLLUP", "RAW_VALUE").checkQuery("SELECT CREATED, RAW_VALUE FROM READING")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+########################################################################################################################
+#
+#  Lemma Logic LLC
+#  __________________
+#
+# Copyright 2018 Lemma Logic LLC
+# All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+########################################################################################################################
+import unittest
+from support import StandInTestCase, createConfig
+
+class TestRoutes(StandInTestCase):
+
+    def createConfig(self):
+        config = createConfig()
+        config["endpoints"][0]["delete"] = {"commit": True, "query": "DELETE FROM SENSOR_EVENT;", "users": ["admin", "nobody"]}
+        return config
+
+    def testEachMethodIsResolvedToItsPermittedUsers(self):
+        methods = self.server.getRoutes("sensor-event")
+        self.assertEqual(sorted(methods), ["DELETE", "GET", "PUT"])
+        admin, sensor = self.server.authenticate(self.ADMIN), self.server.authenticate(self.SENSOR)
+        self.assertTrue(methods["GET"].permits(admin))
+        self.assertFalse(methods["GET"].permits(sensor))
+        self.assertTrue(methods["PUT"].permits(sensor))
+        self.assertFalse(methods["PUT"].permits(admin))
+        self.assertTrue(methods["DELETE"].permits(admin))
+        self.assertFalse(methods["DELETE"].permits(None))
+        self.assertFalse(methods["GET"].writes)
+        self.assertTrue(methods["PUT"].writes)
+
+    def testUnknownPathResponds404(self):
+        self.assertIsNone(self.server.getRoutes("unknown"))
+        self.assertEqual(self.get("/unknown").status_code, 404)
+
+    def testUnconfiguredMethodResponds405WithAllow(self):
+        response = self.request("POST", "/sensor-event", self.SENSOR, body={"RAW_VALUE": 0.77})
+        self.assertEqual(response.status_code, 405)
+        self.assertEqual(response.headers["Allow"], "DELETE, GET, PUT")
+
+    def testUserMissingFromTheVerbResponds401(self):
+        self.assertEqual(self.get("/sensor-event", self.SENSOR).status_code, 401)
+        self.assertEqual(self.put("/sensor-event", {"RAW_VALUE": 0.77}, self.ADMIN).status_code, 401)
+        self.assertEqual(self.countRows(), 0)
+
+    def testHeadIsAnsweredByGet(self):
+        response = self.request("HEAD", "/sensor-event")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_data(), b"")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+########################################################################################################################
+#
+#  Lemma Logic LLC
+#  __________________
+#
+# Copyright 2018 Lemma Logic LLC
+# All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+########################################################################################################################
+import datetime, importlib, json, unittest
+from support import ird, StandInTestCase
+
+RESULT = ird.QueryResult(["ID", "NAME", "VALUE", "FLAG", "WHEN"],
+                         [(1, u"café", 0.5, True, datetime.datetime(2018, 12, 22, 15, 19, 34)),
+                          (2, None, float("nan"), False, None)])
+ROWS = (b'{"ID":1,"NAME":"caf\\u00e9","VALUE":0.5,"FLAG":true,"WHEN":"Sat, 22 Dec 2018 15:19:34 GMT"},'
+        b'{"ID":2,"NAME":null,"VALUE":NaN,"FLAG":false,"WHEN":null}')
+
+def createAdapters():
+    """A JsonAdapter for each encoder that is installed."""
+    adapters = []
+    for name in ["orjson", "simplejson", "json"]:
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            continue
+        adapters.append(ird.JsonAdapter(name))
+    return adapters
+
+class TestJsonAdapter(unittest.TestCase):
+
+    def testRowsAreWrittenAsObjectsInColumnOrder(self):
+        for adapter in createAdapters():
+            self.assertEqual(adapter.serialize("success", RESULT), b'{"status":"success","data":[' + ROWS + b']}')
+
+    def testExtraKeysFollowTheRows(self):
+        for adapter in createAdapters():
+            self.assertEqual(adapter.serialize("success", ird.QueryResult(["ID"], [(1,)]), {"next": 1}),
+                             b'{"status":"success","data":[{"ID":1}],"next":1}')
+
+    def testEmptyResultAndNoResult(self):
+        for adapter in createAdapters():
+            self.assertEqual(adapter.serialize("success", ird.QueryResult(["ID"], [])), b'{"status":"success","data":[]}')
+            self.assertEqual(json.loads(adapter.serialize("failure").decode("utf-8")), {"status": "failure", "data": None})
+
+    def testPercentSignsAreWrittenAsIs(self):
+        for adapter in createAdapters():
+            body = adapter.serialize("success", ird.QueryResult(["100%", "%s"], [(u"50%", u"%(x)s")]))
+            self.assertEqual(body, b'{"status":"success","data":[{"100%":"50%","%s":"%(x)s"}]}')
+
+    def testColumnarResultSendsTheColumnsOnce(self):
+        for adapter in createAdapters():
+            body = json.loads(adapter.serialize("success", ird.QueryResult(["ID", "RAW_VALUE"], [(1, 0.77), (2, 0.78)]), columnar=True).decode("utf-8"))
+            self.assertEqual(body["data"], {"columns": ["ID", "RAW_VALUE"], "rows": [[1, 0.77], [2, 0.78]]})
+
+    def testChunksAndLinesShareTheRowTemplate(self):
+        for adapter in createAdapters():
+            template = adapter.createRowTemplate(RESULT.column_names)
+            chunks = [adapter.serializeChunk(RESULT.column_names, [row], template=template) for row in RESULT.rows]
+            self.assertEqual(b",".join(chunks), ROWS)
+            lines = adapter.serializeLines(RESULT.column_names, RESULT.rows, template=template)
+            self.assertEqual(lines, ROWS.replace(b"},{", b"}\n{") + b"\n")
+
+    def testEncodedValuesAreBytes(self):
+        for adapter in createAdapters():
+            self.assertEqual(adapter.encode({"ID": 1}), b'{"ID":1}')
+            self.assertIsInstance(adapter.separator, bytes)
+
+class TestSerializedResponses(StandInTestCase):
+
+    def testGetWritesRowsFromTheQueryTuples(self):
+        self.execute("INSERT INTO SENSOR_EVENT (RAW_VALUE, EVENT_TIMESTAMP) VALUES (0.77, '2018-12-22 15:19:34')")
+        response = self.get("/sensor-event")
+        self.assertEqual(response.mimetype, "application/json")
+        self.assertEqual(response.get_data(), b'{"status":"success","data":[{"ID":1,"RAW_VALUE":0.77,"EVENT_TIMESTAMP":"2018-12-22 15:19:34"}]}')
+
+if __name__ == '__main__':
+    unittest.main()
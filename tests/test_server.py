@@ -0,0 +1,202 @@
+########################################################################################################################
+#
+#  Lemma Logic LLC
+#  __________________
+#
+# Copyright 2018 Lemma Logic LLC
+# All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+########################################################################################################################
+import json, os, signal, socket, subprocess, sys, tempfile, time, unittest
+from support import ird, StandInTestCase, createConfig, SENSOR
+try:
+    import httplib
+except ImportError:
+    import http.client as httplib
+
+LAUNCHER = """import sys
+sys.path[:0] = %(path)r
+import standin
+standin.install(%(database)r)
+import ird
+sys.exit(ird.main(%(arguments)r))
+"""
+
+def findFreePort():
+    probe = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    probe.bind(("127.0.0.1", 0))
+    port = probe.getsockname()[1]
+    probe.close()
+    return port
+
+class StreamedBody(object):
+    def __init__(self):
+        self.closed = False
+
+    def __iter__(self):
+        return iter([b"row"])
+
+    def close(self):
+        self.closed = True
+
+class TestRequestTracker(unittest.TestCase):
+
+    def testStreamedResponseCountsUntilItsBodyIsClosed(self):
+        body = StreamedBody()
+        tracker = ird.RequestTracker(lambda environ, start_response: body)
+        response = tracker({}, None)
+        self.assertEqual(tracker.wait(0.01), 1)
+        response.close()
+        self.assertTrue(body.closed)
+        self.assertEqual(tracker.wait(0.01), 0)
+
+    def testFailedRequestIsNotCounted(self):
+        def fail(environ, start_response):
+            raise ValueError("failed")
+        tracker = ird.RequestTracker(fail)
+        self.assertRaises(ValueError, tracker, {}, None)
+        self.assertEqual(tracker.wait(0.01), 0)
+
+    def testWorkerCount(self):
+        self.assertEqual(ird.PreforkServer.countWorkers("3"), 3)
+        self.assertEqual(ird.PreforkServer.countWorkers("0"), 1)
+        self.assertGreaterEqual(ird.PreforkServer.countWorkers("auto"), 1)
+
+class TestDevelopmentServer(StandInTestCase):
+
+    def testServerIsShutDownWhenTheDevelopmentServerReturns(self):
+        config_path = os.path.join(self.directory, "config.json")
+        with open(config_path, "w") as f:
+            json.dump(createConfig(), f)
+        apps = []
+        create_app, run = ird.create_app, ird.Flask.run
+        ird.create_app = lambda *args, **kwargs: apps.append(create_app(*args, **kwargs)) or apps[-1]
+        ird.Flask.run = lambda app, **kwargs: None
+        try:
+            self.assertEqual(ird.main(["--config", config_path, "--loglevel", "ERROR"]), 0)
+        finally:
+            ird.create_app, ird.Flask.run = create_app, run
+        self.assertTrue(apps[0].extensions["ird"]._shut_down)
+
+class BrokenPreforkServer(ird.PreforkServer):
+    """Workers that fail while building their app."""
+    READY_TIMEOUT = 5.0
+
+    def runWorker(self, ready_fd, run_tasks=False):
+        raise RuntimeError("the app could not be built")
+
+@unittest.skipUnless(hasattr(os, "fork"), "the prefork server needs os.fork")
+class TestPreforkWorkers(unittest.TestCase):
+
+    def createServer(self, config_path=None):
+        server = BrokenPreforkServer(config_path, "ERROR", "127.0.0.1", 0, 1, drain_timeout=1.0)
+        server._generation = 1
+        return server
+
+    def testReplacementThatFailsToStartIsNotKept(self):
+        server = self.createServer()
+        pid = os.fork()
+        if pid == 0:
+            os._exit(0)
+        server._workers[pid] = 1
+        server._task_worker = pid
+        deadline = time.time() + 5
+        while pid in server._workers and time.time() < deadline:
+            server.reapWorkers()
+            time.sleep(0.01)
+        self.assertEqual(server._workers, {})
+        self.assertIsNone(server._task_worker)
+
+    def testFailedReloadKeepsTheTaskWorker(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+            json.dump(createConfig(), f)
+        try:
+            server = self.createServer(f.name)
+            server._workers[12345] = 1
+            server._task_worker = 12345
+            server.reload()
+            self.assertEqual(server._generation, 1)
+            self.assertEqual(server._workers, {12345: 1})
+            self.assertEqual(server._task_worker, 12345)
+        finally:
+            os.remove(f.name)
+
+@unittest.skipUnless(hasattr(os, "fork"), "the prefork server needs os.fork")
+class TestPreforkServer(StandInTestCase):
+
+    BUFFERED = {"path": "buffered", "put": {"commit": True, "query": "INSERT INTO SENSOR_EVENT (RAW_VALUE) VALUES (%(RAW_VALUE)s);",
+                                            "users": ["sensor-account"], "buffered": {"flushInterval": 30, "ack": "enqueue"}}}
+
+    def writeConfig(self, endpoints):
+        with open(self.config_path, "w") as f:
+            json.dump(createConfig(endpoints), f)
+
+    def setUp(self):
+        StandInTestCase.setUp(self)
+        self.config_path = os.path.join(self.directory, "config.json")
+        self.writeConfig([self.BUFFERED])
+        self.port = findFreePort()
+        tests_directory = os.path.dirname(os.path.abspath(__file__))
+        path = [os.path.join(os.path.dirname(tests_directory), name) for name in ["ird", "benchmark"]]
+        arguments = ["--config", self.config_path, "--port", str(self.port), "--workers", "2", "--loglevel", "ERROR", "--drain-timeout", "5"]
+        self.master = subprocess.Popen([sys.executable, "-c", LAUNCHER % {"path": path, "database": self.database, "arguments": arguments}])
+
+    def tearDown(self):
+        if self.master.poll() is None:
+            # Killing the master would leave its workers running, so it is asked to stop them first.
+            self.master.send_signal(signal.SIGTERM)
+            deadline = time.time() + 15
+            while self.master.poll() is None and time.time() < deadline:
+                time.sleep(0.1)
+            if self.master.poll() is None:
+                self.master.kill()
+                self.master.wait()
+        StandInTestCase.tearDown(self)
+
+    def request(self, method, path, body=None):
+        connection = httplib.HTTPConnection("127.0.0.1", self.port, timeout=10)
+        try:
+            headers = {"Authorization": SENSOR, "Content-Type": "application/json"}
+            connection.request(method, path, None if body is None else json.dumps(body), headers)
+            response = connection.getresponse()
+            response.read()
+            return response.status
+        finally:
+            connection.close()
+
+    def waitForStatus(self, method, path, status, body=None):
+        deadline = time.time() + 15
+        while True:
+            try:
+                if self.request(method, path, body) == status:
+                    return
+            except (socket.error, httplib.HTTPException):
+                pass
+            if time.time() > deadline:
+                self.fail("The server did not answer " + method + " " + path + " with " + str(status))
+            time.sleep(0.1)
+
+    def testStopWritesBufferedRows(self):
+        self.waitForStatus("GET", "/heartbeat", 200)
+        self.assertEqual(self.request("PUT", "/buffered", {"RAW_VALUE": 0.77}), 202)
+        self.assertEqual(self.countRows(), 0)
+        self.master.send_signal(signal.SIGTERM)
+        self.assertEqual(self.master.wait(), 0)
+        self.assertEqual(self.countRows(), 1)
+
+    def testReloadServesTheNewConfig(self):
+        self.waitForStatus("GET", "/heartbeat", 200)
+        self.assertEqual(self.request("PUT", "/sensor-event", {"RAW_VALUE": 0.77}), 404)
+        self.writeConfig(createConfig()["endpoints"] + [self.BUFFERED])
+        self.master.send_signal(signal.SIGHUP)
+        self.waitForStatus("PUT", "/sensor-event", 200, {"RAW_VALUE": 0.77})
+        self.assertIsNone(self.master.poll())
+
+if __name__ == '__main__':
+    unittest.main()
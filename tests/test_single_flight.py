@@ -0,0 +1,135 @@
+########################################################################################################################
+#
+#  Lemma Logic LLC
+#  __________________
+#
+# Copyright 2018 Lemma Logic LLC
+# All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+########################################################################################################################
+import threading, unittest
+from support import ird, StandInTestCase, createConfig
+
+class TestSingleFlight(unittest.TestCase):
+
+    def testFollowersShareTheLeadersResponse(self):
+        single_flight = ird.SingleFlight(timeout=5)
+        flight, leader = single_flight.join("key")
+        self.assertTrue(leader)
+        follower, leads = single_flight.join("key")
+        self.assertIs(follower, flight)
+        self.assertFalse(leads)
+        landed = []
+        single_flight.onLanding(flight, lambda: landed.append(True))
+        single_flight.land("key", flight, ird.Response(b"[1]", 200, mimetype="application/json"))
+        self.assertEqual(landed, [True])
+        response = single_flight.wait(follower)
+        self.assertEqual((response.status_code, response.get_data(), response.mimetype), (200, b"[1]", "application/json"))
+        # Nothing is kept once the flight has landed.
+        self.assertTrue(single_flight.join("key")[1])
+        self.assertEqual(single_flight.getMetrics(), {"in_flight": 1, "queries": 2, "coalesced": 1, "timeouts": 0})
+
+    def testFollowersRunTheQueryWithoutAResponse(self):
+        single_flight = ird.SingleFlight(timeout=5)
+        flight, leader = single_flight.join("key")
+        single_flight.land("key", flight, None)
+        self.assertIsNone(single_flight.wait(flight))
+
+    def testWaitGivesUpAfterTheTimeout(self):
+        single_flight = ird.SingleFlight(timeout=0.01)
+        flight, leader = single_flight.join("key")
+        self.assertIsNone(single_flight.wait(single_flight.join("key")[0]))
+        self.assertEqual(single_flight.getMetrics()["timeouts"], 1)
+
+class TestCoalescedRequests(StandInTestCase):
+
+    def createConfig(self):
+        config = createConfig()
+        config["endpoints"][0]["get"]["singleFlight"] = {"timeout": 5}
+        config["endpoints"].append({"path": "larger-event", "get": {"query": "SELECT * FROM SENSOR_EVENT WHERE RAW_VALUE > %(MINIMUM)s;",
+                                                                    "users": ["admin"], "singleFlight": True}})
+        return config
+
+    def setUp(self):
+        StandInTestCase.setUp(self)
+        self.execute("INSERT INTO SENSOR_EVENT (RAW_VALUE) VALUES (0.5)")
+        self.queries = []
+        self.release = threading.Event()
+        self._executePlan = ird.MySqlConnection.executePlan
+        test = self
+
+        def executePlan(connection, plan, *args, **kwargs):
+            # The first query waits until the test releases it, so other requests arrive while it is running.
+            if plan.statement_type == "SELECT":
+                test.queries.append(plan.sql)
+                if len(test.queries) == 1:
+                    test.release.wait(5)
+            return test._executePlan(connection, plan, *args, **kwargs)
+
+        ird.MySqlConnection.executePlan = executePlan
+
+    def tearDown(self):
+        self.release.set()
+        ird.MySqlConnection.executePlan = self._executePlan
+        StandInTestCase.tearDown(self)
+
+    def getInThread(self, responses, path="/sensor-event"):
+        client = self.app.test_client()
+
+        def get():
+            response = client.get(path, headers={"Authorization": self.ADMIN})
+            responses.append((response.status_code, response.get_data()))
+
+        thread = threading.Thread(target=get)
+        thread.start()
+        return thread
+
+    def getFlightMetrics(self):
+        return self.server.getSingleFlightMetrics()["sensor-event"]
+
+    def testIdenticalRequestsShareOneQuery(self):
+        responses = []
+        threads = [self.getInThread(responses)]
+        self.waitFor(lambda: len(self.queries) == 1)
+        threads.extend([self.getInThread(responses) for _ in range(4)])
+        self.waitFor(lambda: self.getFlightMetrics()["coalesced"] == 4)
+        self.release.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(len(self.queries), 1)
+        self.assertEqual(len(set(responses)), 1)
+        self.assertEqual(responses[0][0], 200)
+        self.assertEqual(self.getFlightMetrics(), {"in_flight": 0, "queries": 1, "coalesced": 4, "timeouts": 0})
+
+    def testWriteStartsANewQuery(self):
+        responses = []
+        leader = self.getInThread(responses)
+        self.waitFor(lambda: len(self.queries) == 1)
+        self.assertEqual(self.put("/sensor-event", {"RAW_VALUE": 1.5}).status_code, 200)
+        # Requests after the write must see it, so they don't join the query that started before it.
+        response = self.get("/sensor-event")
+        self.assertEqual([row["RAW_VALUE"] for row in self.getJson(response)["data"]], [0.5, 1.5])
+        self.release.set()
+        leader.join(5)
+        self.assertEqual(len(self.queries), 2)
+        self.assertEqual(self.getFlightMetrics()["coalesced"], 0)
+
+    def testDifferentParametersAreNotCoalesced(self):
+        responses = []
+        leader = self.getInThread(responses, "/larger-event?MINIMUM=0")
+        self.waitFor(lambda: len(self.queries) == 1)
+        response = self.get("/larger-event?MINIMUM=1")
+        self.assertEqual((response.status_code, self.getJson(response)["data"]), (200, None))
+        self.release.set()
+        leader.join(5)
+        self.assertEqual(len(self.queries), 2)
+        self.assertEqual(self.server.getSingleFlightMetrics()["larger-event"]["coalesced"], 0)
+
+if __name__ == '__main__':
+    unittest.main()
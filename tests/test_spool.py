@@ -0,0 +1,144 @@
+########################################################################################################################
+#
+#  Lemma Logic LLC
+#  __________________
+#
+# Copyright 2018 Lemma Logic LLC
+# All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+########################################################################################################################
+import json, mysql.connector, os, shutil, tempfile, unittest
+from support import ird, StandInTestCase, createConfig
+
+def failCheckout(*args, **kwargs):
+    raise mysql.connector.InterfaceError(msg="Can't connect to MySQL server")
+
+class TestWriteSpool(StandInTestCase):
+
+    def createConfig(self):
+        return createConfig([
+            {"path": "event",
+             "put": {"commit": True, "query": "INSERT INTO EVENT (RAW_VALUE, IDEMPOTENCY_KEY) VALUES (%(RAW_VALUE)s, %(IDEMPOTENCY_KEY)s);",
+                     "users": ["sensor-account"], "spool": {"directory": self.getSpoolDirectory(), "replayRate": 0, "syncInterval": 0}}}
+        ])
+
+    def createSchema(self):
+        self.execute("CREATE TABLE EVENT (ID INTEGER PRIMARY KEY AUTOINCREMENT, RAW_VALUE REAL, IDEMPOTENCY_KEY TEXT UNIQUE)")
+
+    def getSpoolDirectory(self):
+        return os.path.join(self.directory, "spool")
+
+    def getSpoolMetrics(self):
+        return self.heartbeat()["spools"]["PUT event"]
+
+    def getEvents(self):
+        return self.execute("SELECT RAW_VALUE, IDEMPOTENCY_KEY FROM EVENT ORDER BY ID")
+
+    def testWritesAreAcceptedThenReplayed(self):
+        response = self.put("/event", {"RAW_VALUE": 0.5})
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(self.put("/event", [{"RAW_VALUE": 1.5}, {"RAW_VALUE": 2.5}]).status_code, 202)
+        self.waitFor(lambda: self.countRows("EVENT") == 3)
+        self.assertEqual(self.getEvents(), [(0.5, None), (1.5, None), (2.5, None)])
+        self.waitFor(lambda: self.getSpoolMetrics()["pending"] == 0)
+        self.assertEqual(self.getSpoolMetrics()["replayed"], 3)
+
+    def testRepeatedIdempotencyKeyIsNotSpooledAgain(self):
+        for _ in range(2):
+            self.assertEqual(self.put("/event", {"RAW_VALUE": 0.5}, headers={"Idempotency-Key": "reading-1"}).status_code, 202)
+        self.assertEqual(self.put("/event", [{"RAW_VALUE": 1.5}, {"RAW_VALUE": 2.5}], headers={"Idempotency-Key": "batch-1"}).status_code, 202)
+        self.assertEqual(self.put("/event", [{"RAW_VALUE": 1.5}, {"RAW_VALUE": 2.5}], headers={"Idempotency-Key": "batch-1"}).status_code, 202)
+        self.waitFor(lambda: self.countRows("EVENT") == 3)
+        self.assertEqual(self.getEvents(), [(0.5, "reading-1"), (1.5, "batch-1/0"), (2.5, "batch-1/1")])
+        metrics = self.getSpoolMetrics()
+        self.assertEqual((metrics["appended"], metrics["duplicates"]), (3, 2))
+
+    def testRowsAreReplayedAfterARestart(self):
+        pool = self.server.getClusters()[0].primary
+        pool.checkout = failCheckout
+        for value in [0.5, 1.5]:
+            self.assertEqual(self.put("/event", {"RAW_VALUE": value}, headers={"Idempotency-Key": str(value)}).status_code, 202)
+        self.waitFor(lambda: self.getSpoolMetrics()["retries"] > 0)
+        self.assertEqual(self.getSpoolMetrics()["pending"], 2)
+        self.stopApp()
+        self.assertEqual(self.countRows("EVENT"), 0)
+        self.startApp()
+        self.waitFor(lambda: self.countRows("EVENT") == 2)
+        self.assertEqual(self.getEvents(), [(0.5, "0.5"), (1.5, "1.5")])
+        # The keys of the rows left in the spool are remembered across the restart.
+        self.assertEqual(self.put("/event", {"RAW_VALUE": 0.5}, headers={"Idempotency-Key": "0.5"}).status_code, 202)
+        self.assertEqual(self.getSpoolMetrics()["duplicates"], 1)
+
+    def testRefusedRowsAreSetAside(self):
+        self.execute("INSERT INTO EVENT (RAW_VALUE, IDEMPOTENCY_KEY) VALUES (0.5, 'reading-1')")
+        self.assertEqual(self.put("/event", [{"RAW_VALUE": 0.5}], headers={"Idempotency-Key": "reading"}).status_code, 202)
+        self.assertEqual(self.put("/event", {"RAW_VALUE": 0.5}, headers={"Idempotency-Key": "reading-1"}).status_code, 202)
+        self.assertEqual(self.put("/event", {"RAW_VALUE": 1.5}).status_code, 202)
+        self.waitFor(lambda: self.getSpoolMetrics()["pending"] == 0)
+        self.assertEqual(self.getSpoolMetrics()["rejected"], 1)
+        self.assertEqual(self.countRows("EVENT"), 3)
+        with open(os.path.join(self.getSpoolDirectory(), "0", "rejected.ndjson")) as f:
+            rejected = [json.loads(line) for line in f]
+        self.assertEqual(rejected, [{"shard": None, "row": {"RAW_VALUE": 0.5, "IDEMPOTENCY_KEY": "reading-1"}}])
+
+class TestSpoolCapacity(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        plan = ird.QueryPlan("INSERT INTO EVENT (RAW_VALUE) VALUES (%(RAW_VALUE)s);")
+        # Two segments of five rows each; the replayer isn't started, so nothing is freed.
+        self.spool = ird.WriteSpool("PUT event", self.directory, plan, segment_size=128, max_bytes=256)
+        self.spool._directory = self.directory
+
+    def tearDown(self):
+        for segment in self.spool._segments.values():
+            segment.close()
+        shutil.rmtree(self.directory)
+
+    def submit(self, count, key=None):
+        return self.spool.submit([{"RAW_VALUE": value} for value in range(count)], [None] * count, key)
+
+    def testRequestThatDoesNotFitAppendsNothing(self):
+        self.assertTrue(self.submit(8))
+        with self.assertRaises(ird.IngestQueueFull):
+            self.submit(3, "b")
+        self.assertEqual(self.spool.getMetrics()["appended"], 8)
+        self.assertTrue(self.submit(2, "b"))
+        self.assertEqual(self.spool.getMetrics()["appended"], 10)
+        self.assertEqual(len(self.spool.readBatch()), 10)
+
+    def testRowLargerThanASegmentAppendsNothing(self):
+        with self.assertRaises(ird.UploadTooLarge):
+            self.spool.submit([{"RAW_VALUE": 1}, {"RAW_VALUE": "x" * 200}], [None, None], "batch")
+        self.assertEqual(self.spool.getMetrics()["appended"], 0)
+        self.assertTrue(self.submit(1, "batch"))
+
+class TestSpoolSegment(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def testReadStopsAtARecordCutShort(self):
+        path = os.path.join(self.directory, "000000000000.seg")
+        segment = ird.SpoolSegment(path, 64)
+        end = segment.append(0, b"first")
+        second = segment.append(end, b"second")
+        self.assertIsNone(segment.append(second, b"x" * 64))
+        segment._map[end + ird.SpoolSegment.HEADER.size] = ord("S")
+        self.assertEqual([payload for offset, payload in segment.read(0)], [b"first"])
+        segment.close()
+        segment = ird.SpoolSegment(path, 64)
+        self.assertEqual(segment.read(0), [(end, b"first")])
+        segment.close()
+
+if __name__ == '__main__':
+    unittest.main()
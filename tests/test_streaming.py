@@ -0,0 +1,60 @@
+########################################################################################################################
+#
+#  Lemma Logic LLC
+#  __________________
+#
+# Copyright 2018 Lemma Logic LLC
+# All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+########################################################################################################################
+import json, unittest
+from support import StandInTestCase, createConfig
+
+SELECT = "SELECT ID, RAW_VALUE FROM SENSOR_EVENT;"
+
+class TestStreaming(StandInTestCase):
+
+    def createConfig(self):
+        return createConfig([
+            {"path": "pages", "get": {"query": SELECT, "users": ["admin"], "stream": {"format": "json", "fetchSize": 2},
+                                      "pagination": {"key": "ID", "limit": 2, "maxLimit": 3}}},
+            {"path": "lines", "get": {"query": SELECT, "users": ["admin"], "stream": {"format": "ndjson", "fetchSize": 2}}}
+        ])
+
+    def setUp(self):
+        StandInTestCase.setUp(self)
+        for value in range(5):
+            self.execute("INSERT INTO SENSOR_EVENT (RAW_VALUE) VALUES (?)", (value / 10.0,))
+
+    def getPage(self, query=""):
+        response = self.get("/pages" + query)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["Cache-Control"], "no-cache, no-store, no-transform, max-age=0")
+        page = self.getJson(response)
+        return [row["ID"] for row in page["data"]], page["next"]
+
+    def testPagesFollowTheKey(self):
+        self.assertEqual(self.getPage(), ([1, 2], 2))
+        self.assertEqual(self.getPage("?after=2"), ([3, 4], 4))
+        self.assertEqual(self.getPage("?after=4"), ([5], None))
+
+    def testLimitIsCappedByMaxLimit(self):
+        self.assertEqual(self.getPage("?limit=10"), ([1, 2, 3], 3))
+        self.assertEqual(self.getPage("?limit=1&after=3"), ([4], 4))
+
+    def testNdjsonWritesOneRowPerLine(self):
+        response = self.get("/lines")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, "application/x-ndjson")
+        lines = response.get_data().decode("utf-8").splitlines()
+        self.assertEqual([json.loads(line) for line in lines],
+                         [{"ID": index + 1, "RAW_VALUE": index / 10.0} for index in range(5)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,153 @@
+########################################################################################################################
+#
+#  Lemma Logic LLC
+#  __________________
+#
+# Copyright 2018 Lemma Logic LLC
+# All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+########################################################################################################################
+import calendar, datetime, mysql.connector, threading, unittest
+from support import ird, StandInTestCase, createConfig
+
+def countCall(server):
+    server.task_calls = getattr(server, "task_calls", 0) + 1
+
+def timestamp(*fields):
+    return calendar.timegm(datetime.datetime(*fields).timetuple())
+
+class TestCronSchedule(unittest.TestCase):
+
+    def assertNextTime(self, expression, after, expected):
+        self.assertEqual(ird.CronSchedule(expression).nextTime(timestamp(*after)), timestamp(*expected))
+
+    def testNextTime(self):
+        self.assertNextTime("0 3 * * *", (2026, 10, 18, 0, 0), (2026, 10, 18, 3, 0))
+        self.assertNextTime("0 3 * * *", (2026, 10, 18, 3, 0), (2026, 10, 19, 3, 0))
+        self.assertNextTime("*/15 * * * *", (2026, 10, 18, 10, 7, 30), (2026, 10, 18, 10, 15))
+        self.assertNextTime("30 8-17/4 * * *", (2026, 10, 18, 12, 31), (2026, 10, 18, 16, 30))
+        self.assertNextTime("0 0 1 2 *", (2026, 10, 18, 0, 0), (2027, 2, 1, 0, 0))
+        self.assertNextTime("59 23 31 12 *", (2026, 12, 31, 23, 59), (2027, 12, 31, 23, 59))
+
+    def testDaysOfWeek(self):
+        # 2026-10-18 is a Sunday, which is 0 or 7.
+        self.assertNextTime("0 0 * * 1", (2026, 10, 18, 12, 0), (2026, 10, 19, 0, 0))
+        self.assertNextTime("0 0 * * 7", (2026, 10, 12, 0, 0), (2026, 10, 18, 0, 0))
+        self.assertNextTime("0 0 * * 1-5", (2026, 10, 16, 12, 0), (2026, 10, 19, 0, 0))
+        # With both restricted, either the day of the month or the day of the week matches.
+        self.assertNextTime("0 0 20 * 6", (2026, 10, 18, 12, 0), (2026, 10, 20, 0, 0))
+        self.assertNextTime("0 0 30 * 1", (2026, 10, 18, 12, 0), (2026, 10, 19, 0, 0))
+
+    def testInvalidExpressions(self):
+        for expression in ["* * * *", "60 * * * *", "* * 0 * *", "5-1 * * * *", "*/0 * * * *", "a * * * *"]:
+            with self.assertRaises(Exception):
+                ird.CronSchedule(expression)
+        with self.assertRaises(Exception):
+            ird.CronSchedule("0 0 31 2 *").nextTime(0)
+
+class BlockingAction(object):
+    def __init__(self):
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.runs = 0
+
+    def run(self, scheduler):
+        self.runs += 1
+        self.started.set()
+        self.release.wait(5)
+        return "success"
+
+class TestScheduledTask(unittest.TestCase):
+
+    def testIntervalSchedule(self):
+        self.assertEqual(ird.IntervalSchedule(600).nextTime(1000.5), 1600.5)
+
+    def testJitterDelaysTheNextRun(self):
+        task = ird.ScheduledTask("jittered", BlockingAction(), ird.IntervalSchedule(60), jitter=5)
+        for _ in range(20):
+            task.scheduleNext(1000)
+            self.assertTrue(1060 <= task.next_run <= 1065)
+
+    def testRunningTaskIsNotStartedAgain(self):
+        task = ird.ScheduledTask("purge", BlockingAction())
+        self.assertTrue(task.begin())
+        self.assertFalse(task.begin())
+        task.run(None)
+        self.assertTrue(task.begin())
+        metrics = task.getMetrics()
+        self.assertEqual((metrics["success"], metrics["overlap"]), (1, 1))
+
+    def testSchedulerSkipsRunsOfABusyTask(self):
+        action = BlockingAction()
+        scheduler = ird.TaskScheduler(None, workers=2)
+        scheduler.add(ird.ScheduledTask("slow", action, ird.IntervalSchedule(0.02), run_at_start=True))
+        scheduler.start()
+        try:
+            self.assertTrue(action.started.wait(5))
+            threading.Event().wait(0.2)
+            action.release.set()
+        finally:
+            scheduler.stop(5)
+        metrics = scheduler.getMetrics()["slow"]
+        self.assertEqual(action.runs, metrics["success"])
+        self.assertGreater(metrics["overlap"], 0)
+
+    def testFailingTaskIsCounted(self):
+        task = ird.ScheduledTask("broken", ird.CallableTask("no_such_module:run"))
+        task.begin()
+        task.run(None)
+        self.assertEqual(task.getMetrics()["failure"], 1)
+        self.assertFalse(task.getMetrics()["running"])
+
+class TestTaskScheduler(StandInTestCase):
+    LOCKED = False
+
+    def createConfig(self):
+        return createConfig(tasks=[
+            {"name": "count-calls", "callable": "test_tasks:countCall"},
+            {"name": "purge", "every": "1h", "runAtStart": True, "repeat": True,
+             "query": "DELETE FROM SENSOR_EVENT WHERE ID IN (SELECT ID FROM SENSOR_EVENT WHERE RAW_VALUE < 0 LIMIT 2)"}
+        ])
+
+    def createSchema(self):
+        for value in [-1, -2, -3, -4, -5, 1]:
+            self.execute("INSERT INTO SENSOR_EVENT (RAW_VALUE) VALUES (?)", (value,))
+        # SQLite has no named locks, so the task connections get stand-ins for them.
+        connect = mysql.connector.connect
+        locked = self.LOCKED
+
+        def connectWithLocks(**kwargs):
+            connection = connect(**kwargs)
+            connection._sqlite.create_function("GET_LOCK", 2, lambda name, timeout: 0 if locked else 1)
+            connection._sqlite.create_function("RELEASE_LOCK", 1, lambda name: 1)
+            return connection
+
+        mysql.connector.connect = connectWithLocks
+
+    def getTaskMetrics(self, name):
+        return self.heartbeat()["tasks"][name]
+
+    def testTasksRunAtStart(self):
+        self.waitFor(lambda: getattr(self.server, "task_calls", 0) == 1)
+        self.waitFor(lambda: self.getTaskMetrics("purge")["success"] == 1)
+        self.assertEqual(self.execute("SELECT RAW_VALUE FROM SENSOR_EVENT"), [(1,)])
+        metrics = self.getTaskMetrics("purge")
+        self.assertGreater(metrics["next_run"], metrics["last_started"] + 3000)
+        # Tasks without a schedule only run at start.
+        self.assertIsNone(self.getTaskMetrics("count-calls")["next_run"])
+
+class TestLockedTask(TestTaskScheduler):
+    LOCKED = True
+
+    def testTasksRunAtStart(self):
+        self.waitFor(lambda: self.getTaskMetrics("purge")["locked"] == 1)
+        self.assertEqual(self.countRows(), 6)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+########################################################################################################################
+#
+#  Lemma Logic LLC
+#  __________________
+#
+# Copyright 2018 Lemma Logic LLC
+# All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+########################################################################################################################
+import datetime, gzip, io, unittest, zlib
+from support import ird, StandInTestCase, createConfig
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+SELECT = "SELECT ID, RAW_VALUE FROM SENSOR_EVENT ORDER BY ID;"
+INSERT = "INSERT INTO SENSOR_EVENT (RAW_VALUE) VALUES (%(RAW_VALUE)s);"
+
+class TestBinaryAdapters(unittest.TestCase):
+
+    RESULT = ird.QueryResult(["ID", "NAME"], [(1, u"a"), (2, None)])
+
+    @unittest.skipIf(msgpack is None, "msgpack is not installed")
+    def testMessagePackRowsAreMaps(self):
+        adapter = ird.MessagePackAdapter()
+        body = msgpack.unpackb(adapter.serialize("success", self.RESULT, {"next": 2}), raw=False)
+        self.assertEqual(body, {"status": "success", "data": [{"ID": 1, "NAME": u"a"}, {"ID": 2, "NAME": None}], "next": 2})
+        self.assertEqual(list(body["data"][0]), ["ID", "NAME"])
+
+    @unittest.skipIf(cbor2 is None, "cbor2 is not installed")
+    def testCborRowsAreMaps(self):
+        adapter = ird.CborAdapter()
+        body = cbor2.loads(adapter.serialize("success", self.RESULT))
+        self.assertEqual(body, {"status": "success", "data": [{"ID": 1, "NAME": u"a"}, {"ID": 2, "NAME": None}]})
+        lines = adapter.serializeLines(self.RESULT.column_names, self.RESULT.rows)
+        stream = io.BytesIO(lines)
+        self.assertEqual([cbor2.load(stream), cbor2.load(stream)], body["data"])
+
+    @unittest.skipIf(cbor2 is None, "cbor2 is not installed")
+    def testCborDatetimesAreUtc(self):
+        adapter = ird.CborAdapter()
+        result = ird.QueryResult(["TIME"], [(datetime.datetime(2018, 12, 22, 15, 19, 34),)])
+        moment = cbor2.loads(adapter.serialize("success", result))["data"][0]["TIME"]
+        self.assertEqual(moment.utcoffset(), datetime.timedelta(0))
+        self.assertEqual(moment.replace(tzinfo=None), datetime.datetime(2018, 12, 22, 15, 19, 34))
+
+class TestWireFormats(StandInTestCase):
+
+    def createConfig(self):
+        return createConfig([
+            {"path": "sensor-event",
+             "get": {"query": SELECT, "users": ["admin"]},
+             "put": {"commit": True, "query": INSERT, "users": ["sensor-account"]}},
+            {"path": "stream", "get": {"query": SELECT, "users": ["admin"], "stream": {"format": "json", "fetchSize": 10}}}
+        ], compression={"minimumSize": 200})
+
+    def seed(self, count):
+        for value in range(count):
+            self.execute("INSERT INTO SENSOR_EVENT (RAW_VALUE) VALUES (?)", (value + 0.5,))
+
+    @unittest.skipIf(msgpack is None, "msgpack is not installed")
+    def testAcceptPicksMessagePack(self):
+        self.seed(2)
+        response = self.get("/sensor-event", headers={"Accept": "application/msgpack"})
+        self.assertEqual(response.mimetype, "application/msgpack")
+        self.assertEqual(msgpack.unpackb(response.get_data(), raw=False)["data"], [{"ID": 1, "RAW_VALUE": 0.5}, {"ID": 2, "RAW_VALUE": 1.5}])
+
+    @unittest.skipIf(msgpack is None, "msgpack is not installed")
+    def testStreamedMessagePackIsASequenceOfRows(self):
+        self.seed(3)
+        response = self.get("/stream", headers={"Accept": "application/msgpack"})
+        unpacker = msgpack.Unpacker(raw=False)
+        unpacker.feed(response.get_data())
+        self.assertEqual([row["ID"] for row in unpacker], [1, 2, 3])
+
+    @unittest.skipIf(cbor2 is None, "cbor2 is not installed")
+    def testCborBodyIsParsed(self):
+        response = self.request("PUT", "/sensor-event", self.SENSOR, headers={"Content-Type": "application/cbor"}, data=cbor2.dumps({"RAW_VALUE": 0.77}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.execute("SELECT RAW_VALUE FROM SENSOR_EVENT"), [(0.77,)])
+
+    def testLargeResponseIsCompressed(self):
+        self.seed(50)
+        response = self.get("/sensor-event", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertEqual(len(self.getJson(self.get("/sensor-event"))["data"]), 50)
+        self.assertEqual(gzip.GzipFile(fileobj=io.BytesIO(response.get_data())).read(), self.get("/sensor-event").get_data())
+
+    def testSmallResponseIsNotCompressed(self):
+        self.seed(1)
+        response = self.get("/sensor-event", headers={"Accept-Encoding": "gzip"})
+        self.assertNotIn("Content-Encoding", response.headers)
+        self.assertEqual(response.headers["Vary"], "Accept-Encoding")
+
+    def testStreamIsCompressedChunkByChunk(self):
+        self.seed(50)
+        response = self.get("/stream", headers={"Accept-Encoding": "deflate"})
+        self.assertEqual(response.headers["Content-Encoding"], "deflate")
+        self.assertEqual(zlib.decompress(response.get_data()), self.get("/stream").get_data())
+
+class TestBodyLimit(StandInTestCase):
+
+    def createConfig(self):
+        return createConfig(max_body_bytes=32)
+
+    def testBodyLargerThanTheLimitResponds413(self):
+        self.assertEqual(self.put("/sensor-event", {"RAW_VALUE": 0.77, "PADDING": "x" * 32}).status_code, 413)
+        self.assertEqual(self.put("/sensor-event", {"RAW_VALUE": 0.77}).status_code, 200)
+        self.assertEqual(self.countRows(), 1)
+
+if __name__ == '__main__':
+    unittest.main()